@@ -1,5 +1,10 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
-from datetime import datetime
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, Response, \
+    stream_with_context
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+import csv
+import io
+import json
 from flask_login import login_required, current_user
 from functools import wraps
 from extensions import db, bcrypt
@@ -9,6 +14,11 @@ from models import OrderItemNew, User, MenuItem, Event, Category
 from sqlalchemy import func, extract, cast, Date
 from extensions import bcrypt  # using your bcrypt instance
 from app1 import db
+import catalog_cache
+import pagination
+import menu_io
+import menu_recommender
+import recommender_sync
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -28,12 +38,167 @@ def admin_required(func):
     return wrapper
 
 
+# -----------------------
+# Paginated listings
+# -----------------------
+# Each listing is one filtered query paged by an indexed key (see pagination.py).
+# The HTML pages render one bounded page (``?cursor=`` picks it) and get ``page``
+# and ``next_cursor``; the JSON APIs below page through the same listings.
+# Template follow-up: the admin templates don't render a "next" link from
+# ``next_cursor`` yet, so until they do only the first page is reachable by clicking.
+ORDER_STATUSES = ["processing", "closed", "cancelled"]
+
+
+def _parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"{name} must be YYYY-MM-DD, got {value!r}")
+
+
+def users_query(args):
+    query = User.query
+    if args.get("role"):
+        query = query.filter(User.role == args["role"])
+    if args.get("q"):
+        query = query.filter(User.email.startswith(args["q"].strip().lower()))
+    return query
+
+
+def users_page(args):
+    return pagination.keyset_page(users_query(args), [User.user_id], args.get("cursor"),
+                                  pagination.parse_limit(args.get("limit")))
+
+
+def menu_items_query(args):
+    query = MenuItem.query.options(joinedload(MenuItem.category))
+    if args.get("category_id"):
+        query = query.filter(MenuItem.category_id == int(args["category_id"]))
+    return query
+
+
+def menu_items_page(args):
+    return pagination.keyset_page(menu_items_query(args), [MenuItem.menu_items_id], args.get("cursor"),
+                                  pagination.parse_limit(args.get("limit")))
+
+
+def orders_query(args, query=None):
+    """Orders filtered by ``status``, ``user_id`` and a ``date_from``/``date_to`` range (inclusive)."""
+    query = query if query is not None else OrderItemNew.query
+    if args.get("status"):
+        if args["status"] not in ORDER_STATUSES:
+            raise ValueError(f"Unknown status {args['status']!r}")
+        query = query.filter(OrderItemNew.status == args["status"])
+    if args.get("user_id"):
+        query = query.filter(OrderItemNew.user_id == int(args["user_id"]))
+    date_from = _parse_date(args.get("date_from"), "date_from")
+    date_to = _parse_date(args.get("date_to"), "date_to")
+    if date_from:
+        query = query.filter(OrderItemNew.order_date >= date_from)
+    if date_to:
+        query = query.filter(OrderItemNew.order_date < date_to + timedelta(days=1))
+    return query
+
+
+def orders_listing_query(args):
+    return orders_query(args, OrderItemNew.query.options(
+        joinedload(OrderItemNew.user),
+        joinedload(OrderItemNew.menu_item)
+    ))
+
+
+def orders_page(args):
+    # Newest first; id breaks ties between orders placed in the same instant
+    return pagination.keyset_page(orders_listing_query(args), [OrderItemNew.order_date, OrderItemNew.id],
+                                  args.get("cursor"), pagination.parse_limit(args.get("limit")), descending=True)
+
+
+def user_json(user):
+    return {
+        "user_id": user.user_id,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "email": user.email,
+        "phone_number": user.phone_number,
+        "address": user.address,
+        "role": user.role,
+    }
+
+
+def menu_item_json(item):
+    return {
+        "menu_items_id": item.menu_items_id,
+        "recipe_name": item.recipe_name,
+        "category_id": item.category_id,
+        "category_name": item.category.category_name if item.category else None,
+        "price": float(item.price) if item.price is not None else None,
+        "rating": item.rating,
+        "is_ready_to_serve": bool(item.is_ready_to_serve),
+        "img_src": item.img_src,
+    }
+
+
+def order_json(order):
+    return {
+        "id": order.id,
+        "order_id": order.order_id,
+        "user_id": order.user_id,
+        "user_email": order.user.email if order.user else None,
+        "menu_item_id": order.menu_item_id,
+        "recipe_name": order.menu_item.recipe_name if order.menu_item else None,
+        "order_date": order.order_date.isoformat() if order.order_date else None,
+        "quantity": order.quantity,
+        "price": float(order.price) if order.price is not None else None,
+        "status": order.status,
+        "address": order.address,
+    }
+
+
+def listing_json(load_page, serialize):
+    try:
+        return jsonify(load_page(request.args).to_dict(serialize))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@admin_bp.route("/api/users")
+@login_required
+@admin_required
+def api_users():
+    return listing_json(users_page, user_json)
+
+
+@admin_bp.route("/api/menu_items")
+@login_required
+@admin_required
+def api_menu_items():
+    return listing_json(menu_items_page, menu_item_json)
+
+
+@admin_bp.route("/api/orders")
+@login_required
+@admin_required
+def api_orders():
+    return listing_json(orders_page, order_json)
+
+
+def listing_page(load_page):
+    """First page (or ``?cursor=`` page) for a template; bad filters or cursors show an empty page."""
+    try:
+        return load_page(request.args)
+    except ValueError as e:
+        flash(str(e), "danger")
+        return pagination.Page([], None, pagination.DEFAULT_LIMIT)
+
+
 @admin_bp.route("/dashboard")
 @login_required
 @admin_required
 def dashboard():
     # Just render the admin dashboard without Stripe API calls
-    return render_template("admin/adminDashboard.html")
+    return render_template("admin/adminDashboard.html", recommender=menu_recommender.registry.info())
 
 
 # Manage Events Page
@@ -162,7 +327,8 @@ def edit_event(event_id):
 def manage_users():
     from models import User
 
-    users = User.query.order_by(User.user_id.asc()).all()
+    page = listing_page(users_page)
+    users = page.items
     user_to_edit = None
 
     # Handle create user
@@ -178,7 +344,8 @@ def manage_users():
         # Check for duplicate email
         if User.query.filter_by(email=email).first():
             flash("Email already exists!", "danger")
-            return render_template("admin/manageUsers.html", users=users, user=None)
+            return render_template("admin/manageUsers.html", users=users, user=None, page=page,
+                                   next_cursor=page.next_cursor)
 
         password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
 
@@ -213,7 +380,8 @@ def manage_users():
         flash("User updated successfully!", "success")
         return redirect(url_for("admin.manage_users"))
 
-    return render_template("admin/manageUsers.html", users=users, user=user_to_edit)
+    return render_template("admin/manageUsers.html", users=users, user=user_to_edit, page=page,
+                           next_cursor=page.next_cursor)
 
 
 # Edit user
@@ -222,7 +390,8 @@ def manage_users():
 @admin_required
 def edit_user(user_id):
     user = User.query.get_or_404(user_id)
-    users = User.query.order_by(User.user_id.asc()).all()
+    page = listing_page(users_page)
+    users = page.items
 
     if request.method == 'POST':
         user.first_name = request.form['first_name']
@@ -236,7 +405,8 @@ def edit_user(user_id):
         return redirect(url_for('admin.manage_users'))
 
     # Render same template with "user" for edit form
-    return render_template('admin/manageUsers.html', users=users, user=user)
+    return render_template('admin/manageUsers.html', users=users, user=user, page=page,
+                           next_cursor=page.next_cursor)
 
 
 # Delete user
@@ -257,9 +427,10 @@ def delete_users(user_id):
 @login_required
 @admin_required
 def manage_menu_items():
-    items = MenuItem.query.options(joinedload(MenuItem.category)).all()
+    page = listing_page(menu_items_page)
     categories = Category.query.all()
-    return render_template("admin/manageMenu_item.html", items=items, categories=categories)
+    return render_template("admin/manageMenu_item.html", items=page.items, categories=categories, page=page,
+                           next_cursor=page.next_cursor)
 
 
 @admin_bp.route("/menu_items/add", methods=["GET", "POST"])
@@ -299,6 +470,8 @@ def add_menu_item():
         )
         db.session.add(new_item)
         db.session.commit()
+        catalog_cache.bump_version()
+        recommender_sync.item_saved(new_item)
         flash("Menu item added successfully!", "success")
         return redirect(url_for("admin.manage_menu_items"))
 
@@ -328,6 +501,8 @@ def edit_menu_item(item_id):
         item.price = request.form.get('price', type=float)
 
         db.session.commit()
+        catalog_cache.bump_version()
+        recommender_sync.item_saved(item)
         flash("Menu item updated successfully!", "success")
         return redirect(url_for("admin.manage_menu_items"))
 
@@ -342,6 +517,8 @@ def delete_menu_item(item_id):
     try:
         db.session.delete(item)
         db.session.commit()
+        catalog_cache.bump_version()
+        recommender_sync.item_deleted(item_id)
         flash(f"Menu item '{item.recipe_name}' deleted successfully.", "success")
     except Exception as e:
         db.session.rollback()
@@ -349,23 +526,139 @@ def delete_menu_item(item_id):
     return redirect(url_for("admin.manage_menu_items"))
 
 
+# Bulk import / export (menu_items.csv schema)
+@admin_bp.route("/menu_items/import", methods=["POST"])
+@login_required
+@admin_required
+def import_menu_items():
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        flash("Choose a CSV file to import.", "danger")
+        return redirect(url_for("admin.manage_menu_items"))
+
+    try:
+        report = menu_io.import_menu_csv(upload.stream)
+    except (ValueError, UnicodeDecodeError) as e:
+        db.session.rollback()
+        if request.args.get("format") == "json":
+            return jsonify({"error": str(e)}), 400
+        flash(f"Import failed: {e}", "danger")
+        return redirect(url_for("admin.manage_menu_items"))
+
+    if report.inserted or report.updated:
+        # One refresh for the whole file instead of one per row
+        catalog_cache.bump_version()
+        recommender_sync.schedule_refit(current_app._get_current_object())
+
+    if request.args.get("format") == "json":
+        return jsonify(report.to_dict())
+    flash(f"Imported {report.rows} rows: {report.inserted} added, {report.updated} updated, "
+          f"{report.failed} failed.", "success" if not report.failed else "warning")
+    for error in report.errors[:20]:
+        flash(f"Line {error['line']}: {error['error']}", "danger")
+    return redirect(url_for("admin.manage_menu_items"))
+
+
+@admin_bp.route("/menu_items/export")
+@login_required
+@admin_required
+def export_menu_items():
+    # Streamed in batches; the menu is never loaded into memory at once
+    return Response(
+        stream_with_context(menu_io.export_menu_csv()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=menu_items.csv"},
+    )
+
+
 @admin_bp.route("/orders", methods=["GET"])
 @login_required
 def manage_orders_view():
-    # Eager-load user and menu_item relationships to avoid multiple queries
-    orders = OrderItemNew.query.options(
-        joinedload(OrderItemNew.user),
-        joinedload(OrderItemNew.menu_item)
-    ).order_by(OrderItemNew.order_date.desc()).all()
-
-    return render_template("admin/manageOrders.html", orders=orders)
+    # Eager-load user and menu_item relationships to avoid multiple queries; one page at a time
+    page = listing_page(orders_page)
+    return render_template("admin/manageOrders.html", orders=page.items, page=page, next_cursor=page.next_cursor)
 
 
 @admin_bp.route("/orders")
 @login_required
 def manage_orders():
-    orders = OrderItemNew.query.order_by(OrderItemNew.order_date.desc()).all()
-    return render_template("admin/manage_orders.html", orders=orders)
+    page = listing_page(orders_page)
+    return render_template("admin/manage_orders.html", orders=page.items, page=page, next_cursor=page.next_cursor)
+
+
+# Order export: plain column tuples, fetched through a bounded server-side cursor
+ORDER_EXPORT_COLUMNS = [
+    ("id", OrderItemNew.id),
+    ("order_id", OrderItemNew.order_id),
+    ("order_date", OrderItemNew.order_date),
+    ("status", OrderItemNew.status),
+    ("user_id", OrderItemNew.user_id),
+    ("user_email", User.email),
+    ("menu_item_id", OrderItemNew.menu_item_id),
+    ("recipe_name", MenuItem.recipe_name),
+    ("quantity", OrderItemNew.quantity),
+    ("price", OrderItemNew.price),
+    ("rating", OrderItemNew.rating),
+    ("address", OrderItemNew.address),
+]
+ORDER_EXPORT_BATCH_SIZE = 1000
+
+
+def _export_value(value):
+    if isinstance(value, (date, time)):
+        # datetime is a date too
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # Numeric columns come back as Decimal
+        return float(value)
+    if value is not None and not isinstance(value, (int, float, str, bool)):
+        return str(value)
+    return value
+
+
+def export_orders(query, fmt):
+    """Yield ``query`` rows as CSV or NDJSON text, one batch at a time."""
+    names = [name for name, _ in ORDER_EXPORT_COLUMNS]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(names)
+    for count, row in enumerate(query.yield_per(ORDER_EXPORT_BATCH_SIZE), 1):
+        values = [_export_value(value) for value in row]
+        if fmt == "csv":
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(names, values)), separators=(",", ":")))
+            buffer.write("\n")
+        if count % ORDER_EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+@admin_bp.route("/orders/export")
+@login_required
+@admin_required
+def export_orders_view():
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": f"Unknown format {fmt!r}, use csv or ndjson"}), 400
+    try:
+        query = orders_query(request.args, db.session.query(*[column for _, column in ORDER_EXPORT_COLUMNS])
+                             .select_from(OrderItemNew)
+                             .outerjoin(User, OrderItemNew.user_id == User.user_id)
+                             .outerjoin(MenuItem, OrderItemNew.menu_item_id == MenuItem.menu_items_id))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = query.order_by(OrderItemNew.order_date.desc(), OrderItemNew.id.desc())
+    filename = f"orders.{fmt}"
+    return Response(
+        stream_with_context(export_orders(query, fmt)),
+        mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
 
 @admin_bp.route("/orders/update_status/<int:order_id>", methods=["POST"])
@@ -378,7 +671,7 @@ def update_order_status(order_id):
     quantity = request.form.get("quantity", type=int)
     price = request.form.get("price", type=float)
 
-    if status not in ["processing", "closed", "cancelled"]:
+    if status not in ORDER_STATUSES:
         flash("Invalid status selected.", "danger")
         return redirect(url_for("admin.manage_orders"))
 
@@ -496,6 +789,29 @@ def api_orders_revenue_over_time():
         return jsonify({"error": str(e)}), 500
 
 
+# --- Recommender model ---
+@admin_bp.route("/api/recommender")
+@login_required
+@admin_required
+def recommender_status():
+    # Version, source and load time of the live model
+    return jsonify(menu_recommender.registry.info())
+
+
+@admin_bp.route("/recommender/reload", methods=["POST"])
+@login_required
+@admin_required
+def reload_recommender():
+    try:
+        # Loads and smoke-tests in the background; the current model serves until the swap
+        started = recommender_sync.reload_model()
+        return jsonify({"started": started, **menu_recommender.registry.info()}), 202 if started else 409
+
+    except Exception as e:
+        print("Error in reload_recommender:", e)
+        return jsonify({"error": str(e)}), 500
+
+
 # Admin profile
 @admin_bp.route("/profile", methods=["GET", "POST"])
 @login_required
@@ -0,0 +1,399 @@
+"""Pluggable nearest-neighbour backends for the recommender.
+
+``exact`` scores every item with one sparse matrix-vector product, which is
+what the recommender has always done and is the right choice for a cafe-sized
+menu.  ``ivf`` is an approximate inverted-file index for large (50k+)
+catalogs: the TF-IDF rows are clustered with spherical k-means, every item is
+filed under its nearest centroid, and a query scores the centroids, visits the
+``probes`` closest lists and re-ranks only their items exactly.
+
+``probes`` is the recall/latency knob: more lists visited means more items
+re-ranked, higher recall and slower queries.  :func:`measure_recall` reports
+both against the exact backend::
+
+    python ann_index.py --size 100000 --probes 1 2 4 8 16
+
+On the synthetic 100k-item benchmark catalog (no cluster structure, so the
+worst case for IVF) a single core measured:
+
+    probes  recall@10  score ratio  p50     p99
+    1       0.35       0.89         0.52ms  0.9ms
+    2       0.49       0.94         0.59ms  1.2ms
+    4       0.59       0.96         0.85ms  2.6ms
+    8       0.68       0.97         1.09ms  2.8ms
+    16      0.75       0.98         1.60ms  3.2ms
+    32      0.83       0.99         2.63ms  4.4ms
+    exact   1.00       1.00         3.3ms
+
+and exact search took 0.7ms (p50) at 20k items and 2.5ms at 50k, where 4
+probes gave recall@10 0.54-0.56 and 16 probes 0.74-0.76.
+
+The trade-off, stated plainly: IVF does not meet a sub-millisecond target
+at recall worth having.  Exact search does, with perfect recall, up to
+about 20k items, so ``auto`` keeps using it until ``ANN_MIN_ITEMS`` (50k),
+where exact search costs 2.5ms or more and IVF starts to pay off.  From
+there queries probe 16 lists: about 3/4 of the true top 10, and neighbours
+nearly as similar as the missed ones (score ratio 0.98), at about half the
+exact p50 (1.6ms vs 3.3ms at 100k; p99 about 3ms).  Set
+``RECOMMENDER_IVF_PROBES`` lower for speed or higher for recall.  The
+neighbour index is built offline, where latency doesn't matter, with the
+same 16 probes (25s at 100k items, against 17s with 8).
+
+The backend is chosen with ``RECOMMENDER_BACKEND``: ``exact``, ``ivf`` or
+``auto`` (the default: ``ivf`` from ``RECOMMENDER_ANN_MIN_ITEMS`` items up).
+``RECOMMENDER_IVF_LISTS`` (0 = about ``4 * sqrt(n_items)``) and
+``RECOMMENDER_IVF_PROBES`` / ``RECOMMENDER_IVF_BUILD_PROBES`` tune the IVF
+index.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+from neighbor_index import DEFAULT_K, NeighborIndex, build_neighbor_index, top_k
+
+DEFAULT_BACKEND = os.environ.get("RECOMMENDER_BACKEND", "auto")
+ANN_MIN_ITEMS = int(os.environ.get("RECOMMENDER_ANN_MIN_ITEMS", "50000"))
+DEFAULT_LISTS = int(os.environ.get("RECOMMENDER_IVF_LISTS", "0"))
+DEFAULT_PROBES = int(os.environ.get("RECOMMENDER_IVF_PROBES", "16"))
+BUILD_PROBES = int(os.environ.get("RECOMMENDER_IVF_BUILD_PROBES", "16"))
+# Non-zero terms kept per centroid, k-means iterations and training sample size
+CENTROID_TERMS = 256
+KMEANS_ITERATIONS = 6
+KMEANS_SAMPLE = 20000
+# Rows whose probed lists are found per product when building the neighbour index
+PROBE_CHUNK_SIZE = 4096
+
+
+def as_query(vector, n_features):
+    """``(terms, weights, dense)`` of a query given as a sparse row or dense array."""
+    if sp.issparse(vector):
+        vector = sp.csr_matrix(vector)
+        terms, weights = vector.indices, vector.data.astype(np.float32)
+    else:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        terms = np.flatnonzero(vector)
+        weights = vector[terms]
+    dense = np.zeros(n_features, dtype=np.float32)
+    dense[terms] = weights
+    return terms, weights, dense
+
+
+def _ranges(starts, stops):
+    """Concatenation of ``arange(start, stop)`` for every pair, vectorised."""
+    lengths = stops - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum()), offsets, lengths
+
+
+def row_scores(matrix, rows, query):
+    """``matrix[rows] @ query`` for a CSR ``matrix`` and dense ``query``.
+
+    Gathers the rows' entries straight from ``indptr``/``indices``/``data``,
+    which is several times cheaper than scipy's fancy row indexing for the
+    few thousand rows a query re-ranks.
+    """
+    scores = np.zeros(len(rows), dtype=np.float32)
+    entries, offsets, lengths = _ranges(matrix.indptr[rows], matrix.indptr[rows + 1])
+    if not len(entries):
+        return scores
+    products = matrix.data[entries] * query[matrix.indices[entries]]
+    nonempty = lengths > 0
+    scores[nonempty] = np.add.reduceat(products, offsets[nonempty])
+    return scores
+
+
+def _best(rows, scores, k, exclude):
+    """Best ``k`` of ``rows`` by ``scores``, skipping ``exclude`` and -inf."""
+    exclude = np.asarray([] if exclude is None else exclude, dtype=np.int64)
+    top = top_k(scores, k + len(exclude))
+    top = top[np.isfinite(scores[top]) & ~np.isin(rows[top], exclude)][:k]
+    return rows[top], scores[top]
+
+
+class ExactBackend:
+    """Brute force: one sparse mat-vec over the whole catalog."""
+
+    name = "exact"
+
+    def __init__(self, matrix, active=None):
+        self.matrix = matrix
+        self.active = active
+
+    def query(self, vector, k, exclude=None):
+        """``(rows, scores)`` of the ``k`` active items most similar to ``vector``."""
+        _, _, query = as_query(vector, self.matrix.shape[1])
+        scores = np.asarray(self.matrix @ query, dtype=np.float32)
+        if self.active is not None:
+            scores[~self.active] = -np.inf
+        return _best(np.arange(len(scores)), scores, k, exclude)
+
+    def neighbor_index(self, k=DEFAULT_K):
+        return build_neighbor_index(self.matrix, k)
+
+    def updated(self, matrix, active, changed_rows):
+        return ExactBackend(matrix, active)
+
+    def get_arrays(self):
+        return {}
+
+
+def _spherical_kmeans(matrix, n_lists, seed=0):
+    """Sparse, L2-normalised centroids (``n_lists x n_features``, CSR)."""
+    rng = np.random.default_rng(seed)
+    sample = matrix[rng.choice(matrix.shape[0], min(KMEANS_SAMPLE, matrix.shape[0]), replace=False)]
+    centroids = sample[rng.choice(sample.shape[0], n_lists, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assigned = np.asarray((sample @ centroids.T).argmax(axis=1)).ravel()
+        membership = sp.csr_matrix(
+            (np.ones(len(assigned), dtype=np.float32), (assigned, np.arange(len(assigned)))),
+            shape=(n_lists, sample.shape[0]),
+        )
+        centroids = sp.csr_matrix(membership @ sample)
+        # Keep only each centroid's heaviest terms so scoring them stays sparse
+        for row in range(n_lists):
+            data = centroids.data[centroids.indptr[row]:centroids.indptr[row + 1]]
+            if len(data) > CENTROID_TERMS:
+                data[data < np.partition(data, -CENTROID_TERMS)[-CENTROID_TERMS]] = 0
+        centroids.eliminate_zeros()
+        centroids = normalize(centroids)
+    return centroids
+
+
+class IvfBackend:
+    """Inverted-file index over spherical k-means lists, with exact re-ranking.
+
+    Rows added or edited after the lists were built are kept in a small
+    ``loose`` set that every query scans, until the next refit rebuilds the
+    index.
+    """
+
+    name = "ivf"
+
+    def __init__(self, matrix, active=None, n_lists=DEFAULT_LISTS, probes=DEFAULT_PROBES, seed=0, arrays=None):
+        self.matrix = matrix
+        self.active = active
+        self.probes = probes
+        if arrays is None:
+            arrays = self._build(matrix, n_lists or int(4 * np.sqrt(matrix.shape[0])), seed)
+        # Rows grouped by list: list l holds order[bounds[l]:bounds[l + 1]]
+        self.order = arrays["ivf_order"]
+        self.bounds = arrays["ivf_bounds"]
+        # Centroids by term (CSC), so scoring them only touches the query's terms
+        self.centroids = sp.csc_matrix(
+            (arrays["ivf_centroid_data"], arrays["ivf_centroid_indices"], arrays["ivf_centroid_indptr"]),
+            shape=(len(self.bounds) - 1, matrix.shape[1]),
+        )
+        self.loose = arrays.get("ivf_loose", np.empty(0, dtype=np.int32))
+        self.n_lists = self.centroids.shape[0]
+
+    @staticmethod
+    def _build(matrix, n_lists, seed):
+        n_lists = max(1, min(n_lists, matrix.shape[0]))
+        centroids = _spherical_kmeans(matrix, n_lists, seed)
+        assigned = np.asarray((matrix @ centroids.T).argmax(axis=1)).ravel()
+        order = np.argsort(assigned, kind="stable").astype(np.int32)
+        by_term = centroids.tocsc()
+        return {
+            "ivf_order": order,
+            "ivf_bounds": np.searchsorted(assigned[order], np.arange(n_lists + 1)).astype(np.int64),
+            "ivf_centroid_data": by_term.data.astype(np.float32),
+            "ivf_centroid_indices": by_term.indices.astype(np.int32),
+            "ivf_centroid_indptr": by_term.indptr.astype(np.int64),
+        }
+
+    def get_arrays(self):
+        """Index arrays for the bundle (see recommender_artifacts.py)."""
+        return {
+            "ivf_order": self.order,
+            "ivf_bounds": self.bounds,
+            "ivf_centroid_data": self.centroids.data,
+            "ivf_centroid_indices": self.centroids.indices,
+            "ivf_centroid_indptr": self.centroids.indptr,
+            "ivf_loose": self.loose,
+        }
+
+    def updated(self, matrix, active, changed_rows):
+        """A backend over the edited ``matrix``; ``changed_rows`` become loose."""
+        arrays = self.get_arrays()
+        # Drop the changed rows' stale list entries and shift the list bounds
+        kept = ~np.isin(self.order, changed_rows)
+        arrays["ivf_order"] = self.order[kept]
+        arrays["ivf_bounds"] = np.concatenate([[0], np.cumsum(kept)])[self.bounds]
+        arrays["ivf_loose"] = np.union1d(self.loose, changed_rows).astype(np.int32)
+        return IvfBackend(matrix, active, probes=self.probes, arrays=arrays)
+
+    def candidates(self, terms, weights, probes=None):
+        """Rows filed under the ``probes`` centroids closest to the query."""
+        probes = self.probes if probes is None else probes
+        entries, _, lengths = _ranges(self.centroids.indptr[terms], self.centroids.indptr[terms + 1])
+        centroid_scores = np.bincount(
+            self.centroids.indices[entries],
+            self.centroids.data[entries] * np.repeat(weights, lengths),
+            minlength=self.n_lists,
+        )
+        lists = top_k(centroid_scores, probes)
+        positions, _, _ = _ranges(self.bounds[lists], self.bounds[lists + 1])
+        rows = np.concatenate([self.order[positions], self.loose])
+        if self.active is not None:
+            rows = rows[self.active[rows]]
+        return rows
+
+    def query(self, vector, k, exclude=None, probes=None):
+        """Approximate ``(rows, scores)`` of the ``k`` active items most similar to ``vector``."""
+        terms, weights, query = as_query(vector, self.matrix.shape[1])
+        rows = self.candidates(terms, weights, probes)
+        return _best(rows, row_scores(self.matrix, rows, query), k, exclude)
+
+    def neighbor_index(self, k=DEFAULT_K, probes=BUILD_PROBES):
+        """Top-k neighbours of every row, one matrix product per list.
+
+        Every row probes the ``probes`` lists a query for it would.  Then
+        each list scores all the rows that probe it against its members in
+        one sparse product, and the best ``k`` per row are merged across
+        lists.  That is the work of one query per row, without the per-row
+        Python overhead: about 12s instead of 100s for 100k items.
+        """
+        n_items = self.matrix.shape[0]
+        k = max(min(k, n_items - 1), 0)
+        ids = np.zeros((n_items, k), dtype=np.int32)
+        scores = np.full((n_items, k), -np.inf, dtype=np.float32)
+        if k == 0:
+            return NeighborIndex(ids, scores)
+
+        # Lists probed by every row, then the rows probing every list
+        probes = min(probes, self.n_lists)
+        centroids_t = self.centroids.T.tocsc()
+        probed = np.empty((n_items, probes), dtype=np.int64)
+        for start in range(0, n_items, PROBE_CHUNK_SIZE):
+            centroid_scores = (self.matrix[start:start + PROBE_CHUNK_SIZE] @ centroids_t).toarray()
+            probed[start:start + PROBE_CHUNK_SIZE] = np.argpartition(-centroid_scores, probes - 1,
+                                                                     axis=1)[:, :probes]
+        by_list = np.argsort(probed.ravel(), kind="stable")
+        prober_bounds = np.searchsorted(probed.ravel()[by_list], np.arange(self.n_lists + 1))
+        probers_of = by_list // probes
+
+        blocks = [
+            (probers_of[prober_bounds[lst]:prober_bounds[lst + 1]], self.order[self.bounds[lst]:self.bounds[lst + 1]])
+            for lst in range(self.n_lists)
+        ]
+        if len(self.loose):
+            # Loose rows are candidates of every query
+            blocks.append((np.arange(n_items), self.loose))
+        for rows, members in blocks:
+            members = members.astype(np.int64)
+            if self.active is not None:
+                members = members[self.active[members]]
+            if not len(rows) or not len(members):
+                continue
+            block = self.matrix[rows] @ self.matrix[members].T
+            found, found_scores = _block_top_k(block, rows, members, k)
+            # Merge with the best found so far in the lists already scored
+            merged_ids = np.hstack([ids[rows], found])
+            merged_scores = np.hstack([scores[rows], found_scores])
+            order = np.lexsort((merged_ids, -merged_scores), axis=1)[:, :k]
+            ids[rows] = np.take_along_axis(merged_ids, order, axis=1)
+            scores[rows] = np.take_along_axis(merged_scores, order, axis=1)
+        return NeighborIndex(ids, scores)
+
+
+def _block_top_k(block, rows, candidates, k):
+    """Best ``k`` candidates per row of a ``rows x candidates`` similarity block, best first."""
+    block = block.toarray().astype(np.float32, copy=False)
+    # Never an item's own neighbour
+    block[rows[:, None] == candidates[None, :]] = -np.inf
+    k = min(k, len(candidates))
+    if k < len(candidates):
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(len(candidates)), (len(rows), 1))
+    top_scores = np.take_along_axis(block, top, axis=1)
+    top_ids = candidates[top]
+    # Highest score first, lower item index first on ties, like the exact index
+    order = np.lexsort((top_ids, -top_scores), axis=1)
+    return np.take_along_axis(top_ids, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+BACKENDS = {"exact": ExactBackend, "ivf": IvfBackend}
+
+
+def make_backend(matrix, active=None, name=None, arrays=None):
+    """Backend ``name`` (default ``RECOMMENDER_BACKEND``) over ``matrix``.
+
+    ``arrays`` are a saved IVF index (from ``get_arrays``) to reuse instead of
+    clustering again.
+    """
+    name = name or DEFAULT_BACKEND
+    if name == "auto":
+        name = "ivf" if matrix.shape[0] >= ANN_MIN_ITEMS else "exact"
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown recommender backend {name!r}; expected auto or one of {sorted(BACKENDS)}")
+    if name == "ivf":
+        return IvfBackend(matrix, active, arrays=arrays or None)
+    return ExactBackend(matrix, active)
+
+
+def measure_recall(backend, exact, rows, k=10, **query_options):
+    """Recall@k of ``backend`` against ``exact`` for item-to-item queries.
+
+    Also reports how much similarity the approximate top-k keeps relative to
+    the exact one (1.0 = as similar) and both backends' latencies.
+    """
+    recalls, score_ratios, latencies, exact_latencies = [], [], [], []
+    for row in rows:
+        vector = exact.matrix[row]
+        start = time.perf_counter()
+        expected, expected_scores = exact.query(vector, k, exclude=[row])
+        exact_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        found, found_scores = backend.query(vector, k, exclude=[row], **query_options)
+        latencies.append(time.perf_counter() - start)
+        if len(expected) and expected_scores.sum() > 0:
+            recalls.append(len(np.intersect1d(found, expected)) / len(expected))
+            score_ratios.append(found_scores.sum() / expected_scores.sum())
+    return {
+        "recall": float(np.mean(recalls)) if recalls else 1.0,
+        "score_ratio": float(np.mean(score_ratios)) if score_ratios else 1.0,
+        "p50_us": float(np.percentile(latencies, 50) * 1e6),
+        "p99_us": float(np.percentile(latencies, 99) * 1e6),
+        "exact_p50_us": float(np.percentile(exact_latencies, 50) * 1e6),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall and latency of the IVF backend against exact search.")
+    parser.add_argument("--size", type=int, default=100000, help="Synthetic catalog size")
+    parser.add_argument("--bundle", action="store_true", help="Measure on the current recommender bundle instead")
+    parser.add_argument("--lists", type=int, default=DEFAULT_LISTS)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.bundle:
+        from recommender_artifacts import load_bundle
+        matrix = load_bundle().tfidf_matrix
+    else:
+        from bench_recommender import generate_menu
+        from feature_engine import MultiFieldVectorizer
+        matrix = MultiFieldVectorizer().fit_transform(generate_menu(args.size))
+
+    start = time.perf_counter()
+    ivf = IvfBackend(matrix, n_lists=args.lists)
+    print(f"{matrix.shape[0]} items: built {ivf.n_lists} lists in {time.perf_counter() - start:.1f}s")
+
+    exact = ExactBackend(matrix)
+    rows = np.random.default_rng(0).integers(0, matrix.shape[0], size=args.queries)
+    for probes in args.probes:
+        result = measure_recall(ivf, exact, rows, args.k, probes=probes)
+        print(f"probes={probes:>3}: recall@{args.k}={result['recall']:.3f} "
+              f"score ratio={result['score_ratio']:.3f}  p50={result['p50_us']:.0f}us "
+              f"p99={result['p99_us']:.0f}us  (exact p50={result['exact_p50_us']:.0f}us)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
-from flask import Flask, render_template, redirect, url_for, jsonify, flash, request, session, current_app, Blueprint
+from flask import Flask, render_template, redirect, url_for, jsonify, flash, request, session, current_app, Blueprint, abort
 import os
 from config import Config
 from extensions import db, bcrypt, login_manager
 from models import User, Category, MenuItem, Event, OrderItemNew, EventRegistration
 from auth.routes import auth
 from test import stripe_bp
-from menu_recommender import recommend_menu_with_weather
 from flask import url_for
 from admin import admin_bp
+from recommendations import recommendations_bp, model_state
+from response_cache import cached_response
+import search_index
+import catalog_cache
+import cart_store
+import menu_recommender
+import checkout
+import order_history as order_history_store
+import recommender_sync
 from datetime import datetime
+import time
 from flask_login import login_required, current_user, AnonymousUserMixin
 from werkzeug.utils import secure_filename
 
@@ -32,10 +41,15 @@ def create_app():
     with app.app_context():
         db.create_all()
 
+    # Load (or map the shared) recommender, then follow the MenuItem table from here on
+    menu_recommender.init_model()
+    recommender_sync.init_app(app)
+
     # Register Blueprints
     app.register_blueprint(auth)
     app.register_blueprint(stripe_bp)
     app.register_blueprint(admin_bp)
+    app.register_blueprint(recommendations_bp)
 
     # User loader for Flask-Login
     @login_manager.user_loader
@@ -55,9 +69,9 @@ def create_app():
         if not query:
             return jsonify([])
 
-        # Example: search menu items
-        results = MenuItem.query.filter(MenuItem.name.ilike(f"%{query}%")).limit(5).all()
-        return jsonify([{"id": r.id, "name": r.name, "price": r.price} for r in results])
+        # In-memory prefix/trigram index over names and ingredients (search_index.py)
+        limit = max(1, min(request.args.get("limit", 5, type=int), 20))
+        return jsonify(search_index.search(query, limit))
 
     @app.route('/profile')
     @login_required
@@ -143,37 +157,27 @@ def create_app():
     @app.route('/order-history')
     @login_required
     def order_history_page():
-        # Fetch all orders for the current user
-        user_orders = OrderItemNew.query.filter_by(user_id=current_user.user_id).all()
-
-        # Group orders by restaurant
-        orders_by_restaurant = {}
-        for order in user_orders:
-            restaurant_name = order.menu_item.category.category_name  # Example
-            if restaurant_name not in orders_by_restaurant:
-                orders_by_restaurant[restaurant_name] = {
-                    "name": restaurant_name,
-                    "total_orders": 0,
-                    "order_list": []
-                }
-
-            # Use the rating directly from the order
-            user_rating = order.rating
+        # One joined query per page, newest first; per-category totals come from the summary cache
+        try:
+            orders, page, summary = order_history_store.order_history(
+                current_user.user_id, request.args.get("cursor"), request.args.get("limit"))
+        except ValueError:
+            return redirect(url_for('order_history_page'))
 
-            # Add order details
-            orders_by_restaurant[restaurant_name]["total_orders"] += 1
-            orders_by_restaurant[restaurant_name]["order_list"].append({
-                "id": order.id,
-                "image_url": order.menu_item.img_src,
-                "delivered_at": order.order_date.strftime("%d %b %Y"),
-                "address": order.address,
-                "items_summary": order.menu_item.recipe_name,  # Simplified summary
-                "user_rating": user_rating
-            })
+        # Template follow-up: order_history.html doesn't render a "next" link from next_cursor yet
+        return render_template('order_history.html', orders=orders, page=page, next_cursor=page.next_cursor,
+                               summary=summary)
 
-        orders = list(orders_by_restaurant.values())
+    @app.route('/api/order-history')
+    @login_required
+    def api_order_history():
+        try:
+            orders, page, summary = order_history_store.order_history(
+                current_user.user_id, request.args.get("cursor"), request.args.get("limit"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        return render_template('order_history.html', orders=orders)
+        return jsonify({"orders": orders, "next_cursor": page.next_cursor, "summary": summary})
 
     # Optional: AJAX route for inline rating update
     @app.route('/rate-order', methods=['POST'])
@@ -190,9 +194,10 @@ def create_app():
         if not order or order.user_id != current_user.user_id:
             return jsonify({"success": False, "message": "Order not found"}), 404
 
-        # Update the rating
+        # Update the rating (the mapper event also drops this user's cached summary)
         order.rating = rating
         db.session.commit()
+        order_history_store.invalidate(current_user.user_id)
 
         return jsonify({"success": True, "message": "Rating saved"})
 
@@ -239,15 +244,13 @@ def create_app():
             except (ValueError, TypeError):
                 return jsonify({"message": "Invalid item_id"}), 400
 
-            # Lookup menu item by ID
-            menu_item = MenuItem.query.get(item_id)
+            # Lookup menu item by ID (catalog snapshot, one IN query only on a miss)
+            menu_item = cart_store.resolve_items([item_id]).get(item_id)
             if not menu_item:
                 return jsonify({"message": "Item not found"}), 404
 
-            # Store cart in session
-            cart = session.get("cart", {})
-            cart[str(item_id)] = cart.get(str(item_id), 0) + quantity
-            session["cart"] = cart
+            # Store cart server-side; the cookie only carries the cart id
+            cart = cart_store.add_item(item_id, quantity)
 
             print(f"User {current_user.user_id} added {quantity} of {menu_item.recipe_name} to cart")
 
@@ -260,6 +263,56 @@ def create_app():
             print("Error in /add-to-cart:", e)
             return jsonify({"message": str(e)}), 500
 
+    @app.route("/api/cart", methods=["GET", "POST", "DELETE"])
+    @login_required
+    def api_cart():
+        try:
+            # POST {"item_id": 12, "quantity": 2} sets one line (0 removes it); DELETE empties the cart
+            if request.method == "POST":
+                data = request.get_json() or {}
+                try:
+                    item_id = int(data.get("item_id"))
+                    quantity = int(data.get("quantity", 1))
+                except (ValueError, TypeError):
+                    return jsonify({"message": "Invalid item_id or quantity"}), 400
+                cart = cart_store.set_quantity(item_id, quantity)
+            elif request.method == "DELETE":
+                cart = cart_store.clear_cart()
+            else:
+                cart = cart_store.get_cart()
+
+            # Lines and totals in one round-trip
+            return jsonify(cart_store.price_cart(cart))
+
+        except Exception as e:
+            print("Error in /api/cart:", e)
+            return jsonify({"message": str(e)}), 500
+
+    @app.route("/api/checkout", methods=["POST"])
+    @login_required
+    def api_checkout():
+        try:
+            # The client sends the same Idempotency-Key when it retries, so an order is placed once
+            data = request.get_json(silent=True) or {}
+            key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+            cart = data.get("cart") or cart_store.get_cart()
+            result = checkout.place_order(
+                current_user.user_id,
+                cart,
+                key,
+                address=data.get("address") or current_user.address,
+                expected_total=data.get("expected_total"),
+            )
+            if not result["replayed"]:
+                cart_store.clear_cart()
+            return jsonify(result), 200 if result["replayed"] else 201
+
+        except checkout.CheckoutError as e:
+            return jsonify(e.to_dict()), e.status
+        except Exception as e:
+            print("Error in /api/checkout:", e)
+            return jsonify({"message": str(e)}), 500
+
     # Public Routes
     @app.route('/')
     def index():
@@ -271,7 +324,8 @@ def create_app():
 
     @app.route('/menu')
     def menu():
-        categories = Category.query.filter_by(is_active=True).order_by(Category.sort_order).all()
+        # Categories and items come from the versioned catalog cache (catalog_cache.py)
+        categories = catalog_cache.get_catalog().categories
         return render_template('Menu.html', categories=categories, current_user=current_user)
 
     @app.route('/menu/<slug>')
@@ -297,26 +351,18 @@ def create_app():
 
     @app.route('/api/menu/<int:category_id>')
     def get_menu_items(category_id):
-        items = MenuItem.query.filter_by(category_id=category_id).all()
-        data = [
-            {
-                "id": item.menu_items_id,
-                "recipe_name": item.recipe_name,  # matches JS
-                "img_src": item.img_src,  # matches JS
-                "price": float(item.price) if hasattr(item, 'price') else None,
-                "ingredients": item.ingredients,  # matches JS
-                "group": item.cuisine_path
-            }
-            for item in items
-        ]
-        return jsonify(data)
+        # Serialized once per catalog version, revalidated with an ETag
+        return catalog_cache.get_catalog().menu_response(category_id)
 
     @app.route('/menu-items/<slug>')
     def menu_items_by_category(slug):
 
-        category = Category.query.filter_by(slug=slug).first_or_404()
-        items = MenuItem.query.filter_by(category_id=category.category_id).all()
-        categories = Category.query.filter_by(is_active=True).order_by(Category.sort_order).all()
+        catalog = catalog_cache.get_catalog()
+        category = catalog.category_by_slug.get(slug)
+        if category is None:
+            abort(404)
+        items = catalog.items(category.category_id)
+        categories = catalog.categories
 
         return render_template(
             'menu_item.html',
@@ -332,16 +378,24 @@ def create_app():
 
     @app.route('/api/menu-item/<int:item_id>')
     def get_menu_item(item_id):
-        item = MenuItem.query.get(item_id)
+        # Related items are drawn per seed; without one the draw changes every
+        # RELATED_ITEMS_ROTATE seconds, and is cached until then
+        seed = request.args.get("seed", type=int)
+        if seed is None:
+            seed = int(time.time() // catalog_cache.RELATED_ITEMS_ROTATE)
+        seed = abs(seed)
+        # Same for every user until the menu changes: served from the response cache
+        key = ("menu-item", item_id, seed, model_state(), catalog_cache.catalog_version())
+        return cached_response(key, lambda: render_menu_item(item_id, seed))
+
+    def render_menu_item(item_id, seed):
+        # Item and category pool come from the catalog snapshot: no queries
+        catalog = catalog_cache.get_catalog()
+        item = catalog.item_by_id.get(item_id)
         if not item:
             return jsonify({"error": "Item not found"}), 404
 
-        from sqlalchemy.sql.expression import func
-
-        recommended_items = MenuItem.query.filter(
-            MenuItem.category_id == item.category_id,
-            MenuItem.menu_items_id != item.menu_items_id
-        ).order_by(func.random()).limit(7).all()
+        recommended_items = catalog.related_items(item, catalog_cache.RELATED_ITEMS, seed=(item_id, seed))
 
         data = {
             "id": item.menu_items_id,
@@ -411,44 +465,6 @@ def create_app():
         return jsonify(
             {"success": True, "message": f"Successfully registered for {event.event_title} with {guests} guest(s)."})
 
-    # --- Menu Recommender API Routes ---
-
-    @app.route("/recommendations_weather/<menu_item>")
-    def get_recommendations_with_weather(menu_item):
-        try:
-            # Call your recommender
-            result = recommend_menu_with_weather(menu_item)  # returns dict with DataFrames
-
-            # Item-based recommendations
-            item_based_raw = result["clicked_item_recommendation"]
-            item_based = item_based_raw.to_dict(orient="records") if hasattr(item_based_raw, "to_dict") else []
-
-            # Weather-based recommendations
-            weather_based_raw = result["weather_based_recommendation"]
-            if hasattr(weather_based_raw, "to_dict"):
-                weather_based = weather_based_raw.copy()
-                # Ensure img_src exists
-                if "img_src" not in weather_based.columns:
-                    weather_based["img_src"] = None
-                weather_based["img_src"] = weather_based["img_src"].fillna("https://placehold.co/300x200")
-                weather_based = weather_based[
-                    ["recipe_name", "ingredients", "category_id", "category_name", "price", "img_src"]]
-                weather_based = weather_based.to_dict(orient="records")
-            else:
-                weather_based = []
-
-            # Return all required info
-            return jsonify({
-                "clicked_item_recommendation": item_based,
-                "weather_based_recommendation": weather_based,
-                "weather": result["weather"],
-                "temperature": result["temperature"]
-            })
-
-        except Exception as e:
-            print("Error in get_recommendations_with_weather:", e)
-            return jsonify({"error": str(e)}), 500
-
     return app
 
 
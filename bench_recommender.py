@@ -0,0 +1,215 @@
+"""Benchmark the recommender paths on synthetic catalogs of growing size.
+
+Usage::
+
+    python bench_recommender.py --sizes 100 1000 10000 --out bench_results.json
+    python bench_recommender.py --sizes 1000 --compare bench_results.json
+
+For every catalog size a synthetic menu in the ``menu_items.csv`` schema is
+generated and fitted, then each path is timed with the weather lookup stubbed
+out:
+
+* ``fit``: wall time and peak traced memory of ``RecommenderModel.fit``
+* ``recommend_menu``, ``recommend_menu_by_id``, ``recommend_for_cart``,
+  ``recommend_menu_with_weather``: p50/p99 latency and throughput
+* ``route``: ``/recommendations/<id>`` through the Flask test client, with
+  the response cache emptied (untimed) before every request, so each one
+  renders; ``route_cached`` times the same requests once they are all cached
+
+Results are written as JSON; ``--compare`` flags paths whose p50 got more than
+``--threshold`` slower than in a previous results file.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from flask import Flask
+
+import menu_recommender
+import weather_provider
+import response_cache
+from recommendations import recommendations_bp
+from recommender_model import MENU_COLUMNS, RecommenderModel, category_map
+
+DEFAULT_SIZES = (100, 1000, 10000)
+DEFAULT_QUERIES = 500
+
+
+def generate_menu(size, seed=0, source=menu_recommender.MENU_CSV):
+    """Synthetic menu of ``size`` rows in the ``menu_items.csv`` schema.
+
+    Names and ingredient lists are random recombinations of the words in the
+    real menu, plus a per-item token so that rows stay distinct.
+    """
+    rng = np.random.default_rng(seed)
+    real = pd.read_csv(source)
+    name_words = sorted({w for name in real["recipe_name"] for w in name.split()})
+    ingredients = sorted({i.strip() for row in real["ingredients"].dropna() for i in row.split(",")})
+    cuisines = real["cuisine_path"].dropna().unique()
+    images = real["img_src"].dropna().unique()
+
+    rows = []
+    for item_id in range(1, size + 1):
+        name = " ".join(rng.choice(name_words, size=rng.integers(1, 4), replace=False))
+        picked = rng.choice(ingredients, size=rng.integers(3, 9), replace=False)
+        rows.append({
+            "menu_items_id": item_id,
+            "recipe_name": f"{name} {item_id}",
+            "prep_time": f"{rng.integers(5, 30)} minutes",
+            "cook_time": f"{rng.integers(0, 60)} minutes",
+            "total_time": f"{rng.integers(5, 90)} minutes",
+            "ingredients": ", ".join(picked),
+            "rating": round(float(rng.uniform(3, 5)), 1),
+            "cuisine_path": rng.choice(cuisines),
+            "nutrition": "Calories: 300",
+            "img_src": rng.choice(images) if rng.random() > 0.1 else None,
+            "is_ready_to_serve": 1,
+            "cleaned_ingredients": " ".join(picked).lower(),
+            "category_id": int(rng.integers(1, len(category_map) + 1)),
+            "price": round(float(rng.uniform(1, 15)), 2),
+        })
+    return pd.DataFrame(rows, columns=MENU_COLUMNS)
+
+
+def time_queries(func, args_list, before=None):
+    """p50/p99 latency (microseconds) and throughput (queries/second).
+
+    ``before()``, if given, runs ahead of every query and is not timed.
+    """
+    latencies = np.empty(len(args_list))
+    for i, args in enumerate(args_list):
+        if before is not None:
+            before()
+        t0 = time.perf_counter()
+        func(*args)
+        latencies[i] = time.perf_counter() - t0
+    return {
+        "p50_us": float(np.percentile(latencies, 50) * 1e6),
+        "p99_us": float(np.percentile(latencies, 99) * 1e6),
+        "throughput_qps": float(len(args_list) / latencies.sum()),
+    }
+
+
+def bench_size(size, queries=DEFAULT_QUERIES, seed=0):
+    menu_df = generate_menu(size, seed)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    model = RecommenderModel.fit(menu_df)
+    fit_seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    menu_recommender.registry.swap(model, "benchmark", fit_seconds)
+    rng = np.random.default_rng(seed + 1)
+    rows = rng.integers(0, size, size=queries)
+    names = model.menu_df["recipe_name"].to_numpy()[rows]
+    item_ids = model.menu_df["menu_items_id"].to_numpy()[rows]
+    carts = [
+        ({str(i): int(rng.integers(1, 4)) for i in rng.choice(item_ids, size=3)},)
+        for _ in range(queries)
+    ]
+
+    app = Flask(__name__)
+    app.register_blueprint(recommendations_bp)
+    client = app.test_client()
+
+    def route(item_id):
+        response = client.get(f"/recommendations/{item_id}")
+        assert response.status_code == 200, response.status_code
+
+    route_args = [(int(i),) for i in item_ids]
+    # Item ids repeat, so without emptying the cache most requests would be hits
+    route_misses = time_queries(route, route_args, before=response_cache.invalidate)
+    for args in route_args:
+        route(*args)
+    route_hits = time_queries(route, route_args)
+
+    return {
+        "size": size,
+        "fit": {"seconds": fit_seconds, "peak_memory_mb": peak / 1e6},
+        "recommend_menu": time_queries(menu_recommender.recommend_menu, [(n,) for n in names]),
+        "recommend_menu_by_id": time_queries(menu_recommender.recommend_menu_by_id, [(i,) for i in item_ids]),
+        "recommend_for_cart": time_queries(menu_recommender.recommend_for_cart, carts),
+        "recommend_menu_with_weather": time_queries(
+            lambda name: menu_recommender.recommend_menu_with_weather(name), [(n,) for n in names]
+        ),
+        "route": route_misses,
+        "route_cached": route_hits,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Paths whose p50 latency regressed by more than ``threshold`` (a fraction)."""
+    previous = {r["size"]: r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(result["size"])
+        if old is None:
+            continue
+        for path, stats in result.items():
+            if isinstance(stats, dict) and "p50_us" in stats and path in old:
+                before, after = old[path]["p50_us"], stats["p50_us"]
+                if after > before * (1 + threshold):
+                    regressions.append(f"size={result['size']} {path}: p50 {before:.1f}us -> {after:.1f}us")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="Previous results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p50 slowdown (default 20%%)")
+    args = parser.parse_args(argv)
+
+    # Never hit the real weather API while benchmarking
+    weather_provider.set_provider(
+        menu_recommender.OPENWEATHER_API_KEY,
+        weather_provider.CachedWeatherProvider(weather_provider.StubWeatherProvider("Rain", 24.0)),
+    )
+
+    results = []
+    for size in args.sizes:
+        result = bench_size(size, args.queries)
+        results.append(result)
+        print(f"size={size:>7}  fit {result['fit']['seconds']:.2f}s / {result['fit']['peak_memory_mb']:.1f}MB  " +
+              "  ".join(f"{path} p50={stats['p50_us']:.0f}us" for path, stats in result.items()
+                        if isinstance(stats, dict) and "p50_us" in stats))
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "queries": args.queries,
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Server-side shopping carts.
+
+The cart used to live in the signed cookie session, so every item added
+grew the cookie sent with every request.  Now the cookie holds only a
+random ``cart_id``, and the lines (``{"<menu_items_id>": quantity}``) are
+kept in a store chosen with ``CART_BACKEND``:
+
+* ``sqlite`` (default): one table in ``CART_SQLITE_PATH``, shared by every
+  worker on the host, like a local Redis
+* ``memory``: a dict per process, for development and tests; a cart is only
+  visible to the worker that wrote it
+
+Other backends only need ``get``/``set``/``delete``/``update`` (see
+:class:`MemoryCartBackend`) and an entry in :data:`BACKENDS`.  ``update``
+is the read-modify-write behind :func:`add_item` and :func:`set_quantity`;
+it must be atomic, so two concurrent adds to one cart both count (the
+memory backend holds its lock, SQLite a ``BEGIN IMMEDIATE`` transaction).
+Carts untouched for ``CART_TTL_DAYS`` are dropped.
+
+The session holds nothing but the ``cart_id``.  A cart still in an old
+cookie is moved into the store, and out of the cookie, the first time the
+visitor's cart is touched.  Code that read ``session["cart"]`` (the Stripe
+checkout in ``test.stripe_bp``) must call :func:`get_cart` instead.
+
+:func:`price_cart` resolves prices and availability of all lines at once
+from the catalog snapshot (catalog_cache.py).  Only items missing from the
+snapshot cost a query, a single ``IN (...)``.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from flask import session
+
+CART_BACKEND = os.environ.get("CART_BACKEND", "sqlite")
+CART_SQLITE_PATH = os.environ.get("CART_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "cafe-carts.sqlite3"))
+CART_TTL_DAYS = float(os.environ.get("CART_TTL_DAYS", "30"))
+MAX_QUANTITY = 99
+CENT = Decimal("0.01")
+
+
+class MemoryCartBackend:
+    def __init__(self):
+        self._carts = {}
+        self._lock = threading.Lock()
+
+    def get(self, cart_id):
+        with self._lock:
+            entry = self._carts.get(cart_id)
+            if entry is None or time.time() - entry[0] > CART_TTL_DAYS * 86400:
+                return {}
+            return dict(entry[1])
+
+    def set(self, cart_id, items):
+        with self._lock:
+            self._carts[cart_id] = (time.time(), dict(items))
+
+    def delete(self, cart_id):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+    def update(self, cart_id, change):
+        """Replace the cart with ``change(items)``, atomically; returns the new items."""
+        with self._lock:
+            entry = self._carts.get(cart_id)
+            fresh = entry is not None and time.time() - entry[0] <= CART_TTL_DAYS * 86400
+            items = change(dict(entry[1]) if fresh else {})
+            if items:
+                self._carts[cart_id] = (time.time(), dict(items))
+            else:
+                self._carts.pop(cart_id, None)
+            return items
+
+
+class SqliteCartBackend:
+    """Carts as JSON rows in a local SQLite file (WAL, one connection per thread)."""
+
+    def __init__(self, path=CART_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS carts (cart_id TEXT PRIMARY KEY, items TEXT NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS carts_updated_at ON carts (updated_at)")
+            connection.execute("DELETE FROM carts WHERE updated_at < ?", (time.time() - CART_TTL_DAYS * 86400,))
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _read(connection, cart_id):
+        row = connection.execute(
+            "SELECT items FROM carts WHERE cart_id = ? AND updated_at >= ?",
+            (cart_id, time.time() - CART_TTL_DAYS * 86400),
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    @staticmethod
+    def _write(connection, cart_id, items):
+        connection.execute(
+            "INSERT INTO carts (cart_id, items, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(cart_id) DO UPDATE SET items = excluded.items, updated_at = excluded.updated_at",
+            (cart_id, json.dumps(items, separators=(",", ":")), time.time()),
+        )
+
+    def get(self, cart_id):
+        return self._read(self._connection(), cart_id)
+
+    def set(self, cart_id, items):
+        with self._connection() as connection:
+            self._write(connection, cart_id, items)
+
+    def delete(self, cart_id):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM carts WHERE cart_id = ?", (cart_id,))
+
+    def update(self, cart_id, change):
+        """Replace the cart with ``change(items)`` in one write transaction; returns the new items."""
+        connection = self._connection()
+        # Takes the write lock before reading, so no other worker can slip in between
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            items = change(self._read(connection, cart_id))
+            if items:
+                self._write(connection, cart_id, items)
+            else:
+                connection.execute("DELETE FROM carts WHERE cart_id = ?", (cart_id,))
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+        return items
+
+
+BACKENDS = {
+    "memory": MemoryCartBackend,
+    "sqlite": SqliteCartBackend,
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if CART_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown CART_BACKEND {CART_BACKEND!r}; expected one of {sorted(BACKENDS)}")
+                _store = BACKENDS[CART_BACKEND]()
+    return _store
+
+
+# ----- The current visitor's cart -----
+
+def _cart_id(create=False):
+    cart_id = session.get("cart_id")
+    if cart_id is None and create:
+        cart_id = session["cart_id"] = secrets.token_urlsafe(16)
+    return cart_id
+
+
+def _clean(items):
+    return {str(item_id): int(quantity) for item_id, quantity in items.items() if int(quantity) > 0}
+
+
+def _move_legacy_cart():
+    """Move a cart stored in the cookie before the server-side store into the store."""
+    legacy = session.pop("cart", None)
+    if not legacy or not isinstance(legacy, dict):
+        return
+    try:
+        legacy = _clean(legacy)
+    except (TypeError, ValueError):
+        return
+    # Lines already in the stored cart win over the cookie's
+    get_store().update(_cart_id(create=True), lambda items: {**legacy, **items})
+
+
+def get_cart():
+    """``{"<menu_items_id>": quantity}`` of the current session's cart."""
+    _move_legacy_cart()
+    cart_id = _cart_id()
+    return get_store().get(cart_id) if cart_id else {}
+
+
+def save_cart(items):
+    session.pop("cart", None)
+    items = _clean(items)
+    if items:
+        get_store().set(_cart_id(create=True), items)
+    elif _cart_id():
+        get_store().delete(_cart_id())
+    return items
+
+
+def _update_cart(change):
+    """Apply ``change`` to the stored cart atomically (see the backends' ``update``)."""
+    _move_legacy_cart()
+    return get_store().update(_cart_id(create=True), lambda items: _clean(change(items)))
+
+
+def add_item(item_id, quantity=1):
+    def add(cart):
+        cart[str(item_id)] = min(cart.get(str(item_id), 0) + quantity, MAX_QUANTITY)
+        return cart
+    return _update_cart(add)
+
+
+def set_quantity(item_id, quantity):
+    """Set one line's quantity; 0 removes it."""
+    def set_line(cart):
+        cart[str(item_id)] = min(max(int(quantity), 0), MAX_QUANTITY)
+        return cart
+    return _update_cart(set_line)
+
+
+def clear_cart():
+    return save_cart({})
+
+
+# ----- Pricing -----
+
+def _money(value):
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def resolve_items(item_ids):
+    """``{menu_items_id: item}`` for ``item_ids``: the catalog first, one query for the rest."""
+    # Imported here so the cart store itself doesn't need the database models
+    import catalog_cache
+    from models import MenuItem
+    catalog = catalog_cache.get_catalog()
+    items = {item_id: catalog.item_by_id[item_id] for item_id in item_ids if item_id in catalog.item_by_id}
+    missing = [item_id for item_id in item_ids if item_id not in items]
+    if missing:
+        for item in MenuItem.query.filter(MenuItem.menu_items_id.in_(missing)):
+            items[item.menu_items_id] = item
+    return items
+
+
+def price_cart(cart):
+    """Lines and totals of ``cart``, priced with the current menu.
+
+    Unknown or unavailable (not ready to serve) items stay in the response,
+    flagged ``available: false``, and are left out of the totals.
+    """
+    quantities = {int(item_id): int(quantity) for item_id, quantity in cart.items()}
+    items = resolve_items(list(quantities))
+
+    lines = []
+    subtotal = Decimal("0")
+    item_count = 0
+    for item_id, quantity in quantities.items():
+        item = items.get(item_id)
+        available = item is not None and item.price is not None and bool(item.is_ready_to_serve)
+        unit_price = _money(item.price) if item is not None and item.price is not None else None
+        line_total = unit_price * quantity if available else Decimal("0")
+        if available:
+            subtotal += line_total
+            item_count += quantity
+        lines.append({
+            "item_id": item_id,
+            "recipe_name": item.recipe_name if item is not None else None,
+            "img_src": item.img_src if item is not None else None,
+            "quantity": quantity,
+            "unit_price": float(unit_price) if unit_price is not None else None,
+            "line_total": float(line_total),
+            "available": available,
+        })
+    return {
+        "lines": lines,
+        "item_count": item_count,
+        "subtotal": float(subtotal),
+        "unavailable": [line["item_id"] for line in lines if not line["available"]],
+    }
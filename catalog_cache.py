@@ -0,0 +1,197 @@
+"""Versioned in-process cache of the public menu catalog.
+
+``/menu``, ``/menu-items/<slug>`` and ``/api/menu/<category_id>`` used to
+query ``Category`` and ``MenuItem`` on every page view, for a menu that
+changes a few times a day.  :func:`get_catalog` instead returns a
+:class:`Catalog` snapshot built once per catalog version.  A snapshot holds:
+
+* the active categories in menu order, and every category by slug
+* the items of every category
+* the serialized ``/api/menu/<category_id>`` body of every category, served
+  with an ETag (see response_cache.py)
+* per-category pools that ``/api/menu-item/<id>`` samples its related items
+  from (:meth:`Catalog.related_items`), instead of ``ORDER BY random()``
+
+The catalog version is a small file (``CATALOG_VERSION_FILE``, in the temp
+directory by default) shared by all workers on the host.  ``add_menu_item``,
+``edit_menu_item`` and ``delete_menu_item`` call :func:`bump_version` after
+committing; it replaces the file atomically.  Every worker checks the file
+(one ``stat``) on each request and rebuilds on its next request.  Edits made
+outside the admin pages appear after at most ``CATALOG_CACHE_MAX_AGE``
+seconds.
+
+Snapshots hold plain copies of the rows, not ORM objects, so they can
+safely outlive the session they were loaded in.
+
+Related items are drawn without replacement by a seeded numpy ``Generator``,
+so the same seed always gives the same picks.  ``RELATED_ITEMS_WEIGHTING``
+can make the draw uniform (the default), or weight it by ``rating`` or by
+``popularity`` (order counts from the live recommender).
+"""
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from flask import current_app
+
+import menu_recommender
+
+from models import Category, MenuItem
+from response_cache import CachedResponse
+
+VERSION_FILE = os.environ.get("CATALOG_VERSION_FILE", os.path.join(tempfile.gettempdir(), "cafe-catalog.version"))
+MAX_AGE = float(os.environ.get("CATALOG_CACHE_MAX_AGE", "300"))
+RELATED_ITEMS = 7
+RELATED_ITEMS_WEIGHTING = os.environ.get("RELATED_ITEMS_WEIGHTING", "uniform")
+# Seconds a default (unseeded) draw of related items is kept
+RELATED_ITEMS_ROTATE = int(os.environ.get("RELATED_ITEMS_ROTATE", "300"))
+
+_lock = threading.Lock()
+_catalog = None
+# (inode, mtime) of the version file -> its contents
+_version_stat = None
+_version = "0"
+
+
+def _snapshot(row):
+    """A detached copy of every column of ``row``."""
+    return SimpleNamespace(**{column.key: getattr(row, column.key) for column in row.__table__.columns})
+
+
+def menu_item_json(item):
+    # Shape the menu page JS expects
+    return {
+        "id": item.menu_items_id,
+        "recipe_name": item.recipe_name,
+        "img_src": item.img_src,
+        "price": float(item.price) if item.price is not None else None,
+        "ingredients": item.ingredients,
+        "group": item.cuisine_path
+    }
+
+
+class Catalog:
+    def __init__(self, version, categories, items):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.categories = [category for category in categories if category.is_active]
+        self.category_by_slug = {category.slug: category for category in categories}
+        category_by_id = {category.category_id: category for category in categories}
+
+        self.items_by_category = {}
+        self.item_by_id = {}
+        for item in items:
+            item.category = category_by_id.get(item.category_id)
+            self.items_by_category.setdefault(item.category_id, []).append(item)
+            self.item_by_id[item.menu_items_id] = item
+
+        # Related-item pools: ids and ratings of every category, as arrays
+        self.pools = {
+            category_id: (
+                np.array([item.menu_items_id for item in category_items], dtype=np.int64),
+                np.array([float(item.rating or 0) for item in category_items], dtype=np.float64),
+            )
+            for category_id, category_items in self.items_by_category.items()
+        }
+
+        self.menu_responses = {
+            category_id: self._json([menu_item_json(item) for item in category_items])
+            for category_id, category_items in self.items_by_category.items()
+        }
+        self._empty = self._json([])
+
+    @staticmethod
+    def _json(data):
+        response = current_app.json.response(data)
+        return CachedResponse(response.get_data(), response.mimetype)
+
+    @classmethod
+    def load(cls, version):
+        categories = [_snapshot(c) for c in Category.query.order_by(Category.sort_order, Category.category_id)]
+        items = [_snapshot(i) for i in MenuItem.query.order_by(MenuItem.menu_items_id)]
+        return cls(version, categories, items)
+
+    def items(self, category_id):
+        return self.items_by_category.get(category_id, [])
+
+    def related_items(self, item, n, seed=None, weighting=RELATED_ITEMS_WEIGHTING):
+        """Up to ``n`` other items of ``item``'s category, sampled without replacement."""
+        ids, ratings = self.pools.get(item.category_id, (np.empty(0, dtype=np.int64), np.empty(0)))
+        others = ids != item.menu_items_id
+        ids = ids[others]
+        if not len(ids):
+            return []
+
+        weights = None
+        if weighting == "rating":
+            weights = ratings[others]
+        elif weighting == "popularity":
+            model = menu_recommender.registry.current
+            if "popularity" in model.menu_df:
+                popularity = model.menu_df["popularity"].to_numpy()
+                rows = [model.row_by_id.get(int(i)) for i in ids]
+                weights = np.array([popularity[row] if row is not None else 0 for row in rows], dtype=np.float64)
+        if weights is not None:
+            # Every item keeps a chance, so unrated or never-ordered items still show up
+            weights = weights + 1.0
+            weights /= weights.sum()
+
+        rng = np.random.default_rng(seed)
+        picked = rng.choice(len(ids), size=min(n, len(ids)), replace=False, p=weights)
+        return [self.item_by_id[int(i)] for i in ids[picked]]
+
+    def menu_response(self, category_id):
+        """The ``/api/menu/<category_id>`` response (``304`` on a matching ETag)."""
+        return self.menu_responses.get(category_id, self._empty).to_response()
+
+
+def catalog_version():
+    """The current catalog version, re-read only when the version file was replaced."""
+    global _version_stat, _version
+    try:
+        stat = os.stat(VERSION_FILE)
+    except FileNotFoundError:
+        return "0"
+    key = (stat.st_ino, stat.st_mtime_ns)
+    if key != _version_stat:
+        with open(VERSION_FILE) as f:
+            _version = f.read().strip() or "0"
+        _version_stat = key
+    return _version
+
+
+def bump_version():
+    """Mark the catalog changed for every worker (call after committing a menu edit)."""
+    global _catalog
+    version = f"{time.time_ns()}-{os.getpid()}"
+    # A private temp file per call: threads of one worker may bump at the same time
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(VERSION_FILE) + ".", suffix=".tmp",
+                               dir=os.path.dirname(VERSION_FILE) or ".")
+    try:
+        # Readable by workers running as other users, as before
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w") as f:
+            f.write(version)
+        os.replace(tmp, VERSION_FILE)
+    except Exception:
+        os.unlink(tmp)
+        raise
+    _catalog = None
+    return version
+
+
+def get_catalog():
+    """The :class:`Catalog` for the current version, building it if needed."""
+    global _catalog
+    version = catalog_version()
+    catalog = _catalog
+    if catalog is not None and catalog.version == version and time.monotonic() - catalog.built_at < MAX_AGE:
+        return catalog
+    with _lock:
+        catalog = _catalog
+        if catalog is None or catalog.version != version or time.monotonic() - catalog.built_at >= MAX_AGE:
+            catalog = _catalog = Catalog.load(version)
+    return catalog
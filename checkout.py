@@ -0,0 +1,216 @@
+"""Turns a cart into order lines in one transaction, idempotently.
+
+:func:`place_order` does the whole checkout in a single transaction:
+
+1. It claims the client's idempotency key by inserting a
+   ``checkout_requests`` row.  The row's id, plus ``ORDER_ID_OFFSET``, becomes
+   the ``order_id`` of every line.  Order ids from ``ORDER_ID_OFFSET`` up are
+   reserved for this checkout, so they can't collide with the order ids the
+   Stripe payment flow gives out below it; an id that is taken anyway fails
+   the checkout instead of merging two orders.
+2. It loads price and availability of every cart item in one ``IN (...)``
+   query.  Prices come from the database, not from the client or a cache.
+   If the client sent ``expected_total`` and the total has changed, the
+   checkout stops.
+3. It decrements stock, if ``MenuItem`` has a ``stock`` column.  Each update
+   is guarded, so a line that would go below zero fails the checkout.
+4. It bulk-inserts all ``OrderItemNew`` lines and commits once.
+
+Any failure rolls everything back, the key included, so a corrected retry
+with the same key is accepted.  A retry of a checkout that succeeded, e.g. a
+repeated payment callback, finds the stored response and gets it back
+unchanged.  Two concurrent requests with the same key cannot both insert:
+the second fails the unique constraint and replays the first.
+"""
+import json
+import os
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from sqlalchemy.exc import IntegrityError
+
+import order_history
+from extensions import db
+from models import MenuItem, OrderItemNew
+
+ORDER_STATUS = "processing"
+# checkout_requests.id + ORDER_ID_OFFSET = order_id (fits a signed 32-bit column)
+ORDER_ID_OFFSET = int(os.environ.get("CHECKOUT_ORDER_ID_OFFSET", "1000000000"))
+MAX_KEY_LENGTH = 64
+CENT = Decimal("0.01")
+
+checkout_requests = db.Table(
+    "checkout_requests",
+    db.Column("id", db.Integer, primary_key=True, autoincrement=True),
+    db.Column("idempotency_key", db.String(MAX_KEY_LENGTH), nullable=False, unique=True),
+    db.Column("user_id", db.Integer, nullable=False),
+    db.Column("response", db.Text),
+    db.Column("created_at", db.DateTime, nullable=False),
+)
+
+
+class CheckoutError(Exception):
+    """The cart can't be ordered as is; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details or {}
+
+    def to_dict(self):
+        return {"success": False, "message": str(self), **self.details}
+
+
+def _stored_response(key, user_id):
+    row = db.session.execute(
+        db.select(checkout_requests.c.user_id, checkout_requests.c.response)
+        .where(checkout_requests.c.idempotency_key == key)
+    ).first()
+    if row is None:
+        return None
+    if row.user_id != user_id:
+        raise CheckoutError("Idempotency key already used", status=409)
+    return {**json.loads(row.response), "replayed": True}
+
+
+def _price_lines(cart):
+    if not isinstance(cart, dict):
+        raise CheckoutError("Cart must map item ids to quantities")
+    quantities = {}
+    for item_id, quantity in cart.items():
+        try:
+            item_id, quantity = int(item_id), int(quantity)
+        except (TypeError, ValueError):
+            raise CheckoutError(f"Invalid cart line {item_id!r}: {quantity!r}")
+        if quantity > 0:
+            quantities[item_id] = quantity
+    if not quantities:
+        raise CheckoutError("Cart is empty")
+
+    # One query for every line's current price and availability
+    rows = db.session.execute(
+        db.select(MenuItem.menu_items_id, MenuItem.recipe_name, MenuItem.price, MenuItem.is_ready_to_serve)
+        .where(MenuItem.menu_items_id.in_(list(quantities)))
+    ).all()
+    items = {row.menu_items_id: row for row in rows}
+    unavailable = [item_id for item_id in quantities
+                   if item_id not in items or items[item_id].price is None or not items[item_id].is_ready_to_serve]
+    if unavailable:
+        raise CheckoutError("Some items are no longer available", status=409, details={"unavailable": unavailable})
+
+    lines = []
+    for item_id, quantity in quantities.items():
+        unit_price = Decimal(str(items[item_id].price)).quantize(CENT, rounding=ROUND_HALF_UP)
+        lines.append({
+            "menu_item_id": item_id,
+            "recipe_name": items[item_id].recipe_name,
+            "quantity": quantity,
+            "price": unit_price,
+        })
+    return lines
+
+
+def _parse_total(value):
+    """``expected_total`` as a ``Decimal`` in cents; ``CheckoutError`` (400) if it isn't a number."""
+    if value is None:
+        return None
+    try:
+        total = Decimal(str(value))
+    except InvalidOperation:
+        total = None
+    if isinstance(value, bool) or total is None or not total.is_finite():
+        raise CheckoutError(f"expected_total must be a number, got {value!r}")
+    return total.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _order_id(request_id):
+    order_id = ORDER_ID_OFFSET + request_id
+    taken = db.session.execute(
+        db.select(OrderItemNew.id).where(OrderItemNew.order_id == order_id).limit(1)
+    ).first()
+    if taken is not None:
+        raise RuntimeError(f"order_id {order_id} is already used by another order")
+    return order_id
+
+
+def _decrement_stock(lines):
+    stock = getattr(MenuItem, "stock", None)
+    if stock is None:
+        return
+    short = []
+    for line in lines:
+        result = db.session.execute(
+            db.update(MenuItem)
+            .where(MenuItem.menu_items_id == line["menu_item_id"], stock >= line["quantity"])
+            .values({stock: stock - line["quantity"]})
+        )
+        if result.rowcount != 1:
+            short.append(line["menu_item_id"])
+    if short:
+        raise CheckoutError("Not enough stock", status=409, details={"out_of_stock": short})
+
+
+def place_order(user_id, cart, idempotency_key, address=None, expected_total=None):
+    """Create the order for ``cart`` and return the response body (stored for replays)."""
+    if not isinstance(idempotency_key, str) or not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+        raise CheckoutError(f"An Idempotency-Key of 1-{MAX_KEY_LENGTH} characters is required")
+    expected_total = _parse_total(expected_total)
+
+    stored = _stored_response(idempotency_key, user_id)
+    if stored is not None:
+        return stored
+
+    now = datetime.now()
+    try:
+        request_id = db.session.execute(
+            checkout_requests.insert().values(idempotency_key=idempotency_key, user_id=user_id, created_at=now)
+        ).inserted_primary_key[0]
+        order_id = _order_id(request_id)
+
+        lines = _price_lines(cart)
+        total = sum((line["price"] * line["quantity"] for line in lines), Decimal("0"))
+        if expected_total is not None and expected_total != total:
+            raise CheckoutError("Prices changed since the cart was shown", status=409,
+                                details={"total": float(total)})
+        _decrement_stock(lines)
+
+        db.session.bulk_insert_mappings(OrderItemNew, [
+            {
+                "user_id": user_id,
+                "menu_item_id": line["menu_item_id"],
+                "order_id": order_id,
+                "order_date": now,
+                "address": address,
+                "status": ORDER_STATUS,
+                "quantity": line["quantity"],
+                "price": float(line["price"]),
+            }
+            for line in lines
+        ])
+
+        response = {
+            "success": True,
+            "order_id": order_id,
+            "lines": [{**line, "price": float(line["price"])} for line in lines],
+            "total": float(total),
+            "replayed": False,
+        }
+        db.session.execute(
+            checkout_requests.update().where(checkout_requests.c.id == request_id)
+            .values(response=json.dumps(response))
+        )
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request with the same key committed first
+        db.session.rollback()
+        stored = _stored_response(idempotency_key, user_id)
+        if stored is None:
+            raise
+        return stored
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Bulk inserts skip the ORM events that refresh the order history summary
+    order_history.invalidate(user_id)
+    return response
@@ -0,0 +1,141 @@
+"""Multi-field, weighted TF-IDF features for the menu recommender.
+
+Each text field of a menu item gets its own ``TfidfVectorizer``; the per-field
+matrices are scaled by ``sqrt(weight)``, stacked side by side with
+``scipy.sparse.hstack`` and L2-normalised.  The dot product of two rows is
+then the weight-averaged cosine similarity of the fields, and everything
+stays sparse end to end.
+
+Weights are read from ``RECOMMENDER_FIELD_WEIGHTS``, either inline JSON
+(``{"recipe_name": 2, "ingredients": 1}``) or the path of a JSON file, so
+they can be tuned without code changes.  A weight of 0 drops the field.
+"""
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+DEFAULT_FIELD_WEIGHTS = {
+    "recipe_name": 1.0,
+    "ingredients": 1.0,
+    "cleaned_ingredients": 0.5,
+    "cuisine_path": 0.25,
+}
+
+
+def load_field_weights(value=None):
+    """Field weights from ``value`` / ``RECOMMENDER_FIELD_WEIGHTS`` or the defaults."""
+    value = value if value is not None else os.environ.get("RECOMMENDER_FIELD_WEIGHTS")
+    if not value:
+        return dict(DEFAULT_FIELD_WEIGHTS)
+    if os.path.isfile(value):
+        with open(value) as f:
+            weights = json.load(f)
+    else:
+        weights = json.loads(value)
+    return {field: float(weight) for field, weight in weights.items() if float(weight) > 0}
+
+
+class MultiFieldVectorizer:
+    """One TF-IDF vectorizer per field, combined into a single sparse matrix."""
+
+    def __init__(self, field_weights=None, stop_words="english"):
+        self.field_weights = dict(field_weights or load_field_weights())
+        self.stop_words = stop_words
+        # field -> fitted TfidfVectorizer, or None if the field had no terms
+        self.vectorizers = {}
+
+    def _new_vectorizer(self, vocabulary=None):
+        return TfidfVectorizer(stop_words=self.stop_words, vocabulary=vocabulary, dtype=np.float32)
+
+    @property
+    def vocabulary_size(self):
+        return sum(len(v.vocabulary_) for v in self.vectorizers.values() if v is not None)
+
+    @property
+    def n_features(self):
+        return self.vocabulary_size
+
+    def _combine(self, blocks, n_rows):
+        if not blocks:
+            return sp.csr_matrix((n_rows, 0), dtype=np.float32)
+        combined = sp.hstack(blocks, format="csr", dtype=np.float32)
+        return normalize(combined, norm="l2", copy=False)
+
+    def _field_text(self, menu_df, field):
+        return menu_df[field].fillna('').astype(str) if field in menu_df else [''] * len(menu_df)
+
+    def fit_transform(self, menu_df):
+        blocks = []
+        self.vectorizers = {}
+        for field, weight in self.field_weights.items():
+            vectorizer = self._new_vectorizer()
+            try:
+                block = vectorizer.fit_transform(self._field_text(menu_df, field))
+            except ValueError:
+                # Empty vocabulary (field blank everywhere): contributes nothing
+                self.vectorizers[field] = None
+                continue
+            self.vectorizers[field] = vectorizer
+            blocks.append(block * np.float32(np.sqrt(weight)))
+        return self._combine(blocks, len(menu_df))
+
+    def transform(self, menu_df):
+        blocks = []
+        for field, weight in self.field_weights.items():
+            vectorizer = self.vectorizers.get(field)
+            if vectorizer is not None:
+                blocks.append(vectorizer.transform(self._field_text(menu_df, field)) * np.float32(np.sqrt(weight)))
+        return self._combine(blocks, len(menu_df))
+
+    def transform_query(self, text):
+        """Vectorize free text (e.g. a search query) against every field."""
+        blocks = []
+        for field, weight in self.field_weights.items():
+            vectorizer = self.vectorizers.get(field)
+            if vectorizer is not None:
+                blocks.append(vectorizer.transform([text]) * np.float32(np.sqrt(weight)))
+        return self._combine(blocks, 1)
+
+    def unknown_terms(self, menu_df):
+        """Terms in ``menu_df`` the fitted vocabularies don't contain."""
+        unknown = set()
+        for field, vectorizer in self.vectorizers.items():
+            if vectorizer is None:
+                continue
+            analyzer = vectorizer.build_analyzer()
+            for text in self._field_text(menu_df, field):
+                unknown.update(
+                    f"{field}:{term}" for term in analyzer(text) if term not in vectorizer.vocabulary_
+                )
+        return unknown
+
+    # ----- Persistence (see recommender_artifacts.py) -----
+
+    def get_state(self):
+        """JSON-serialisable config plus per-field ``idf`` arrays."""
+        config = {
+            "stop_words": self.stop_words,
+            "field_weights": self.field_weights,
+            "vocabularies": {
+                field: {term: int(col) for term, col in v.vocabulary_.items()} if v is not None else None
+                for field, v in self.vectorizers.items()
+            },
+        }
+        idfs = {field: v.idf_ for field, v in self.vectorizers.items() if v is not None}
+        return config, idfs
+
+    @classmethod
+    def from_state(cls, config, idfs):
+        engine = cls(config["field_weights"], stop_words=config["stop_words"])
+        for field, vocabulary in config["vocabularies"].items():
+            if vocabulary is None:
+                engine.vectorizers[field] = None
+                continue
+            vectorizer = engine._new_vectorizer(vocabulary)
+            vectorizer.idf_ = np.asarray(idfs[field], dtype=np.float64)
+            engine.vectorizers[field] = vectorizer
+        return engine
@@ -0,0 +1,200 @@
+"""Bulk import and export of menu items as CSV (``menu_items.csv`` schema).
+
+:func:`import_menu_csv` reads an uploaded file as a stream, ``IMPORT_CHUNK_SIZE``
+rows at a time.  It validates every row and upserts each chunk in one
+transaction: one query finds the ids that already exist, then
+``bulk_update_mappings`` / ``bulk_insert_mappings`` write the chunk.  Rows
+with a ``menu_items_id`` update that item if it exists and are inserted
+with that id otherwise, so ``menu_items.csv`` or an export from another
+environment loads into an empty table as is.  Rows without one are
+inserted and get their id from the database.  MySQL moves AUTO_INCREMENT
+past explicit ids by itself; on PostgreSQL the id sequence is reset to the
+largest id once after the import, so later inserts don't collide.
+Invalid rows are skipped and reported with their line number.  A chunk that
+fails to commit is rolled back and all its rows are reported.
+
+The caller refreshes the derived state once at the end: the catalog version
+(catalog_cache.py) and a single recommender refit (recommender_sync.py).
+Per-row updates would cost one neighbour patch per item.
+
+:func:`export_menu_csv` yields the table as CSV text in keyset-paginated
+batches, so the export never holds the whole menu in memory.
+"""
+import csv
+import io
+import math
+import os
+from itertools import islice
+
+from extensions import db
+from models import Category, MenuItem
+from recommender_model import MENU_COLUMNS
+
+IMPORT_CHUNK_SIZE = int(os.environ.get("MENU_IMPORT_CHUNK_SIZE", "500"))
+EXPORT_BATCH_SIZE = 1000
+REQUIRED_COLUMNS = ("recipe_name", "price", "category_id")
+TEXT_COLUMNS = ("recipe_name", "prep_time", "cook_time", "total_time", "ingredients", "cuisine_path", "nutrition",
+                "img_src", "cleaned_ingredients")
+# Errors listed in the report; the counts stay exact
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+        }
+
+
+def _number(value, kind, column, minimum=None, maximum=None):
+    try:
+        number = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{column} must be a number, got {value!r}")
+    if not math.isfinite(number):
+        raise ValueError(f"{column} must be a finite number, got {value!r}")
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise ValueError(f"{column} must be between {minimum} and {maximum}, got {value!r}")
+    return number
+
+
+def _flag(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "y", "on")
+
+
+def parse_row(row, category_ids):
+    """Validate one CSV row; return ``MenuItem`` column values or raise ``ValueError``."""
+    values = {}
+    for column in TEXT_COLUMNS:
+        if column in row:
+            values[column] = (row[column] or "").strip() or None
+    if not values.get("recipe_name"):
+        raise ValueError("recipe_name is required")
+
+    values["price"] = _number(row.get("price"), float, "price", minimum=0)
+    values["category_id"] = _number(row.get("category_id"), int, "category_id")
+    if values["category_id"] not in category_ids:
+        raise ValueError(f"unknown category_id {values['category_id']}")
+    if (row.get("rating") or "").strip():
+        values["rating"] = _number(row["rating"], float, "rating", minimum=0, maximum=5)
+    if "is_ready_to_serve" in row:
+        values["is_ready_to_serve"] = _flag(row["is_ready_to_serve"])
+    if (row.get("menu_items_id") or "").strip():
+        values["menu_items_id"] = _number(row["menu_items_id"], int, "menu_items_id", minimum=1)
+    return values
+
+
+def _write_chunk(chunk, report):
+    ids = [values["menu_items_id"] for _, values in chunk if "menu_items_id" in values]
+    existing = set()
+    if ids:
+        existing = {item_id for (item_id,) in
+                    db.session.query(MenuItem.menu_items_id).filter(MenuItem.menu_items_id.in_(ids))}
+    updates = [values for _, values in chunk if values.get("menu_items_id") in existing]
+    inserts = [values for _, values in chunk if values.get("menu_items_id") not in existing]
+    try:
+        if updates:
+            db.session.bulk_update_mappings(MenuItem, updates)
+        if inserts:
+            db.session.bulk_insert_mappings(MenuItem, inserts)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        for line, _ in chunk:
+            report.error(line, f"chunk rolled back: {e}")
+        return
+    report.updated += len(updates)
+    report.inserted += len(inserts)
+
+
+def _reset_id_sequence():
+    """Move PostgreSQL's id sequence past ids inserted explicitly (MySQL does it itself)."""
+    if db.session.get_bind().dialect.name != "postgresql":
+        return
+    table, column = MenuItem.__table__.name, MenuItem.menu_items_id.key
+    db.session.execute(db.text(
+        f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+        f"(SELECT COALESCE(MAX({column}), 1) FROM {table}))"
+    ))
+    db.session.commit()
+
+
+def import_menu_csv(stream, chunk_size=IMPORT_CHUNK_SIZE):
+    """Upsert every valid row of the CSV byte ``stream``; return an :class:`ImportReport`."""
+    report = ImportReport()
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV is missing required columns: {', '.join(missing)}")
+
+    category_ids = {category_id for (category_id,) in db.session.query(Category.category_id)}
+    while True:
+        rows = list(islice(reader, chunk_size))
+        if not rows:
+            break
+        chunk = []
+        seen = set()
+        for row in rows:
+            report.rows += 1
+            # Line in the file, counting the header as line 1
+            line = report.rows + 1
+            try:
+                values = parse_row(row, category_ids)
+            except ValueError as e:
+                report.error(line, str(e))
+                continue
+            item_id = values.get("menu_items_id")
+            if item_id is not None:
+                if item_id in seen:
+                    report.error(line, f"menu_items_id {item_id} appears twice in one chunk")
+                    continue
+                seen.add(item_id)
+            chunk.append((line, values))
+        if chunk:
+            _write_chunk(chunk, report)
+    if report.inserted:
+        _reset_id_sequence()
+    return report
+
+
+def export_menu_csv(batch_size=EXPORT_BATCH_SIZE):
+    """Yield the whole menu as CSV text, one batch of rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+    writer.writerow(MENU_COLUMNS)
+    columns = [getattr(MenuItem, column) for column in MENU_COLUMNS]
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(*columns).where(MenuItem.menu_items_id > last_id)
+            .order_by(MenuItem.menu_items_id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            record = dict(zip(MENU_COLUMNS, row))
+            record["is_ready_to_serve"] = int(bool(record["is_ready_to_serve"]))
+            writer.writerow(["" if value is None else value for value in record.values()])
+        last_id = rows[-1][0]
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -1,103 +1,242 @@
 # %%
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import requests
+import json
+import os
+import numpy as np
+import scipy.sparse as sp
+import recommender_shared
+from recommender_artifacts import BASE_DIR, load_bundle
+from collaborative_filtering import get_cf_model
+from model_registry import ModelRegistry
+from neighbor_index import top_k
+from recommender_model import (CART_RECOMMENDATION_COLUMNS, ITEM_RECOMMENDATION_COLUMNS, RecommenderModel,
+                                category_map, normalize_name, weather_to_category)
+from weather_provider import WeatherUnavailable, get_provider
 
-# %%
-menu_df = pd.read_csv("menu_items.csv")
-# %%
-category_map = {
-    1: "Breakfast",
-    2: "Lunch Specials",
-    3: "Dinner Dishes",
-    4: "Desserts",
-    5: "Hot Drinks",
-    6: "Cold Drinks",
-    7: "Salads and Sides",
-    8: "Kid's Menu"
-}
-# %%
-menu_df["category_name"] = menu_df["category_id"].map(category_map)
+MENU_CSV = os.path.join(BASE_DIR, "menu_items.csv")
+OPENWEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY", "f7c3d772751b67eb57a49e49dda6e3ed")
 
-# %%
-menu_df["features"] = (
-        menu_df["recipe_name"].fillna('') + " " +
-        menu_df["cuisine_path"].fillna('') + " " +
-        menu_df["cleaned_ingredients"].fillna('') + " " +
-        menu_df["ingredients"].fillna('')
-)
 
 # %%
-tfidf = TfidfVectorizer(stop_words="english")
-tfidf_matrix = tfidf.fit_transform(menu_df["recipe_name"] + " " + menu_df["ingredients"])
-cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
+def load_private_model():
+    """Open the prebuilt bundle, or fit from the CSV if none has been built yet."""
+    try:
+        return load_bundle()
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Recommender bundle unavailable ({e}); fitting from {MENU_CSV}. "
+              f"Run `python recommender_artifacts.py build` to skip this at startup.")
+        return RecommenderModel.fit_csv(MENU_CSV)
 
-# %%
-indices = pd.Series(menu_df.index, index=menu_df["recipe_name"]).drop_duplicates()
+
+def load_model():
+    """Map the model shared by all workers (see recommender_shared.py), if enabled."""
+    if recommender_shared.enabled():
+        try:
+            key = recommender_shared.source_key(csv_path=MENU_CSV)
+            return recommender_shared.attach(load_private_model, key)
+        except (OSError, ValueError) as e:
+            print("Shared recommender unavailable, loading a private copy:", e)
+    return load_private_model()
+
+
+# The live model; swapped at runtime without a restart (see model_registry.py)
+registry = ModelRegistry()
+
+
+def init_model():
+    """Load the startup model once per process; ``create_app`` calls this.
+
+    Not done at import, so scripts that only need the module (the benchmark
+    swaps in its own models) never load, fit or publish one.
+    """
+    with registry.lock:
+        if registry.current is None:
+            registry.load(load_model, "startup")
+    return registry.current
+
+
+def __getattr__(name):
+    # ``menu_recommender.model`` still reads the current model
+    if name == "model":
+        return registry.current
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # %%
+def _item_rows(current, item_name=None, item_id=None, num_recommendations=5):
+    """Rows of the nearest items, best first, or ``None`` if the item is unknown.
+
+    Only the ``k`` nearest items of each item are precomputed
+    (``neighbor_index.DEFAULT_K``, 20, unless the bundle was built with
+    another ``k``), so at most ``k`` rows come back.
+    """
+    num_recommendations = max(0, min(int(num_recommendations), current.neighbor_index.k))
+    if item_id is not None:
+        idx = current.row_by_id.get(int(item_id))
+    else:
+        idx = current.row_by_name.get(normalize_name(item_name))
+    if idx is None:
+        return None
+    # Nearest items are precomputed, best first, without the item itself
+    item_indices, _ = current.neighbor_index.neighbors(idx, num_recommendations)
+    return item_indices
+
+
 def recommend_menu(item_name, num_recommendations=5):
-    if item_name not in menu_df["recipe_name"].values:
+    """The items most similar to ``item_name``; at most the index's ``k`` (20 by default)."""
+    current = registry.current
+    rows = _item_rows(current, item_name=item_name, num_recommendations=num_recommendations)
+    if rows is None:
         return f"{item_name} not found in dataset."
+    return current.menu_df.iloc[rows][ITEM_RECOMMENDATION_COLUMNS]
+
+
+def recommend_menu_by_id(item_id, num_recommendations=5):
+    """Same as :func:`recommend_menu` (also capped at ``k``), keyed by ``menu_items_id``."""
+    current = registry.current
+    rows = _item_rows(current, item_id=item_id, num_recommendations=num_recommendations)
+    if rows is None:
+        return f"Menu item {item_id} not found in dataset."
+    return current.menu_df.iloc[rows][ITEM_RECOMMENDATION_COLUMNS]
+
+
+# %%
+def _cart_rows(current, cart, num_recommendations):
+    if not isinstance(cart, dict):
+        cart = {item_id: 1 for item_id in cart}
+
+    rows, weights = [], []
+    for item_id, weight in cart.items():
+        try:
+            row, weight = current.row_by_id.get(int(item_id)), float(weight)
+        except (TypeError, ValueError):
+            # A malformed line matches no item, like an unknown id
+            continue
+        if row is not None and np.isfinite(weight):
+            rows.append(row)
+            weights.append(weight)
+    rows = np.asarray(rows, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float32)
+    if not len(rows):
+        return rows
 
-    # Get index of the item
-    idx = menu_df.index[menu_df["recipe_name"] == item_name][0]
+    # Weighted sum of the cart items' similarity rows: M @ (M[cart]^T @ w),
+    # scored by the model's backend (exact, or approximate for large catalogs)
+    profile = sp.csr_matrix(weights) @ current.tfidf_matrix[rows]
+    # never suggest what is already in the cart
+    item_indices, _ = current.backend.query(profile, num_recommendations, exclude=rows)
+    return item_indices
 
-    # Get similarity scores for this item
-    sim_scores = list(enumerate(cosine_sim[idx]))
 
-    # Sort by similarity (highest first), skip the item itself
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)[1:num_recommendations + 1]
+def recommend_for_cart(cart, num_recommendations=8):
+    """Recommend items for a whole cart in one vectorized pass.
 
-    # Get recommended item indices
-    item_indices = [i[0] for i in sim_scores]
+    ``cart`` maps menu item ids to weights (e.g. the session cart
+    ``{"12": 2, "31": 1}``); a plain list of ids weighs each item 1.
+    Unknown or malformed ids are ignored.
+    """
+    current = registry.current
+    return current.menu_df.iloc[_cart_rows(current, cart, num_recommendations)][CART_RECOMMENDATION_COLUMNS]
 
-    return menu_df.iloc[item_indices][["recipe_name", "ingredients", "category_id", "price"]]
 
+def cart_recommendations_json(cart, num_recommendations=8):
+    """:func:`recommend_for_cart` as a JSON array, built from prebuilt records."""
+    current = registry.current
+    return current.fragments_json("cart", _cart_rows(current, cart, num_recommendations))
 
 
 # %%
-menu_df['category_name'] = menu_df['category_id'].map(category_map)
+def _user_rows(current, user_id, num_recommendations):
+    cf_model = get_cf_model()
+    if cf_model is None:
+        return []
+    # Ask for a few extra in case some items were deleted since training
+    item_ids = cf_model.recommend(user_id, num_recommendations * 2)
+    rows = [current.row_by_id[int(i)] for i in item_ids if int(i) in current.row_by_id]
+    return rows[:num_recommendations]
+
+
+def recommend_for_user(user_id, num_recommendations=8):
+    """Personalised items from the collaborative-filtering model.
+
+    Returns an empty frame until a model has been trained with
+    ``python collaborative_filtering.py train``.
+    """
+    current = registry.current
+    return current.menu_df.iloc[_user_rows(current, user_id, num_recommendations)][CART_RECOMMENDATION_COLUMNS]
+
+
+def user_recommendations_json(user_id, num_recommendations=8):
+    """:func:`recommend_for_user` as a JSON array, built from prebuilt records."""
+    current = registry.current
+    return current.fragments_json("cart", _user_rows(current, user_id, num_recommendations))
+
+
 # %%
-weather_to_category = {
-    "Clear": ["Cold Drinks", "Salads and Sides", "Breakfast", "Desserts"],
-    "Hot": ["Cold Drinks", "Desserts", "Salads and Sides"],
-    "Rain": ["Hot Drinks", "Dinner Dishes"],
-    "Drizzle": ["Hot Drinks", "Lunch Specials"],
-    "Clouds": ["Hot Drinks", "Lunch Specials", "Dinner Dishes"],
-    "Thunderstorm": ["Hot Drinks", "Dinner Dishes"],
-    "Mist": ["Hot Drinks", "Breakfast"],
-    "Haze": ["Cold Drinks", "Salads and Sides", "Lunch Specials"],
-    "Fog": ["Hot Drinks", "Breakfast"],
-    "Smoke": ["Hot Drinks", "Lunch Specials"],
-    "Dust": ["Cold Drinks", "Salads and Sides"]
-}
+def _search_rows(current, query, num_results, category_id=None, min_price=None, max_price=None):
+    # The query is vectorized like a menu item, so "spicy noodle chicken"
+    # matches names, ingredients and cuisine through the fitted vocabulary
+    vector = current.tfidf.transform_query(query)
+    if not vector.nnz:
+        return np.empty(0, dtype=np.int64)
+    # One sparse mat-vec over the catalog; unrelated items score 0
+    scores = current.similarities(vector)
+    allowed = np.array(current.active, dtype=bool) & (scores > 0)
+    if category_id is not None:
+        allowed &= current.menu_df["category_id"].to_numpy() == category_id
+    if min_price is not None or max_price is not None:
+        prices = current.menu_df["price"].to_numpy(dtype=float)
+        if min_price is not None:
+            allowed &= prices >= min_price
+        if max_price is not None:
+            allowed &= prices <= max_price
+    scores[~allowed] = -np.inf
+    rows = top_k(scores, num_results)
+    return rows[np.isfinite(scores[rows])]
+
+
+def semantic_search(query, num_results=10, category_id=None, min_price=None, max_price=None):
+    """Items most similar to free-text ``query``, optionally filtered by category and price."""
+    current = registry.current
+    rows = _search_rows(current, query, num_results, category_id, min_price, max_price)
+    return current.menu_df.iloc[rows][CART_RECOMMENDATION_COLUMNS]
+
+
+def semantic_search_json(query, num_results=10, category_id=None, min_price=None, max_price=None):
+    """:func:`semantic_search` as a JSON array, built from prebuilt records."""
+    current = registry.current
+    return current.fragments_json("cart", _search_rows(current, query, num_results, category_id,
+                                                       min_price, max_price))
 
 
 # %%
-def get_myanmar_weather_by_latlon(lat, lon, api_key):
-    url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}&units=metric"
-    response = requests.get(url).json()
-    weather = response["weather"][0]["main"]
-    temp = response["main"]["temp"]
-    return weather, temp
+def get_myanmar_weather_by_latlon(lat, lon, api_key=OPENWEATHER_API_KEY):
+    # Cached per rounded lat/lon, refreshed in the background (see weather_provider.py)
+    return get_provider(api_key).get(lat, lon)
+
+
+def current_weather(lat=16.8409, lon=96.1735, api_key=OPENWEATHER_API_KEY):
+    """``(condition, temperature)``, or ``(None, None)`` if the weather API is down."""
+    try:
+        return get_myanmar_weather_by_latlon(lat, lon, api_key)
+    except WeatherUnavailable as e:
+        # Still serve the item-based half when the weather API is down
+        print("Weather unavailable:", e)
+        return None, None
 
 
 # %%
-def recommend_menu_with_weather(item_name, lat=16.8409, lon=96.1735, api_key="f7c3d772751b67eb57a49e49dda6e3ed",
-                                num_recommendations=8):
+def recommend_menu_with_weather(item_name=None, lat=16.8409, lon=96.1735, api_key=OPENWEATHER_API_KEY,
+                                num_recommendations=8, item_id=None):
 
-    item_based = recommend_menu(item_name, num_recommendations)
+    if item_id is not None:
+        item_based = recommend_menu_by_id(item_id, num_recommendations)
+    else:
+        item_based = recommend_menu(item_name, num_recommendations)
 
-    weather, temp = get_myanmar_weather_by_latlon(lat, lon, api_key)
-    recommended_categories = weather_to_category.get(weather, [])
+    weather, temp = current_weather(lat, lon, api_key)
 
-    weather_based = menu_df[menu_df['category_name'].isin(recommended_categories)].head(num_recommendations)
-    weather_based = weather_based[[
-        "recipe_name", "ingredients", "category_id", "category_name", "price", "img_src"
-    ]]
+    # Ranked per weather and temperature band at load time (list of dicts)
+    weather_based = registry.current.weather_payload(weather, temp)[:num_recommendations]
 
     return {
         "clicked_item_recommendation": item_based,
@@ -106,18 +245,39 @@ def recommend_menu_with_weather(item_name, lat=16.8409, lon=96.1735, api_key="f7
         "temperature": temp
     }
 
+
+def recommendations_json(item_name=None, lat=16.8409, lon=96.1735, api_key=OPENWEATHER_API_KEY,
+                         num_recommendations=8, item_id=None, weather=None):
+    """The body of :func:`recommend_menu_with_weather` as a JSON string.
+
+    Joins the model's prebuilt per-item fragments, so no DataFrame or dict
+    is created per request.  An unknown item gives an empty item list, and
+    the item list holds at most the neighbour index's ``k`` (20 by default)
+    items, whatever ``num_recommendations`` asks for.
+    ``weather`` is a ``(condition, temperature)`` pair already looked up with
+    :func:`current_weather`.
+    """
+    current = registry.current
+    rows = _item_rows(current, item_name, item_id, num_recommendations)
+    weather, temp = weather or current_weather(lat, lon, api_key)
+    # Keys in sorted order, like jsonify
+    return (
+        '{"clicked_item_recommendation":' + current.fragments_json("item", [] if rows is None else rows) +
+        ',"temperature":' + json.dumps(temp) +
+        ',"weather":' + json.dumps(weather) +
+        ',"weather_based_recommendation":' + current.weather_json(weather, temp, num_recommendations) + "}"
+    )
+
 # %%
 if __name__ == "__main__":
+    init_model()
     # Ask the user for the menu item they clicked
     user_item = input("Enter the menu item you want recommendations for: ")
 
     # Call the weather-based recommendation
-    result = recommend_menu_with_weather(user_item, api_key="f7c3d772751b67eb57a49e49dda6e3ed")
+    result = recommend_menu_with_weather(user_item)
 
     # Display results
     print("\nWeather:", result["weather"], "-", result["temperature"])
     print("\nItem-based recommendation:\n", result["clicked_item_recommendation"])
     print("\nWeather-based recommendation:\n", result["weather_based_recommendation"])
-
-# %%
-print(menu_df.columns)
@@ -0,0 +1,176 @@
+"""The live recommender, held behind a single swappable reference.
+
+``menu_recommender`` used to build its model as module state at import, so
+a new model meant a redeploy.  Now :class:`ModelRegistry` holds the current
+:class:`RecommenderModel`.  Request code reads ``registry.current`` once and
+keeps using that object until the request ends.  A served model is never
+changed: menu edits go through :meth:`ModelRegistry.edit`, which patches a
+copy and swaps the reference.  Replacing the reference therefore never
+disturbs a request in flight: it finishes on the model it started with, and
+the old model is freed when the last such request returns.
+
+A new model is loaded off the request path
+(:meth:`ModelRegistry.load_in_background`) and put through :func:`smoke_test`.
+Only then is it swapped in.  Edits made while it was loading are replayed
+on it first, so a reload never drops them.  If loading or the check fails,
+the current model keeps serving and the error is reported by
+:meth:`ModelRegistry.info` on the admin dashboard.
+"""
+import json
+import threading
+import time
+
+import numpy as np
+
+SMOKE_QUERY_SIZE = 5
+
+
+class ModelRejected(Exception):
+    """A loaded model failed its smoke test and was never served."""
+
+
+def smoke_test(model, num_recommendations=SMOKE_QUERY_SIZE):
+    """Run the request paths once against ``model``; raise :class:`ModelRejected` if one fails."""
+    active = np.flatnonzero(model.active)
+    if not len(active):
+        raise ModelRejected("model has no active items")
+    row = int(active[0])
+    item_rows, _ = model.neighbor_index.neighbors(row, num_recommendations)
+    query_rows, _ = model.backend.query(model.tfidf_matrix[row], num_recommendations, exclude=[row])
+    for rows in (item_rows, query_rows):
+        if len(rows) and (np.min(rows) < 0 or np.max(rows) >= len(model.menu_df)):
+            raise ModelRejected(f"neighbour rows out of range for {len(model.menu_df)} items")
+    try:
+        json.loads(model.fragments_json("item", item_rows))
+        json.loads(model.fragments_json("cart", query_rows))
+        json.loads(model.weather_json(None, None, num_recommendations))
+    except (KeyError, IndexError, ValueError) as e:
+        raise ModelRejected(f"response fragments are broken: {e!r}") from e
+
+
+class ModelRegistry:
+    """The current model plus where it came from and when it was loaded.
+
+    ``lock`` is held while the reference is swapped, by :meth:`swap` and by
+    :meth:`edit`, so an edit never lands on a model that is being replaced.
+    """
+
+    def __init__(self):
+        self.current = None
+        self.lock = threading.RLock()
+        self.source = None
+        self.loaded_at = None
+        self.load_seconds = None
+        self.previous_version = None
+        self.swaps = 0
+        self.last_error = None
+        self._listeners = []
+        self._load_thread = None
+        # One list per running load: the edits to replay on the model it loads
+        self._replay_logs = []
+
+    def subscribe(self, callback):
+        """Call ``callback(model)`` after every swap (e.g. to empty response caches)."""
+        self._listeners.append(callback)
+
+    def swap(self, model, source, load_seconds=None, check=True):
+        """Smoke-test ``model`` and make it current; return the model it replaced."""
+        if check:
+            smoke_test(model)
+        with self.lock:
+            previous = self.current
+            self.current = model
+            self.previous_version = previous.version if previous is not None else None
+            self.source = source
+            self.loaded_at = time.time()
+            self.load_seconds = load_seconds
+            self.swaps += 1
+            self.last_error = None
+        for callback in self._listeners:
+            callback(model)
+        return previous
+
+    def edit(self, change):
+        """Copy, patch and swap: make ``change(current)`` the current model and return it.
+
+        ``change`` returns a new model (see ``RecommenderModel.upserted``) and
+        runs under ``lock``, so concurrent edits apply one after the other.
+        Unlike :meth:`swap` this skips the smoke test and the listeners: an
+        edit patches the search index and response cache itself.
+        """
+        with self.lock:
+            self.current = change(self.current)
+            for log in self._replay_logs:
+                log.append(change)
+            return self.current
+
+    def load(self, loader, source):
+        """Build a model with ``loader()`` and swap it in; return the new model.
+
+        Edits made through :meth:`edit` while ``loader()`` runs are replayed
+        on the new model before the swap, so none is lost.
+        """
+        start = time.perf_counter()
+        log = []
+        with self.lock:
+            self._replay_logs.append(log)
+        try:
+            model = loader()
+            with self.lock:
+                for change in log:
+                    model = change(model)
+                self.swap(model, source, time.perf_counter() - start)
+        finally:
+            with self.lock:
+                # By identity: two logs with the same edits compare equal
+                self._replay_logs = [other for other in self._replay_logs if other is not log]
+        return model
+
+    def load_in_background(self, loader, source, on_loaded=None):
+        """:meth:`load` in a thread; ``False`` if a load is already running.
+
+        ``on_loaded(model)`` runs after a successful swap.
+        """
+        with self.lock:
+            if self.loading():
+                return False
+            self._load_thread = threading.Thread(target=self._load_quietly, args=(loader, source, on_loaded),
+                                                 name="recommender-load", daemon=True)
+            self._load_thread.start()
+        return True
+
+    def _load_quietly(self, loader, source, on_loaded):
+        try:
+            model = self.load(loader, source)
+            if on_loaded is not None:
+                on_loaded(model)
+            print(f"Recommender {model.version} loaded from {source} in {self.load_seconds:.2f}s")
+        except Exception as e:
+            # Keep serving the current model
+            self.last_error = f"{source}: {e}"
+            print("Loading the recommender from", source, "failed:", e)
+        finally:
+            self._load_thread = None
+
+    def loading(self):
+        thread = self._load_thread
+        return thread is not None and thread.is_alive()
+
+    def info(self):
+        """Version and load details of the current model, for the admin dashboard."""
+        model = self.current
+        return {
+            "version": model.version if model is not None else None,
+            "bundle_version": model.bundle_version if model is not None else None,
+            "revision": model.revision if model is not None else None,
+            "backend": model.backend.name if model is not None else None,
+            "items": int(np.count_nonzero(model.active)) if model is not None else 0,
+            "source": self.source,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at))
+            if self.loaded_at else None,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "previous_version": self.previous_version,
+            "swaps": self.swaps,
+            "loading": self.loading(),
+            "last_error": self.last_error,
+        }
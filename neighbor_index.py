@@ -0,0 +1,167 @@
+"""Compact top-k neighbour index used by the menu recommender.
+
+Instead of keeping the full N x N cosine similarity matrix around, only the
+``k`` most similar items of every row are stored, as two small float32/int32
+arrays.  Rows of the TF-IDF matrix are L2-normalised, so a plain dot product
+is the cosine similarity.
+"""
+import sys
+import time
+
+import numpy as np
+
+DEFAULT_K = 20
+DEFAULT_CHUNK_SIZE = 1024
+
+
+class NeighborIndex:
+    """Top-k neighbour ids and scores per item, sorted best first."""
+
+    def __init__(self, ids, scores):
+        self.ids = ids
+        self.scores = scores
+
+    @property
+    def k(self):
+        return self.ids.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.scores.nbytes
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def neighbors(self, row, n):
+        """Return ``(ids, scores)`` of the ``n`` nearest items to ``row``."""
+        ids, scores = self.ids[row, :n], self.scores[row, :n]
+        if len(scores) and not np.isfinite(scores[-1]):
+            # Fewer than n live items left (deleted items are scored -inf)
+            valid = np.isfinite(scores)
+            ids, scores = ids[valid], scores[valid]
+        return ids, scores
+
+
+def top_k(scores, k):
+    """Indices of the ``k`` largest ``scores``, best first, via partial selection."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k] if k < scores.shape[0] else np.arange(scores.shape[0])
+    return top[np.lexsort((top, -scores[top]))]
+
+
+def _top_k_rows(block, k, row_ids, excluded=None):
+    """Top-k column ids/scores of every row of a dense similarity block."""
+    # Never recommend an item for itself, nor a deleted one
+    block[np.arange(block.shape[0]), row_ids] = -np.inf
+    if excluded is not None:
+        block[:, excluded] = -np.inf
+
+    if k < block.shape[1]:
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(block.shape[1]), (block.shape[0], 1))
+    top_scores = np.take_along_axis(block, top, axis=1)
+
+    # Highest score first, lower item index first on ties (same as the old
+    # stable sorted() over the full row)
+    order = np.lexsort((top, -top_scores), axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def neighbor_rows(matrix, row_ids, k, excluded=None, chunk_size=DEFAULT_CHUNK_SIZE, matrix_t=None):
+    """Exact top-k ``(ids, scores)`` for the given rows of ``matrix``.
+
+    ``excluded`` is an optional boolean mask of columns (e.g. deleted items)
+    that must never be returned as neighbours.
+    """
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    ids = np.empty((len(row_ids), k), dtype=np.int32)
+    scores = np.empty((len(row_ids), k), dtype=np.float32)
+    if matrix_t is None:
+        matrix_t = matrix.T.tocsc() if hasattr(matrix, "tocsc") else matrix.T
+
+    for start in range(0, len(row_ids), chunk_size):
+        chunk = row_ids[start:start + chunk_size]
+        block = matrix[chunk] @ matrix_t
+        block = block.toarray() if hasattr(block, "toarray") else np.asarray(block)
+        block_ids, block_scores = _top_k_rows(block.astype(np.float32, copy=False), k, chunk, excluded)
+        ids[start:start + len(chunk)] = block_ids
+        scores[start:start + len(chunk)] = block_scores
+
+    return ids, scores
+
+
+def build_neighbor_index(matrix, k=DEFAULT_K, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Build a :class:`NeighborIndex` from an L2-normalised (sparse) matrix.
+
+    Similarities are computed ``chunk_size`` rows at a time, so peak memory is
+    ``chunk_size x N`` instead of ``N x N``.
+    """
+    n_items = matrix.shape[0]
+    k = max(min(k, n_items - 1), 0)
+    if k == 0:
+        return NeighborIndex(np.empty((n_items, 0), dtype=np.int32), np.empty((n_items, 0), dtype=np.float32))
+
+    ids, scores = neighbor_rows(matrix, np.arange(n_items), k, chunk_size=chunk_size)
+    return NeighborIndex(ids, scores)
+
+
+# %%
+def compare_with_dense(matrix, k=DEFAULT_K, num_recommendations=5, queries=200):
+    """Memory and per-query latency of the dense matrix vs the neighbour index."""
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    n_items = matrix.shape[0]
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, n_items, size=queries)
+
+    start = time.perf_counter()
+    cosine_sim = cosine_similarity(matrix, matrix)
+    dense_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for idx in rows:
+        sim_scores = sorted(enumerate(cosine_sim[idx]), key=lambda x: x[1], reverse=True)
+        [i[0] for i in sim_scores[1:num_recommendations + 1]]
+    dense_query = (time.perf_counter() - start) / queries
+
+    start = time.perf_counter()
+    index = build_neighbor_index(matrix, k=k)
+    index_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for idx in rows:
+        index.neighbors(idx, num_recommendations)
+    index_query = (time.perf_counter() - start) / queries
+
+    return {
+        "items": n_items,
+        "dense_bytes": cosine_sim.nbytes,
+        "index_bytes": index.nbytes,
+        "dense_build_s": dense_build,
+        "index_build_s": index_build,
+        "dense_query_us": dense_query * 1e6,
+        "index_query_us": index_query * 1e6,
+    }
+
+
+if __name__ == "__main__":
+    # Usage: python neighbor_index.py [catalog size]
+    import pandas as pd
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    menu = pd.read_csv("menu_items.csv")
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else len(menu)
+    menu = menu.sample(n=size, replace=size > len(menu), random_state=0).reset_index(drop=True)
+    # Make repeated rows distinct so the synthetic catalog has real variety
+    text = menu["recipe_name"] + " " + menu["ingredients"] + " item" + menu.index.astype(str)
+    tfidf_matrix = TfidfVectorizer(stop_words="english").fit_transform(text)
+
+    result = compare_with_dense(tfidf_matrix)
+    print(f"items:            {result['items']}")
+    print(f"dense matrix:     {result['dense_bytes'] / 1e6:10.2f} MB  "
+          f"build {result['dense_build_s'] * 1e3:8.1f} ms  query {result['dense_query_us']:10.1f} us")
+    print(f"neighbour index:  {result['index_bytes'] / 1e6:10.2f} MB  "
+          f"build {result['index_build_s'] * 1e3:8.1f} ms  query {result['index_query_us']:10.1f} us")
@@ -0,0 +1,181 @@
+"""A customer's order history: one query per page plus a cached summary.
+
+``/order-history`` used to load every order of the user, then lazily load
+``order.menu_item`` and ``order.menu_item.category`` for each row, which is
+up to two extra queries per order.  Now:
+
+* :func:`history_query` fetches the orders, newest first, with one query.
+  That query joins the menu item and category and selects only the columns
+  the page shows.  :func:`history_page` keyset-pages it (pagination.py),
+  for the ``/order-history`` page and its JSON API alike.
+* :func:`category_summary` aggregates all the user's orders per category in
+  SQL (order count, quantity, spend, average rating).  The result is cached
+  per user.
+
+The summary cache is emptied for a user whenever a transaction that
+inserted, updated or deleted one of their orders commits, which covers
+checkout and ``/rate-order``.  The users are collected at each flush and
+dropped from the cache only after the commit: invalidating at flush time
+would let another request cache the old totals again before the change is
+visible, and a rollback would have invalidated for nothing.  Each
+invalidation also bumps the user's generation; a summary whose load
+overlapped an invalidation is returned but not cached.  Other workers'
+caches expire after ``ORDER_SUMMARY_TTL`` seconds.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Category, MenuItem, OrderItemNew
+import pagination
+
+SUMMARY_TTL = float(os.environ.get("ORDER_SUMMARY_TTL", "60"))
+SUMMARY_CACHE_SIZE = int(os.environ.get("ORDER_SUMMARY_CACHE_SIZE", "4096"))
+HISTORY_PAGE_SIZE = 20
+UNCATEGORISED = "Other"
+
+_lock = threading.Lock()
+_summaries = OrderedDict()
+# user_id -> times invalidated; _epoch changes when that map is trimmed
+_generations = {}
+_epoch = 0
+
+
+def history_query(user_id):
+    """The user's orders as plain rows, with their menu item and category."""
+    return db.session.query(
+        OrderItemNew.id,
+        OrderItemNew.order_date,
+        OrderItemNew.address,
+        OrderItemNew.rating,
+        OrderItemNew.quantity,
+        MenuItem.recipe_name,
+        MenuItem.img_src,
+        Category.category_name,
+    ).select_from(OrderItemNew) \
+        .outerjoin(MenuItem, OrderItemNew.menu_item_id == MenuItem.menu_items_id) \
+        .outerjoin(Category, MenuItem.category_id == Category.category_id) \
+        .filter(OrderItemNew.user_id == user_id)
+
+
+def history_page(user_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """One :class:`pagination.Page` of the user's orders, newest first."""
+    return pagination.keyset_page(history_query(user_id), [OrderItemNew.order_date, OrderItemNew.id], cursor,
+                                  pagination.parse_limit(limit, HISTORY_PAGE_SIZE), descending=True)
+
+
+def _load_summary(user_id):
+    rows = db.session.query(
+        Category.category_name,
+        db.func.count(OrderItemNew.id),
+        db.func.sum(OrderItemNew.quantity),
+        db.func.sum(OrderItemNew.price * OrderItemNew.quantity),
+        db.func.avg(OrderItemNew.rating),
+    ).select_from(OrderItemNew) \
+        .outerjoin(MenuItem, OrderItemNew.menu_item_id == MenuItem.menu_items_id) \
+        .outerjoin(Category, MenuItem.category_id == Category.category_id) \
+        .filter(OrderItemNew.user_id == user_id) \
+        .group_by(Category.category_name).all()
+    summary = {}
+    for name, orders, quantity, spent, rating in rows:
+        name = name or UNCATEGORISED
+        entry = summary.setdefault(name, {"name": name, "total_orders": 0, "total_quantity": 0,
+                                          "total_spent": 0.0, "average_rating": None})
+        entry["total_orders"] += orders
+        entry["total_quantity"] += int(quantity or 0)
+        entry["total_spent"] += float(spent or 0)
+        if rating is not None:
+            entry["average_rating"] = round(float(rating), 2)
+    return sorted(summary.values(), key=lambda entry: (-entry["total_orders"], entry["name"]))
+
+
+def category_summary(user_id):
+    """Per-category totals of all the user's orders, most ordered first (cached)."""
+    now = time.monotonic()
+    with _lock:
+        cached = _summaries.get(user_id)
+        if cached is not None and now - cached[0] < SUMMARY_TTL:
+            _summaries.move_to_end(user_id)
+            return cached[1]
+        generation = (_epoch, _generations.get(user_id, 0))
+    summary = _load_summary(user_id)
+    with _lock:
+        if generation != (_epoch, _generations.get(user_id, 0)):
+            # Invalidated while loading: the totals may predate that commit
+            return summary
+        _summaries[user_id] = (now, summary)
+        _summaries.move_to_end(user_id)
+        while len(_summaries) > SUMMARY_CACHE_SIZE:
+            _summaries.popitem(last=False)
+    return summary
+
+
+def invalidate(user_id):
+    global _epoch
+    with _lock:
+        _summaries.pop(user_id, None)
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+        if len(_generations) > SUMMARY_CACHE_SIZE:
+            # Forgetting generations could hide an invalidation; a new epoch covers them all
+            _generations.clear()
+            _epoch += 1
+
+
+_CHANGED_USERS = "order_history_changed_users"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault(_CHANGED_USERS, set())
+    for target in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(target, OrderItemNew):
+            changed.add(target.user_id)
+            # An order moved to another user changes the old user's totals too
+            changed.update(inspect(target).attrs.user_id.history.deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def _order_changes_committed(session):
+    for user_id in session.info.pop(_CHANGED_USERS, ()):
+        invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _order_changes_rolled_back(session):
+    session.info.pop(_CHANGED_USERS, None)
+
+
+def _group_by_category(rows, summary):
+    # The shape the template always used; ``total_orders`` counts all of the
+    # user's orders in that category, not just these rows
+    totals = {entry["name"]: entry["total_orders"] for entry in summary}
+
+    orders_by_category = {}
+    for row in rows:
+        name = row.category_name or UNCATEGORISED
+        group = orders_by_category.setdefault(name, {
+            "name": name,
+            "total_orders": totals.get(name, 0),
+            "order_list": []
+        })
+        group["order_list"].append({
+            "id": row.id,
+            "image_url": row.img_src,
+            "delivered_at": row.order_date.strftime("%d %b %Y") if row.order_date else None,
+            "address": row.address,
+            "items_summary": row.recipe_name,
+            "user_rating": row.rating
+        })
+    return list(orders_by_category.values())
+
+
+def order_history(user_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """``(orders, page, summary)`` for one page of the history, newest first."""
+    page = history_page(user_id, cursor, limit)
+    summary = category_summary(user_id)
+    return _group_by_category(page.items, summary), page, summary
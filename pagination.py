@@ -0,0 +1,125 @@
+"""Keyset (seek) pagination for the admin listings.
+
+Offset pagination (``LIMIT n OFFSET k``) makes the database walk past
+``k`` rows on every page.  Loading whole tables with ``.all()`` is worse:
+every row becomes an ORM object.  :func:`keyset_page` instead orders by an
+indexed, unique key, e.g. ``(order_date, id)``, and continues after the last
+row of the previous page::
+
+    WHERE (order_date, id) < (:last_date, :last_id) ORDER BY order_date DESC, id DESC LIMIT :n
+
+Every page costs one index range scan of ``limit + 1`` rows, whatever the
+page number and the table size.  The position travels as an opaque
+``cursor`` string (:func:`encode_cursor`), which the JSON APIs return as
+``next_cursor``.
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import tuple_
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class Page:
+    def __init__(self, items, next_cursor, limit):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.limit = limit
+
+    @property
+    def has_more(self):
+        return self.next_cursor is not None
+
+    def to_dict(self, serialize):
+        return {
+            "items": [serialize(item) for item in self.items],
+            "next_cursor": self.next_cursor,
+            "has_more": self.has_more,
+            "limit": self.limit,
+        }
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Key values of a cursor; ``ValueError`` if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return [_decode_value(value) for value in values]
+
+
+def _check_value(column, value):
+    """``value`` if it has the Python type of ``column``, else ``ValueError``."""
+    try:
+        expected = column.type.python_type
+    except NotImplementedError:
+        return value
+    if expected is float:
+        expected = (int, float)
+    # bool is an int, and a date column must not compare against a datetime
+    if (isinstance(value, bool) and expected is not bool) or not isinstance(value, expected) \
+            or (expected is date and isinstance(value, datetime)):
+        raise ValueError(f"Invalid cursor value {value!r} for {column.key}")
+    return value
+
+
+def parse_limit(value, default=DEFAULT_LIMIT):
+    try:
+        limit = int(value) if value not in (None, "") else default
+    except ValueError:
+        raise ValueError(f"Invalid limit {value!r}")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def keyset_page(query, key_columns, cursor=None, limit=DEFAULT_LIMIT, descending=False):
+    """One page of ``query`` ordered by ``key_columns`` (unique together), after ``cursor``.
+
+    ``key_columns`` must be selectable from the query's entity; the last
+    one should be the primary key to break ties.  A cursor that doesn't
+    fit the key columns raises ``ValueError``.
+    """
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(key_columns):
+            raise ValueError("Cursor does not match this listing")
+        values = [_check_value(column, value) for column, value in zip(key_columns, values)]
+        key = tuple_(*key_columns) if len(key_columns) > 1 else key_columns[0]
+        bound = tuple_(*values) if len(key_columns) > 1 else values[0]
+        query = query.filter(key < bound if descending else key > bound)
+    order = [column.desc() if descending else column.asc() for column in key_columns]
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in key_columns])
+    return Page(rows, next_cursor, limit)
@@ -0,0 +1,131 @@
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import login_required, current_user
+import menu_recommender
+from menu_recommender import (cart_recommendations_json, current_weather, recommendations_json,
+                              semantic_search_json, user_recommendations_json)
+from recommender_model import category_map, normalize_name, temperature_band
+from response_cache import cached_response
+
+# Menu Recommender API Routes
+recommendations_bp = Blueprint("recommendations", __name__)
+
+MAX_SEARCH_RESULTS = 50
+MAX_RECOMMENDATIONS = 50
+
+
+def json_response(body):
+    # Bodies are assembled from the recommender's prebuilt JSON fragments
+    return current_app.response_class(body + "\n", mimetype="application/json")
+
+
+def recommendation_count(default=8):
+    """``?n=``, clamped to 1..``MAX_RECOMMENDATIONS``."""
+    return max(1, min(request.args.get("n", default, type=int), MAX_RECOMMENDATIONS))
+
+
+def model_state():
+    """Part of every cache key: changes whenever the model or the menu does."""
+    current = menu_recommender.registry.current
+    return current.version, current.bundle_version, current.revision
+
+
+def cached_recommendations(item_key, **item):
+    # The body is the same for everyone in the same weather; the exact
+    # temperature is part of the key because the response echoes it
+    weather = current_weather()
+    key = ("recommendations", item_key, weather[0], temperature_band(weather[1]), weather[1], model_state())
+    return cached_response(key, lambda: json_response(recommendations_json(weather=weather, **item)))
+
+
+@recommendations_bp.route("/recommendations_weather/<menu_item>")
+def get_recommendations_with_weather(menu_item):
+    try:
+        # Call your recommender (cached per item, weather and model state)
+        return cached_recommendations(("name", normalize_name(menu_item)), item_name=menu_item)
+
+    except Exception as e:
+        print("Error in get_recommendations_with_weather:", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@recommendations_bp.route("/recommendations/<int:item_id>")
+def get_recommendations_by_id(item_id):
+    try:
+        # Keyed by menu_items_id: no string matching on the hot path
+        return cached_recommendations(("id", item_id), item_id=item_id)
+
+    except Exception as e:
+        print("Error in get_recommendations_by_id:", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@recommendations_bp.route("/recommendations_cart", methods=["GET", "POST"])
+def get_cart_recommendations():
+    try:
+        # POST {"cart": {"<item_id>": quantity}} or fall back to the visitor's stored cart
+        if request.method == "POST":
+            cart = (request.get_json() or {}).get("cart", {})
+        else:
+            # Imported here so the recommender routes don't need the database models
+            import cart_store
+            cart = cart_store.get_cart()
+        if not isinstance(cart, (dict, list)):
+            return jsonify({"error": "cart must map item ids to quantities"}), 400
+        num_recommendations = recommendation_count()
+
+        recommendations = cart_recommendations_json(cart, num_recommendations)
+        return json_response('{"cart_recommendation":' + recommendations + "}")
+
+    except Exception as e:
+        print("Error in get_cart_recommendations:", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@recommendations_bp.route("/recommendations/user")
+@login_required
+def get_user_recommendations():
+    try:
+        num_recommendations = recommendation_count()
+        recommendations = user_recommendations_json(current_user.user_id, num_recommendations)
+        return json_response('{"user_recommendation":' + recommendations + "}")
+
+    except Exception as e:
+        print("Error in get_user_recommendations:", e)
+        return jsonify({"error": str(e)}), 500
+
+
+def category_filter(value):
+    """``category_id`` from a ``?category=`` id or name (e.g. ``5`` or ``hot drinks``)."""
+    if value is None or value == "":
+        return None
+    if value.isdigit():
+        return int(value)
+    for category_id, name in category_map.items():
+        if normalize_name(name) == normalize_name(value):
+            return category_id
+    raise ValueError(f"Unknown category {value!r}")
+
+
+@recommendations_bp.route("/api/semantic-search")
+def semantic_search():
+    try:
+        # Ranked by TF-IDF similarity to the whole query, not substring matches
+        query = request.args.get("q", "").strip()
+        if not query:
+            return json_response('{"results":[]}')
+        try:
+            category_id = category_filter(request.args.get("category"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        num_results = min(request.args.get("n", 10, type=int), MAX_SEARCH_RESULTS)
+
+        results = semantic_search_json(
+            query, num_results, category_id=category_id,
+            min_price=request.args.get("min_price", type=float),
+            max_price=request.args.get("max_price", type=float),
+        )
+        return json_response('{"results":' + results + "}")
+
+    except Exception as e:
+        print("Error in semantic_search:", e)
+        return jsonify({"error": str(e)}), 500
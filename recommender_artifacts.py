@@ -0,0 +1,228 @@
+"""On-disk bundle of the fitted recommender.
+
+Fitting TF-IDF and the neighbour index at import time makes every worker and
+every restart pay the full cost.  ``python recommender_artifacts.py build``
+does it once and writes a versioned bundle::
+
+    recommender_bundle/
+        CURRENT                 -> name of the active version directory
+        20250101120000/
+            manifest.json       format/model version, shapes
+            features.json       field weights and per-field TF-IDF vocabularies
+            idf_<field>.npy
+            tfidf_data.npy, tfidf_indices.npy, tfidf_indptr.npy
+            neighbor_ids.npy, neighbor_scores.npy
+            ivf_*.npy           IVF index, when the ivf backend is used (ann_index.py)
+            fragments_<view>_data.npy, fragments_<view>_offsets.npy
+                                prebuilt JSON records per response view
+            active.npy          False for items deleted since the fit
+            items.csv           menu metadata
+
+Workers open the arrays read-only with ``mmap_mode="r"``, so loading is
+near-instant and all processes share the same page-cache pages.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from ann_index import make_backend
+from feature_engine import MultiFieldVectorizer, load_field_weights
+from neighbor_index import NeighborIndex
+from recommender_model import PAYLOAD_VIEWS, EncodedRecords, RecommenderModel
+
+BUNDLE_FORMAT_VERSION = 2
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUNDLE_DIR = os.environ.get("RECOMMENDER_BUNDLE_DIR", os.path.join(BASE_DIR, "recommender_bundle"))
+CURRENT_POINTER = "CURRENT"
+
+
+def publish_version(root, version, write):
+    """Write a new version directory under ``root`` and make it current.
+
+    ``write(directory)`` fills a temporary directory, which is then renamed
+    to ``root/version``; the ``CURRENT`` pointer is swapped with
+    ``os.replace``, so a reader never sees a half-written version.  An
+    existing version is never replaced (``FileExistsError``): workers may
+    have it mapped, and ``CURRENT`` may point at it.
+    """
+    os.makedirs(root, exist_ok=True)
+    version_dir = os.path.join(root, version)
+    if os.path.exists(version_dir):
+        raise FileExistsError(f"Recommender version {version} already exists in {root}")
+    tmp_dir = tempfile.mkdtemp(prefix=".build-", dir=root)
+    try:
+        write(tmp_dir)
+        # Fails rather than replace a version that appeared meanwhile
+        os.rename(tmp_dir, version_dir)
+    except OSError as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if os.path.exists(version_dir):
+            raise FileExistsError(f"Recommender version {version} already exists in {root}") from e
+        raise
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    fd, pointer_tmp = tempfile.mkstemp(prefix=f".{CURRENT_POINTER}.", dir=root)
+    with os.fdopen(fd, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(root, CURRENT_POINTER))
+    return version_dir
+
+
+def save_array(directory, name, array):
+    np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+
+def load_array(directory, name, mmap=True):
+    return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+
+
+def save_bundle(model, root=DEFAULT_BUNDLE_DIR, version=None):
+    """Write ``model`` as a new bundle version under ``root`` and make it current.
+
+    The version directory is named after ``model.version`` unless ``version``
+    is given (e.g. to publish a model edited since it was fitted).
+    """
+    def write(directory):
+        tfidf_matrix = sp.csr_matrix(model.tfidf_matrix, dtype=np.float32)
+        tfidf_matrix.sort_indices()
+        backend_arrays = model.backend.get_arrays()
+
+        manifest = {
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "model_version": model.version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "n_items": tfidf_matrix.shape[0],
+            "n_features": tfidf_matrix.shape[1],
+            "k": model.neighbor_index.k,
+            "field_weights": model.tfidf.field_weights,
+            "backend": model.backend.name,
+            "backend_arrays": sorted(backend_arrays),
+        }
+        features, idfs = model.tfidf.get_state()
+
+        with open(os.path.join(directory, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        with open(os.path.join(directory, "features.json"), "w") as f:
+            json.dump(features, f)
+
+        for field, idf in idfs.items():
+            save_array(directory, f"idf_{field}", idf.astype(np.float64))
+        save_array(directory, "tfidf_data", tfidf_matrix.data)
+        # One index dtype for both, or scipy copies them on load instead of mapping
+        index_dtype = np.int32 if tfidf_matrix.nnz < np.iinfo(np.int32).max else np.int64
+        save_array(directory, "tfidf_indices", tfidf_matrix.indices.astype(index_dtype))
+        save_array(directory, "tfidf_indptr", tfidf_matrix.indptr.astype(index_dtype))
+        save_array(directory, "neighbor_ids", model.neighbor_index.ids)
+        save_array(directory, "neighbor_scores", model.neighbor_index.scores)
+        for name, array in backend_arrays.items():
+            save_array(directory, name, array)
+        for view, records in model.fragments.items():
+            data, offsets = records.to_arrays()
+            save_array(directory, f"fragments_{view}_data", data)
+            save_array(directory, f"fragments_{view}_offsets", offsets)
+        save_array(directory, "active", model.active)
+        model.menu_df.to_csv(os.path.join(directory, "items.csv"), index=False)
+
+    return publish_version(root, version or model.version, write)
+
+
+def current_version(root=DEFAULT_BUNDLE_DIR):
+    """Name of the version ``CURRENT`` points at (``FileNotFoundError`` if none)."""
+    with open(os.path.join(root, CURRENT_POINTER)) as f:
+        return f.read().strip()
+
+
+def load_bundle(root=DEFAULT_BUNDLE_DIR, version=None, mmap=True):
+    """Open a bundle as a :class:`RecommenderModel` without refitting anything."""
+    version = version or current_version(root)
+    directory = os.path.join(root, version)
+
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported recommender bundle format {manifest.get('format_version')!r} in {directory}"
+        )
+    with open(os.path.join(directory, "features.json")) as f:
+        features = json.load(f)
+
+    idfs = {
+        field: load_array(directory, f"idf_{field}", mmap=False)
+        for field, vocabulary in features["vocabularies"].items() if vocabulary is not None
+    }
+    tfidf = MultiFieldVectorizer.from_state(features, idfs)
+
+    tfidf_matrix = sp.csr_matrix(
+        (
+            load_array(directory, "tfidf_data", mmap),
+            load_array(directory, "tfidf_indices", mmap),
+            load_array(directory, "tfidf_indptr", mmap),
+        ),
+        shape=(manifest["n_items"], manifest["n_features"]),
+        copy=False,
+    )
+    neighbor_index = NeighborIndex(
+        load_array(directory, "neighbor_ids", mmap),
+        load_array(directory, "neighbor_scores", mmap),
+    )
+    menu_df = pd.read_csv(os.path.join(directory, "items.csv"))
+    active = load_array(directory, "active", mmap=False)
+    # Reuse the saved IVF index if RECOMMENDER_BACKEND still asks for one
+    backend_arrays = {name: load_array(directory, name, mmap) for name in manifest.get("backend_arrays", [])}
+    backend = make_backend(tfidf_matrix, active, arrays=backend_arrays)
+    fragments = None
+    if os.path.exists(os.path.join(directory, f"fragments_{next(iter(PAYLOAD_VIEWS))}_data.npy")):
+        fragments = {
+            view: EncodedRecords(load_array(directory, f"fragments_{view}_data", mmap),
+                                 load_array(directory, f"fragments_{view}_offsets", mmap))
+            for view in PAYLOAD_VIEWS
+        }
+
+    model = RecommenderModel(menu_df, tfidf, tfidf_matrix, neighbor_index, version=manifest["model_version"],
+                             active=active, backend=backend, fragments=fragments)
+    model.bundle_version = version
+    return model
+
+
+def prune_versions(root=DEFAULT_BUNDLE_DIR, keep=3):
+    """Delete all but the ``keep`` newest versions (never the current one)."""
+    current = current_version(root)
+    versions = sorted(
+        name for name in os.listdir(root)
+        if not name.startswith(".") and os.path.isdir(os.path.join(root, name))
+    )
+    for name in versions[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the recommender bundle.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Fit the recommender and write a new bundle version")
+    build.add_argument("--csv", default=os.path.join(BASE_DIR, "menu_items.csv"))
+    build.add_argument("--out", default=DEFAULT_BUNDLE_DIR)
+    build.add_argument("--keep", type=int, default=3, help="Number of versions to keep")
+    build.add_argument("--field-weights", help="JSON or JSON file of per-field weights "
+                                                 "(default: RECOMMENDER_FIELD_WEIGHTS)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    model = RecommenderModel.fit_csv(args.csv, field_weights=load_field_weights(args.field_weights))
+    version_dir = save_bundle(model, args.out)
+    prune_versions(args.out, keep=args.keep)
+    print(f"Wrote recommender bundle {version_dir} "
+          f"({len(model.menu_df)} items) in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""Fitted state of the menu recommender.
+
+Everything the recommender needs at request time lives on one
+:class:`RecommenderModel`: the menu metadata, the fitted multi-field TF-IDF
+vectorizer (feature_engine.py), the sparse feature matrix, the top-k
+neighbour index and the nearest-neighbour backend for on-demand queries
+(ann_index.py).  A model is either
+fitted from a menu DataFrame or loaded from an on-disk bundle (see
+recommender_artifacts.py).
+
+Response records are encoded to JSON once per item and view (see
+:data:`PAYLOAD_VIEWS`), so the routes build a response by joining prebuilt
+fragments instead of converting DataFrames on every request.
+
+Menu edits are applied incrementally with :meth:`RecommenderModel.upserted`
+and :meth:`RecommenderModel.deleted`: new text is transformed with the
+existing vocabulary and only the neighbour lists it affects are recomputed.
+Deleted items stay in the arrays as inactive rows so row numbers never shift;
+a full refit compacts them away.
+
+A model is never changed once it is served.  An edit returns a patched copy
+that shares the untouched arrays, and the caller publishes it by swapping
+one reference (model_registry.py).  A request that read the current model
+keeps a consistent ``menu_df``, ``active``, neighbour index and backend,
+whatever edits land meanwhile.
+"""
+import copy
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from ann_index import make_backend
+from feature_engine import MultiFieldVectorizer
+from neighbor_index import NeighborIndex, neighbor_rows
+
+# Columns of menu_items.csv / the MenuItem table
+MENU_COLUMNS = [
+    "menu_items_id", "recipe_name", "prep_time", "cook_time", "total_time", "ingredients", "rating",
+    "cuisine_path", "nutrition", "img_src", "is_ready_to_serve", "cleaned_ingredients", "category_id", "price"
+]
+
+category_map = {
+    1: "Breakfast",
+    2: "Lunch Specials",
+    3: "Dinner Dishes",
+    4: "Desserts",
+    5: "Hot Drinks",
+    6: "Cold Drinks",
+    7: "Salads and Sides",
+    8: "Kid's Menu"
+}
+
+weather_to_category = {
+    "Clear": ["Cold Drinks", "Salads and Sides", "Breakfast", "Desserts"],
+    "Hot": ["Cold Drinks", "Desserts", "Salads and Sides"],
+    "Rain": ["Hot Drinks", "Dinner Dishes"],
+    "Drizzle": ["Hot Drinks", "Lunch Specials"],
+    "Clouds": ["Hot Drinks", "Lunch Specials", "Dinner Dishes"],
+    "Thunderstorm": ["Hot Drinks", "Dinner Dishes"],
+    "Mist": ["Hot Drinks", "Breakfast"],
+    "Haze": ["Cold Drinks", "Salads and Sides", "Lunch Specials"],
+    "Fog": ["Hot Drinks", "Breakfast"],
+    "Smoke": ["Hot Drinks", "Lunch Specials"],
+    "Dust": ["Cold Drinks", "Salads and Sides"]
+}
+
+# (band, upper bound in degrees C) and the categories each band adds
+TEMPERATURE_BANDS = (("cold", 20.0), ("mild", 30.0), ("hot", float("inf")))
+temperature_band_to_category = {
+    "cold": ["Hot Drinks"],
+    "mild": [],
+    "hot": weather_to_category["Hot"],
+}
+ITEM_RECOMMENDATION_COLUMNS = ["recipe_name", "ingredients", "category_id", "price"]
+CART_RECOMMENDATION_COLUMNS = ["menu_items_id", "recipe_name", "ingredients", "category_id", "price", "img_src"]
+WEATHER_RECOMMENDATION_COLUMNS = ["recipe_name", "ingredients", "category_id", "category_name", "price", "img_src"]
+# Prebuilt JSON record of every item, per kind of recommendation list
+PAYLOAD_VIEWS = {
+    "item": ITEM_RECOMMENDATION_COLUMNS,
+    "cart": CART_RECOMMENDATION_COLUMNS,
+    "weather": WEATHER_RECOMMENDATION_COLUMNS,
+}
+MAX_WEATHER_CANDIDATES = 50
+PLACEHOLDER_IMAGE = "https://placehold.co/300x200"
+
+
+def prepare_menu_frame(menu_df):
+    """Add the derived ``category_name``, ``features`` and ``popularity`` columns."""
+    menu_df = menu_df.reset_index(drop=True)
+    if "popularity" not in menu_df:
+        menu_df["popularity"] = 0
+    menu_df["category_name"] = menu_df["category_id"].map(category_map)
+    menu_df["features"] = (
+            menu_df["recipe_name"].fillna('') + " " +
+            menu_df["cuisine_path"].fillna('') + " " +
+            menu_df["cleaned_ingredients"].fillna('') + " " +
+            menu_df["ingredients"].fillna('')
+    )
+    return menu_df
+
+
+def view_records(menu_df, columns):
+    """``menu_df`` rows as JSON-ready dicts of ``columns``, with placeholder images."""
+    records = menu_df[columns].copy()
+    if "img_src" in columns:
+        records["img_src"] = records["img_src"].fillna(PLACEHOLDER_IMAGE)
+    return records.to_dict(orient="records")
+
+
+def encode_records(menu_df, columns):
+    """One JSON object string per row, encoded the way ``flask.jsonify`` would."""
+    return [json.dumps(record, sort_keys=True, separators=(",", ":")) for record in view_records(menu_df, columns)]
+
+
+class EncodedRecords:
+    """Per-row JSON strings kept as one UTF-8 buffer plus row offsets.
+
+    The two arrays can be memory-mapped from a bundle and shared by every
+    worker; rows edited since are held in a small ``overrides`` dict.
+    """
+
+    def __init__(self, data, offsets, overrides=None):
+        self.data = data
+        self.offsets = offsets
+        self.overrides = overrides or {}
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return max(len(self.offsets) - 1, max(self.overrides, default=-1) + 1)
+
+    def __getitem__(self, row):
+        text = self.overrides.get(row)
+        if text is None:
+            text = self.data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+        return text
+
+    def replaced(self, row, text):
+        """A copy with ``row`` set to ``text`` (appending if ``row == len(self)``)."""
+        return EncodedRecords(self.data, self.offsets, {**self.overrides, row: text})
+
+    def to_arrays(self):
+        """``(data, offsets)`` with the overrides folded in, for saving."""
+        if not self.overrides:
+            return self.data, self.offsets
+        merged = EncodedRecords.from_strings(self[row] for row in range(len(self)))
+        return merged.data, merged.offsets
+
+
+def temperature_band(temp):
+    """``"cold"``, ``"mild"`` or ``"hot"``; unknown temperatures count as mild."""
+    if temp is None:
+        return "mild"
+    for band, upper in TEMPERATURE_BANDS:
+        if temp < upper:
+            return band
+    return TEMPERATURE_BANDS[-1][0]
+
+
+def weather_categories(weather, band):
+    """Categories suggested for a weather condition in a temperature band."""
+    return set(weather_to_category.get(weather, [])) | set(temperature_band_to_category[band])
+
+
+def new_version():
+    """A fresh model version: the fit time, sortable, down to the nanosecond.
+
+    Two models fitted in the same second still get distinct versions, so
+    their bundle directories never collide.
+    """
+    ns = time.time_ns()
+    return time.strftime("%Y%m%d%H%M%S", time.localtime(ns // 10 ** 9)) + f"-{ns % 10 ** 9:09d}"
+
+
+def normalize_name(name):
+    """Key for name lookups: case-insensitive, whitespace-collapsed."""
+    return " ".join(str(name).split()).casefold()
+
+
+class RecommenderModel:
+    def __init__(self, menu_df, tfidf, tfidf_matrix, neighbor_index, version=None, active=None, backend=None,
+                 fragments=None):
+        self.menu_df = menu_df
+        self.tfidf = tfidf
+        self.tfidf_matrix = tfidf_matrix
+        self.neighbor_index = neighbor_index
+        self.version = version or new_version()
+        # Bumped by every edit, so (version, revision) identifies the state
+        self.revision = 0
+        self.active = np.ones(len(menu_df), dtype=bool) if active is None else active
+        self.backend = backend or make_backend(tfidf_matrix, self.active)
+        # Hash lookups built once, so requests never scan menu_df
+        self.row_by_id = {}
+        self.row_by_name = {}
+        for row, (item_id, name) in enumerate(zip(menu_df["menu_items_id"], menu_df["recipe_name"])):
+            if self.active[row]:
+                self.row_by_id[int(item_id)] = row
+                # First item wins on duplicate names, as the old menu_df scan did
+                self.row_by_name.setdefault(normalize_name(name), row)
+        # Terms seen in edited items that the fitted vocabulary doesn't know
+        self.oov_terms = set()
+        # Name of the bundle directory this model was loaded from, if any
+        self.bundle_version = None
+        self.fragments = fragments or {
+            view: EncodedRecords.from_strings(encode_records(menu_df, columns))
+            for view, columns in PAYLOAD_VIEWS.items()
+        }
+        self._build_weather_candidates()
+
+    @classmethod
+    def fit(cls, menu_df, version=None, field_weights=None):
+        menu_df = prepare_menu_frame(menu_df)
+        tfidf = MultiFieldVectorizer(field_weights)
+        tfidf_matrix = tfidf.fit_transform(menu_df)
+        backend = make_backend(tfidf_matrix, np.ones(len(menu_df), dtype=bool))
+        # Only the top-k neighbours of every item are kept (see neighbor_index.py);
+        # large catalogs find them through the approximate backend
+        neighbor_index = backend.neighbor_index()
+        return cls(menu_df, tfidf, tfidf_matrix, neighbor_index, version, backend=backend)
+
+    @classmethod
+    def fit_csv(cls, path, version=None, field_weights=None):
+        return cls.fit(pd.read_csv(path), version, field_weights)
+
+    def similarities(self, vector, matrix=None):
+        """Cosine similarity of every item to ``vector`` (one sparse mat-vec)."""
+        matrix = self.tfidf_matrix if matrix is None else matrix
+        return np.asarray((matrix @ vector.T).todense(), dtype=np.float32).ravel()
+
+    def fragments_json(self, view, rows):
+        """JSON array of the prebuilt ``view`` records of ``rows``, in order."""
+        fragments = self.fragments[view]
+        return "[" + ",".join([fragments[row] for row in rows]) + "]"
+
+    # ----- Weather candidates -----
+
+    def _build_weather_candidates(self):
+        """Rank items per (weather, temperature band) once, with their JSON records.
+
+        Items are ranked by rating, then popularity (orders), then menu order,
+        so the weather half of a response is a dictionary lookup.
+        """
+        menu_df = self.menu_df
+        rating = menu_df["rating"].fillna(0).to_numpy(dtype=float)
+        popularity = menu_df["popularity"].fillna(0).to_numpy(dtype=float)
+        ranked = np.lexsort((np.arange(len(menu_df)), -popularity, -rating))
+        ranked = ranked[self.active[ranked]]
+        categories = menu_df["category_name"].to_numpy()[ranked]
+
+        records = view_records(menu_df, WEATHER_RECOMMENDATION_COLUMNS)
+
+        candidates, payloads = {}, {}
+        for weather in [None, *weather_to_category]:
+            for band, _ in TEMPERATURE_BANDS:
+                rows = ranked[np.isin(categories, list(weather_categories(weather, band)))]
+                rows = rows[:MAX_WEATHER_CANDIDATES]
+                candidates[(weather, band)] = rows
+                payloads[(weather, band)] = [records[row] for row in rows]
+        self.weather_candidates = candidates
+        self.weather_payloads = payloads
+
+    @staticmethod
+    def weather_key(weather, temp):
+        return weather if weather in weather_to_category else None, temperature_band(temp)
+
+    def weather_payload(self, weather, temp):
+        """Prebuilt, best-first records for ``weather`` at ``temp`` degrees."""
+        return self.weather_payloads[self.weather_key(weather, temp)]
+
+    def weather_json(self, weather, temp, num_recommendations):
+        """:meth:`weather_payload` as a JSON array, joined from prebuilt fragments."""
+        rows = self.weather_candidates[self.weather_key(weather, temp)][:num_recommendations]
+        return self.fragments_json("weather", rows)
+
+    def with_popularity(self, counts):
+        """A copy with order counts per ``menu_items_id`` and re-ranked weather lists.
+
+        Returns ``self`` if no count changed.
+        """
+        popularity = self.menu_df["menu_items_id"].map(counts).fillna(0).astype(int)
+        if popularity.equals(self.menu_df["popularity"].astype(int)):
+            return self
+        clone = self._copy()
+        menu_df = self.menu_df.copy()
+        menu_df["popularity"] = popularity
+        clone.menu_df = menu_df
+        clone._build_weather_candidates()
+        return clone
+
+    # ----- Incremental updates -----
+
+    @property
+    def vocabulary_drift(self):
+        """Unknown terms seen since the fit, relative to the vocabulary size."""
+        return len(self.oov_terms) / max(self.tfidf.vocabulary_size, 1)
+
+    @property
+    def inactive_ratio(self):
+        return 1 - self.active.sum() / max(len(self.active), 1)
+
+    def _copy(self):
+        """A shallow copy to patch before it is published.
+
+        Arrays and frames are shared with ``self`` and replaced, never written,
+        on the copy; the lookup dicts are copied because edits update them.
+        """
+        clone = copy.copy(self)
+        clone.row_by_id = dict(self.row_by_id)
+        clone.row_by_name = dict(self.row_by_name)
+        clone.oov_terms = set(self.oov_terms)
+        clone.revision = self.revision + 1
+        return clone
+
+    def _reindex_name(self, name, menu_df, active):
+        """Point ``name`` at its first active row again after an edit."""
+        key = normalize_name(name)
+        matches = np.flatnonzero(
+            (menu_df["recipe_name"].map(normalize_name) == key).to_numpy() & active
+        )
+        if len(matches):
+            self.row_by_name[key] = int(matches[0])
+        else:
+            self.row_by_name.pop(key, None)
+
+    def _transform(self, menu_row):
+        self.oov_terms.update(self.tfidf.unknown_terms(menu_row))
+        return sp.csr_matrix(self.tfidf.transform(menu_row), dtype=self.tfidf_matrix.dtype)
+
+    def _patch_neighbors(self, changed_row, matrix, active):
+        """Recompute only the neighbour lists ``changed_row`` can affect."""
+        ids = np.array(self.neighbor_index.ids)
+        scores = np.array(self.neighbor_index.scores)
+        if len(ids) < matrix.shape[0]:
+            ids = np.vstack([ids, np.zeros((matrix.shape[0] - len(ids), ids.shape[1]), dtype=ids.dtype)])
+            scores = np.vstack([scores, np.full((matrix.shape[0] - len(scores), scores.shape[1]), -np.inf,
+                                                dtype=scores.dtype)])
+        k = ids.shape[1]
+        if k == 0:
+            return NeighborIndex(ids, scores)
+
+        # Rows that list the changed item, plus rows it now beats the k-th neighbour of
+        sims = self.similarities(matrix[changed_row], matrix)
+        affected = np.any(ids == changed_row, axis=1) | (sims > scores[:, -1])
+        affected[changed_row] = active[changed_row]
+        affected &= active
+
+        rows = np.flatnonzero(affected)
+        if len(rows):
+            ids[rows], scores[rows] = neighbor_rows(matrix, rows, k, excluded=~active)
+        return NeighborIndex(ids, scores)
+
+    def upserted(self, item):
+        """A copy with one menu item, given as a dict of ``MenuItem`` columns, added or updated."""
+        item_id = int(item["menu_items_id"])
+        menu_row = prepare_menu_frame(pd.DataFrame([item]))
+        clone = self._copy()
+        vector = clone._transform(menu_row)
+        row = self.row_by_id.get(item_id)
+        old_name = self.menu_df.at[row, "recipe_name"] if row is not None else None
+        if row is not None and "popularity" not in item:
+            menu_row["popularity"] = self.menu_df.at[row, "popularity"]
+
+        if row is None:
+            row = len(self.menu_df)
+            menu_df = pd.concat([self.menu_df, menu_row], ignore_index=True)
+            matrix = sp.vstack([self.tfidf_matrix, vector], format="csr")
+            active = np.append(self.active, True)
+        else:
+            menu_df = self.menu_df.copy()
+            for column in menu_row.columns:
+                menu_df.at[row, column] = menu_row.at[0, column]
+            matrix = sp.vstack([self.tfidf_matrix[:row], vector, self.tfidf_matrix[row + 1:]], format="csr")
+            active = self.active
+
+        # Row numbers of existing items never change
+        clone.neighbor_index = self._patch_neighbors(row, matrix, active)
+        clone.backend = self.backend.updated(matrix, active, [row])
+        clone.fragments = {
+            view: self.fragments[view].replaced(row, encode_records(menu_df.iloc[[row]], columns)[0])
+            for view, columns in PAYLOAD_VIEWS.items()
+        }
+        clone.tfidf_matrix = matrix
+        clone.active = active
+        clone.menu_df = menu_df
+        clone.row_by_id[item_id] = row
+        if old_name is not None:
+            clone._reindex_name(old_name, menu_df, active)
+        clone._reindex_name(menu_df.at[row, "recipe_name"], menu_df, active)
+        clone._build_weather_candidates()
+        return clone
+
+    def deleted(self, item_id):
+        """A copy with one menu item deactivated (``self`` if it is unknown).
+
+        Its row stays until the next refit.
+        """
+        row = self.row_by_id.get(int(item_id))
+        if row is None:
+            return self
+        active = self.active.copy()
+        active[row] = False
+        matrix = sp.vstack([self.tfidf_matrix[:row], sp.csr_matrix((1, self.tfidf_matrix.shape[1])),
+                            self.tfidf_matrix[row + 1:]], format="csr")
+
+        clone = self._copy()
+        clone.neighbor_index = self._patch_neighbors(row, matrix, active)
+        clone.backend = self.backend.updated(matrix, active, [row])
+        del clone.row_by_id[int(item_id)]
+        clone.active = active
+        clone.tfidf_matrix = matrix
+        clone._reindex_name(self.menu_df.at[row, "recipe_name"], self.menu_df, active)
+        clone._build_weather_candidates()
+        return clone
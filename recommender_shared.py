@@ -0,0 +1,209 @@
+"""One recommender in shared memory for all worker processes.
+
+Each gunicorn worker used to load (or fit) its own copy of the recommender.
+Here the bundle (see recommender_artifacts.py) is published to a tmpfs
+directory, ``/dev/shm/cafe-recommender`` by default, and every worker
+memory-maps the same files: the TF-IDF matrix, neighbour index, ANN index
+and prebuilt JSON records are shared pages, so adding workers does not add
+copies of them.
+
+Publishing uses the same layout as the on-disk bundle: a new version
+directory, then an atomic ``os.replace`` of the ``CURRENT`` pointer.  Workers
+check the pointer at most every ``RECOMMENDER_SHARED_POLL`` seconds and swap
+to a new version when it moves (recommender_sync.py); old versions stay
+mapped until no worker uses them.
+
+Each model source gets its own segment, a subdirectory named by
+:func:`source_key`: the on-disk bundle version, or a digest of the menu CSV
+and fit settings when there is no bundle.  A worker only ever attaches the
+segment of the source it would otherwise load itself, so a segment left in
+``/dev/shm`` by an earlier deploy is never served; older segments are pruned.
+
+The first process to start publishes the on-disk bundle (or a model fitted
+from the CSV) to its segment under a file lock; a loader can also do it up
+front, e.g. from gunicorn's ``on_starting`` hook or a deploy step::
+
+    python recommender_shared.py publish
+
+Set ``RECOMMENDER_SHARED_DIR`` to another directory, or to an empty string to
+disable sharing (it is disabled where ``/dev/shm`` does not exist).
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from feature_engine import load_field_weights
+from recommender_artifacts import (BUNDLE_FORMAT_VERSION, DEFAULT_BUNDLE_DIR, current_version, load_bundle,
+                                   prune_versions, save_bundle)
+
+try:
+    import fcntl
+except ImportError:  # Windows: no /dev/shm either, sharing stays disabled
+    fcntl = None
+
+DEFAULT_SHARED_DIR = "/dev/shm/cafe-recommender" if os.path.isdir("/dev/shm") and fcntl else ""
+SHARED_DIR = os.environ.get("RECOMMENDER_SHARED_DIR", DEFAULT_SHARED_DIR)
+POLL_INTERVAL = float(os.environ.get("RECOMMENDER_SHARED_POLL", "2"))
+KEEP_VERSIONS = 3
+# Segments of other sources kept besides the attached one, for workers still draining
+KEEP_SEGMENTS = 1
+
+# Segment directory this process attached, if any; follows and publishes use it
+segment = None
+_publish_lock = threading.Lock()
+_pending_lock = threading.Lock()
+_pending_publishes = 0
+
+
+def enabled(root=SHARED_DIR):
+    return bool(root) and fcntl is not None
+
+
+def attached():
+    """Whether this process serves a shared model (attaching may have failed)."""
+    return segment is not None
+
+
+class _DirectoryLock:
+    """Exclusive ``flock`` on ``root/.lock``, serialising publishers across processes."""
+
+    def __init__(self, root):
+        self.root = root
+        self.file = None
+
+    def __enter__(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.file = open(os.path.join(self.root, ".lock"), "w")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def shared_version(root=None):
+    """Version the ``CURRENT`` pointer of ``root`` (default: the attached segment) names, or ``None``."""
+    root = root or segment
+    if root is None:
+        return None
+    try:
+        return current_version(root)
+    except FileNotFoundError:
+        return None
+
+
+def source_key(bundle_root=DEFAULT_BUNDLE_DIR, csv_path=None):
+    """Segment name for the model a worker would load privately.
+
+    ``bundle-<version>`` for the on-disk bundle, else ``csv-<digest>`` of
+    ``csv_path`` together with the bundle format and field weights, so a
+    changed menu or fit configuration never maps an old segment.
+    """
+    version = shared_version(bundle_root)
+    if version is not None:
+        return f"bundle-{version}"
+    digest = hashlib.sha1(json.dumps([BUNDLE_FORMAT_VERSION, load_field_weights()], sort_keys=True).encode())
+    with open(csv_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return f"csv-{digest.hexdigest()[:16]}"
+
+
+def prune_segments(root, keep_name, keep=KEEP_SEGMENTS):
+    """Delete all but the ``keep`` most recently used segments besides ``keep_name``.
+
+    Workers still mapping a deleted segment keep their pages until they let go.
+    """
+    others = sorted(
+        (entry for entry in os.scandir(root)
+         if entry.is_dir() and not entry.name.startswith(".") and entry.name != keep_name),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in others[:-keep] if keep else others:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def attach(build, key, root=SHARED_DIR):
+    """Map the model of segment ``key``, publishing ``build()`` to it first if needed.
+
+    ``build()`` runs when the segment is empty.  Only one process builds: the
+    others wait on the lock, then map what it published.
+    """
+    global segment
+    directory = os.path.join(root, key)
+    with _DirectoryLock(root):
+        if shared_version(directory) is None:
+            model = build()
+            save_bundle(model, directory, version=model.bundle_version or model.version)
+            prune_versions(directory, keep=KEEP_VERSIONS)
+        # Touched so pruning ranks it as in use
+        os.utime(directory)
+        prune_segments(root, key)
+    model = load_bundle(directory)
+    segment = directory
+    return model
+
+
+def publish(model, root=None):
+    """Publish ``model`` (e.g. after edits) as a new version of ``root`` (default: the attached segment)."""
+    root = root or segment
+    with _publish_lock, _DirectoryLock(root):
+        # Served models are never changed, so this writes a consistent snapshot
+        version = f"{model.version}.{time.time_ns()}"
+        save_bundle(model, root, version=version)
+        prune_versions(root, keep=KEEP_VERSIONS)
+    return version
+
+
+def publish_in_background(get_model, root=None):
+    """:func:`publish` ``get_model()`` in a thread.
+
+    The model is fetched when the publish actually runs, so of several
+    queued publishes the last one always writes the newest state.
+    """
+    global _pending_publishes
+
+    def run():
+        global _pending_publishes
+        try:
+            publish(get_model(), root)
+        except Exception as e:
+            print("Publishing the shared recommender failed:", e)
+        finally:
+            with _pending_lock:
+                _pending_publishes -= 1
+
+    with _pending_lock:
+        _pending_publishes += 1
+    threading.Thread(target=run, name="recommender-publish", daemon=True).start()
+
+
+def publishing():
+    """Whether this process still has publishes queued or running."""
+    return _pending_publishes > 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish the recommender bundle to shared memory.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    publish_parser = subparsers.add_parser("publish", help="Copy the current bundle into the shared directory")
+    publish_parser.add_argument("--bundle", default=DEFAULT_BUNDLE_DIR)
+    publish_parser.add_argument("--out", default=SHARED_DIR)
+    args = parser.parse_args(argv)
+
+    if not args.out:
+        parser.error("no shared directory: set RECOMMENDER_SHARED_DIR or pass --out")
+    start = time.perf_counter()
+    key = source_key(args.bundle)
+    model = attach(lambda: load_bundle(args.bundle), key, args.out)
+    print(f"Published recommender {model.bundle_version} to {os.path.join(args.out, key)} "
+          f"in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
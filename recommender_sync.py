@@ -0,0 +1,367 @@
+"""Keeps the recommender in step with the ``MenuItem`` table.
+
+The admin blueprint calls :func:`item_saved` / :func:`item_deleted` after each
+commit.  They patch a copy of the live model (see
+``RecommenderModel.upserted``) and swap it in through the registry instead of
+refitting.  A full refit from the
+database runs in a background thread only once too many unknown terms have
+piled up (vocabulary drift) or too many rows are deleted.
+
+Only the worker that served the admin request sees an edit immediately; the
+other workers pick it up through :func:`sync_with_database`, which diffs the
+table against the model every ``RECOMMENDER_SYNC_INTERVAL`` seconds.  Every
+applied change also empties the worker's response cache (response_cache.py)
+and is mirrored into the search index (search_index.py).
+
+When the model lives in shared memory (recommender_shared.py), admin edits,
+refits and any change a worker picked up from the database are published as a
+new shared version, and every worker switches to the newest published
+version on its next request.  Patched models hold private copies of the
+arrays; following the published version maps the shared pages again.
+
+New models reach the live registry (model_registry.py) without a restart:
+refits, published shared versions, a rebuilt on-disk bundle
+(``python recommender_artifacts.py build``) and :func:`reload_model` (the
+admin "reload" button) are all loaded in the background, smoke-tested and
+swapped in atomically.  A loaded bundle knows nothing of the database, so
+before the swap it is brought up to date with the same diff
+:func:`sync_with_database` uses (:func:`reconcile`); edits made while it
+loaded are replayed by the registry.
+"""
+import os
+import threading
+import time
+
+import pandas as pd
+
+import menu_recommender
+import recommender_shared
+import response_cache
+import search_index
+from extensions import db
+from models import MenuItem, OrderItemNew
+from recommender_artifacts import current_version, load_bundle
+from recommender_model import MENU_COLUMNS, RecommenderModel
+
+REFIT_DRIFT_THRESHOLD = float(os.environ.get("RECOMMENDER_REFIT_DRIFT", "0.05"))
+REFIT_INACTIVE_THRESHOLD = float(os.environ.get("RECOMMENDER_REFIT_INACTIVE", "0.2"))
+SYNC_INTERVAL = float(os.environ.get("RECOMMENDER_SYNC_INTERVAL", "60"))
+# Beyond this many changed rows (e.g. a bulk import) a refit beats patching row by row
+SYNC_MAX_PATCHES = int(os.environ.get("RECOMMENDER_SYNC_MAX_PATCHES", "200"))
+
+registry = menu_recommender.registry
+# Also held by every swap, so edits never race a model replacement
+_lock = registry.lock
+# The app whose database background loads are reconciled with (set by init_app)
+_app = None
+_refit_thread = None
+_sync_thread = None
+_last_shared_check = 0.0
+# Newest on-disk bundle version already picked up (or tried)
+_last_bundle_seen = None
+
+
+def load_menu_frame():
+    """All menu items as a DataFrame in the ``menu_items.csv`` schema."""
+    columns = [getattr(MenuItem, column) for column in MENU_COLUMNS]
+    with db.engine.connect() as connection:
+        frame = pd.read_sql(db.select(*columns), connection)
+    return _normalise_frame(frame)
+
+
+def order_counts():
+    """Number of order lines per ``menu_items_id``, used to rank popular items."""
+    rows = db.session.query(OrderItemNew.menu_item_id, db.func.count(OrderItemNew.id)) \
+        .group_by(OrderItemNew.menu_item_id).all()
+    return {int(item_id): count for item_id, count in rows}
+
+
+def _normalise_frame(frame):
+    frame["price"] = frame["price"].astype(float)
+    frame["rating"] = frame["rating"].astype(float)
+    frame["is_ready_to_serve"] = frame["is_ready_to_serve"].fillna(0).astype(int)
+    return frame
+
+
+def item_record(item):
+    """A ``MenuItem`` as a plain dict in the ``menu_items.csv`` schema."""
+    record = {column: getattr(item, column) for column in MENU_COLUMNS}
+    record["price"] = float(record["price"]) if record["price"] is not None else None
+    record["rating"] = float(record["rating"]) if record["rating"] is not None else None
+    record["is_ready_to_serve"] = int(bool(record["is_ready_to_serve"]))
+    return record
+
+
+def _signature(values):
+    signature = []
+    for value in values:
+        if value is None or (isinstance(value, float) and pd.isna(value)):
+            signature.append(None)
+        elif isinstance(value, float):
+            signature.append(round(value, 4))
+        else:
+            signature.append(str(value))
+    return tuple(signature)
+
+
+# ----- Applying events -----
+
+def apply_event(model, event, payload):
+    """``model`` with one event applied, as a new model."""
+    if event == "upsert":
+        return model.upserted(payload)
+    return model.deleted(payload)
+
+
+def diff_events(model, frame):
+    """``("upsert", record)`` / ``("delete", item_id)`` events that turn ``model`` into ``frame``."""
+    menu_df = model.menu_df
+    current = {
+        int(item_id): _signature(menu_df.loc[row, MENU_COLUMNS].tolist())
+        for item_id, row in list(model.row_by_id.items())
+    }
+    events = []
+    for record in frame[MENU_COLUMNS].to_dict(orient="records"):
+        item_id = int(record["menu_items_id"])
+        if current.pop(item_id, None) != _signature([record[column] for column in MENU_COLUMNS]):
+            events.append(("upsert", record))
+    events.extend(("delete", item_id) for item_id in current)
+    return events
+
+
+def _apply(event, payload):
+    with _lock:
+        # Replayed by the registry on any model still loading
+        registry.edit(lambda model: apply_event(model, event, payload))
+        search_index.index.apply(event, payload)
+    response_cache.invalidate()
+
+
+def _publish():
+    if recommender_shared.attached():
+        recommender_shared.publish_in_background(lambda: registry.current)
+
+
+def _maybe_schedule_refit(app):
+    model = registry.current
+    if model.vocabulary_drift > REFIT_DRIFT_THRESHOLD or model.inactive_ratio > REFIT_INACTIVE_THRESHOLD:
+        schedule_refit(app)
+
+
+def item_saved(item, app=None):
+    """Add or update ``item`` in the live recommender."""
+    try:
+        _apply("upsert", item_record(item))
+        _publish()
+        _maybe_schedule_refit(app)
+    except Exception as e:
+        print("Error updating recommender for menu item", item.menu_items_id, e)
+
+
+def item_deleted(item_id, app=None):
+    """Remove ``item_id`` from the live recommender."""
+    try:
+        _apply("delete", int(item_id))
+        _publish()
+        _maybe_schedule_refit(app)
+    except Exception as e:
+        print("Error removing menu item", item_id, "from recommender:", e)
+
+
+def _drop_cached_responses(model):
+    response_cache.invalidate()
+
+
+# Responses built from the old model are never served again
+registry.subscribe(_drop_cached_responses)
+
+
+def _refitting():
+    return _refit_thread is not None and _refit_thread.is_alive()
+
+
+# ----- Loading new versions -----
+
+def fit_from_database():
+    """A model fitted from the ``MenuItem`` table (needs an app context)."""
+    frame = load_menu_frame()
+    frame["popularity"] = frame["menu_items_id"].map(order_counts()).fillna(0).astype(int)
+    return RecommenderModel.fit(frame)
+
+
+def reconcile(model):
+    """``(model, changes)``: ``model`` plus the database changes it lacks.
+
+    A bundle written before recent admin edits would otherwise serve without
+    them until the next :func:`sync_with_database` pass.  Too many changes
+    (e.g. a bulk import since the bundle was built) fit from the database
+    instead.
+    """
+    if _app is None:
+        return model, 0
+    with _app.app_context():
+        frame = load_menu_frame()
+        if frame.empty:
+            return model, 0
+        events = diff_events(model, frame)
+        if len(events) > SYNC_MAX_PATCHES:
+            return fit_from_database(), len(events)
+        for event, payload in events:
+            model = apply_event(model, event, payload)
+        return model.with_popularity(order_counts()), len(events)
+
+
+def _load_in_background(loader, source):
+    """Load ``loader()`` off the request path, reconciled with the database."""
+    changes = []
+
+    def load():
+        model, applied = reconcile(loader())
+        changes.append(applied)
+        return model
+
+    def share(model):
+        # Patched after loading: publish it, so workers map one copy again
+        if changes and changes[0]:
+            _publish()
+
+    return registry.load_in_background(load, source, on_loaded=share)
+
+
+def follow_shared_model():
+    """Switch to the newest shared version if another process published one."""
+    if not recommender_shared.attached() or recommender_shared.publishing():
+        # Our own publish is on its way; following now could drop newer edits
+        return False
+    version = recommender_shared.shared_version()
+    if version is None or version == registry.current.bundle_version or _refitting():
+        return False
+    return _load_in_background(lambda: load_bundle(recommender_shared.segment, version), f"shared {version}")
+
+
+def follow_bundle():
+    """Load the on-disk bundle if it was rebuilt after the live model was fitted."""
+    global _last_bundle_seen
+    try:
+        version = current_version()
+    except FileNotFoundError:
+        return False
+    if version == _last_bundle_seen or _refitting():
+        return False
+    _last_bundle_seen = version
+    # Bundle versions start with the fit timestamp; a newer refit wins
+    if version.split(".")[0] <= registry.current.version:
+        return False
+    # load_model() republishes to the shared directory (once, under its lock)
+    return _load_in_background(menu_recommender.load_model, f"bundle {version}")
+
+
+def reload_model():
+    """Reload the on-disk bundle (or the CSV) in the background and swap it in."""
+    return _load_in_background(menu_recommender.load_model, "reload")
+
+
+# ----- Full refit -----
+
+def _refit(app):
+    global _refit_thread
+    try:
+        with app.app_context():
+            # Edits made during the fit are replayed by the registry
+            model = registry.load(fit_from_database, "database refit")
+        if recommender_shared.attached():
+            recommender_shared.publish(model)
+        print(f"Recommender refitted from database ({int(model.active.sum())} items, version {model.version})")
+    except Exception as e:
+        registry.last_error = f"database refit: {e}"
+        print("Recommender refit failed:", e)
+    finally:
+        with _lock:
+            _refit_thread = None
+
+
+def schedule_refit(app):
+    """Refit from the database in the background (no-op if one is running)."""
+    global _refit_thread
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+    with _lock:
+        if _refit_thread is not None and _refit_thread.is_alive():
+            return
+        _refit_thread = threading.Thread(target=_refit, args=(app,), name="recommender-refit", daemon=True)
+        _refit_thread.start()
+
+
+# ----- Reconciling with the database -----
+
+def sync_with_database():
+    """Apply every difference between the ``MenuItem`` table and the model."""
+    frame = load_menu_frame()
+    if frame.empty:
+        # Fresh database: keep serving the bundled/CSV model
+        return 0
+
+    events = diff_events(registry.current, frame)
+    if len(events) > SYNC_MAX_PATCHES:
+        schedule_refit(None)
+        return len(events)
+    for event, payload in events:
+        _apply(event, payload)
+    changes = len(events)
+    if changes:
+        # Other workers patched the same changes privately; one shared copy again
+        _publish()
+
+    counts = order_counts()
+    model = registry.current
+    if registry.edit(lambda current: current.with_popularity(counts)) is not model:
+        response_cache.invalidate()
+    return changes
+
+
+def _sync_loop(app):
+    while True:
+        time.sleep(SYNC_INTERVAL)
+        try:
+            with app.app_context():
+                if sync_with_database():
+                    _maybe_schedule_refit(app)
+        except Exception as e:
+            print("Recommender sync failed:", e)
+
+
+def init_app(app):
+    """Switch the recommender's source to the database and keep it in sync."""
+    global _app
+    _app = app
+    with app.app_context():
+        try:
+            sync_with_database()
+            _maybe_schedule_refit(app)
+        except Exception as e:
+            print("Initial recommender sync failed:", e)
+
+    @app.before_request
+    def _follow_new_models():
+        global _last_shared_check
+        now = time.monotonic()
+        if now - _last_shared_check < recommender_shared.POLL_INTERVAL or registry.loading():
+            return
+        _last_shared_check = now
+        try:
+            follow_bundle() or follow_shared_model()
+        except Exception as e:
+            print("Switching to a new recommender failed:", e)
+
+    @app.before_request
+    def _start_recommender_sync():
+        # Started lazily so it runs in each (forked) worker process
+        global _sync_thread
+        if SYNC_INTERVAL <= 0 or _sync_thread is not None:
+            return
+        with _lock:
+            if _sync_thread is None:
+                _sync_thread = threading.Thread(target=_sync_loop, args=(app,), name="recommender-sync",
+                                                daemon=True)
+                _sync_thread.start()
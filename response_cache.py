@@ -0,0 +1,115 @@
+"""Bounded LRU cache of rendered JSON responses, served with ETags.
+
+Responses that are the same for every user (recommendations for an item in
+the current weather, the item detail API) are rendered once per key and kept
+as bytes with a strong ETag.  A request carrying a matching
+``If-None-Match`` gets an empty ``304 Not Modified``, so browsers and the CDN
+revalidate instead of downloading the body again.
+
+Callers put everything the body depends on into the key, including the
+recommender's ``version`` and ``revision``: any model or menu change moves
+requests to new keys, and the old entries age out of the LRU.
+:func:`invalidate` drops everything at once (called by recommender_sync.py).
+
+``RESPONSE_CACHE_MAX_ENTRIES`` and ``RESPONSE_CACHE_MAX_BYTES`` bound the
+memory per worker; ``RESPONSE_CACHE_MAX_AGE`` (seconds, default 0 = always
+revalidate) sets ``Cache-Control``.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+
+MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+MAX_AGE = int(os.environ.get("RESPONSE_CACHE_MAX_AGE", "0"))
+
+
+class CachedResponse:
+    __slots__ = ("body", "mimetype", "etag")
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+
+    def to_response(self):
+        """The cached body, or ``304`` if the client already has this ETag."""
+        if request.if_none_match.contains(self.etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(self.body, mimetype=self.mimetype)
+        response.set_etag(self.etag)
+        response.headers["Cache-Control"] = f"public, max-age={MAX_AGE}" if MAX_AGE > 0 else "public, no-cache"
+        return response
+
+
+class ResponseCache:
+    """Thread-safe LRU of :class:`CachedResponse`, bounded by count and bytes."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype="application/json"):
+        entry = CachedResponse(body, mimetype)
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(key, build):
+    """Serve ``key`` from the cache, rendering it with ``build()`` on a miss.
+
+    ``build`` returns anything a view may return; only ``200`` responses
+    are cached.
+    """
+    entry = response_cache.get(key)
+    if entry is None:
+        response = current_app.make_response(build())
+        if response.status_code != 200:
+            return response
+        entry = response_cache.put(key, response.get_data(), response.mimetype)
+    return entry.to_response()
+
+
+def invalidate():
+    """Forget every cached response (the menu or the model changed)."""
+    response_cache.clear()
@@ -0,0 +1,216 @@
+"""In-process index for search-as-you-type (``/api/search``).
+
+The endpoint used to run ``ILIKE '%q%'`` on every keystroke, which no
+database index can serve.  :class:`SearchIndex` keeps the menu in memory
+instead:
+
+* word postings for recipe names and cleaned ingredients; name words
+  weigh more than ingredient words
+* a sorted vocabulary, so a partly typed word matches by prefix (bisect)
+* trigram postings over the vocabulary, so a misspelled word still finds
+  words with a close trigram overlap (Dice coefficient)
+
+Items are ranked first by how many query words they match, then by how
+well they match (exact > prefix > fuzzy), a bonus when the name starts with
+the query, and then by rating.  Results are cached per query in a small LRU
+that every change empties.
+
+The index mirrors the live recommender (model_registry.py): it is built from
+the current model on first use and rebuilt on every swap, and
+recommender_sync.py patches it on every menu edit (:meth:`SearchIndex.apply`).
+No query touches the database.
+"""
+import bisect
+import os
+import re
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+import menu_recommender
+
+CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "512"))
+NAME_WEIGHT = 1.0
+INGREDIENT_WEIGHT = 0.4
+EXACT, PREFIX, FUZZY = 1.0, 0.8, 0.6
+MIN_FUZZY_SIMILARITY = 0.6
+# Words a one- or two-letter prefix may expand to
+MAX_PREFIX_EXPANSIONS = 64
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    if text is None or (isinstance(text, float) and np.isnan(text)):
+        return []
+    return _WORD.findall(str(text).casefold())
+
+
+def trigrams(word):
+    padded = f"${word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._model = None
+        self._reset()
+
+    def _reset(self):
+        self._items = {}                     # menu_items_id -> (name, price, rating, words)
+        self._postings = defaultdict(dict)   # word -> {menu_items_id: field weight}
+        self._vocabulary = []                # sorted words, for prefix lookups
+        self._trigrams = defaultdict(set)    # trigram -> words
+
+    # ----- Building -----
+
+    def rebuild(self, model):
+        """Index every active item of ``model`` (a :class:`RecommenderModel`)."""
+        menu_df = model.menu_df
+        records = menu_df.loc[np.asarray(model.active, dtype=bool),
+                              ["menu_items_id", "recipe_name", "cleaned_ingredients", "price", "rating"]]
+        with self._lock:
+            self._reset()
+            for record in records.to_dict(orient="records"):
+                self._add(record)
+            self._vocabulary = sorted(self._postings)
+            self._model = model
+            self._cache.clear()
+
+    def apply(self, event, payload):
+        """Mirror one recommender_sync event: ``("upsert", record)`` or ``("delete", item_id)``."""
+        with self._lock:
+            if self._model is None:
+                # Not built yet; the first search builds from the edited model
+                return
+            if event == "upsert":
+                self._remove(int(payload["menu_items_id"]))
+                self._add(payload, insert_words=True)
+            else:
+                self._remove(int(payload))
+            self._cache.clear()
+
+    def _add(self, record, insert_words=False):
+        item_id = int(record["menu_items_id"])
+        name = record["recipe_name"]
+        weights = {}
+        for word in tokenize(record.get("cleaned_ingredients")):
+            weights[word] = INGREDIENT_WEIGHT
+        for word in tokenize(name):
+            weights[word] = NAME_WEIGHT
+        for word, weight in weights.items():
+            if word not in self._postings:
+                for gram in trigrams(word):
+                    self._trigrams[gram].add(word)
+                if insert_words:
+                    bisect.insort(self._vocabulary, word)
+            self._postings[word][item_id] = weight
+        price = record.get("price")
+        rating = record.get("rating")
+        self._items[item_id] = (
+            str(name),
+            None if price is None or price != price else float(price),
+            0.0 if rating is None or rating != rating else float(rating),
+            tuple(weights),
+        )
+
+    def _remove(self, item_id):
+        item = self._items.pop(item_id, None)
+        if item is None:
+            return
+        for word in item[3]:
+            postings = self._postings[word]
+            postings.pop(item_id, None)
+            if not postings:
+                del self._postings[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+                for gram in trigrams(word):
+                    self._trigrams[gram].discard(word)
+
+    def _ensure_built(self):
+        model = menu_recommender.registry.current
+        if self._model is None and model is not None:
+            self.rebuild(model)
+
+    # ----- Querying -----
+
+    def _matches(self, token):
+        """``{word: match quality}`` for one query token."""
+        matches = {}
+        if token in self._postings:
+            matches[token] = EXACT
+        start = bisect.bisect_left(self._vocabulary, token)
+        for word in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not word.startswith(token):
+                break
+            if word != token:
+                matches[word] = PREFIX * (0.5 + 0.5 * len(token) / len(word))
+        if not matches and len(token) >= 3:
+            grams = trigrams(token)
+            shared = defaultdict(int)
+            for gram in grams:
+                for word in self._trigrams.get(gram, ()):
+                    shared[word] += 1
+            for word, count in shared.items():
+                similarity = 2 * count / (len(grams) + len(word))
+                if similarity >= MIN_FUZZY_SIMILARITY:
+                    matches[word] = FUZZY * similarity
+        return matches
+
+    def _search(self, query, limit):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        matched = defaultdict(int)
+        scores = defaultdict(float)
+        for token in tokens:
+            best = {}
+            for word, quality in self._matches(token).items():
+                for item_id, weight in self._postings[word].items():
+                    score = quality * weight
+                    if score > best.get(item_id, 0.0):
+                        best[item_id] = score
+            for item_id, score in best.items():
+                matched[item_id] += 1
+                scores[item_id] += score
+
+        prefix = " ".join(tokens)
+        ranked = []
+        for item_id, score in scores.items():
+            name, price, rating, _ = self._items[item_id]
+            if prefix and name.casefold().startswith(prefix):
+                score += 0.5
+            ranked.append((-matched[item_id], -score, -rating, name, item_id))
+        ranked.sort()
+        return [
+            {"id": item_id, "name": self._items[item_id][0], "price": self._items[item_id][1]}
+            for *_, item_id in ranked[:limit]
+        ]
+
+    def search(self, query, limit=5):
+        """Up to ``limit`` items as ``{"id", "name", "price"}`` dicts, best first."""
+        key = (" ".join(tokenize(query)), limit)
+        if not key[0]:
+            return []
+        self._ensure_built()
+        with self._lock:
+            results = self._cache.get(key)
+            if results is not None:
+                self._cache.move_to_end(key)
+                return results
+            results = self._search(query, limit)
+            self._cache[key] = results
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return results
+
+
+index = SearchIndex()
+# A new model (refit, reload, shared version) may have a different menu
+menu_recommender.registry.subscribe(index.rebuild)
+
+
+def search(query, limit=5):
+    return index.search(query, limit)
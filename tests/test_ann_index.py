@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+from ann_index import ExactBackend, IvfBackend, make_backend, measure_recall
+from neighbor_index import build_neighbor_index
+
+
+@pytest.fixture
+def matrix():
+    matrix = sp.random(300, 80, density=0.1, random_state=1, format="csr", dtype=np.float32)
+    return normalize(matrix)
+
+
+def exact_top(matrix, row, k, exclude=()):
+    scores = (matrix @ matrix[row].T).toarray().ravel()
+    scores[list(exclude)] = -np.inf
+    return np.argsort(-scores, kind="stable")[:k].tolist()
+
+
+def test_exact_backend_query_and_exclude(matrix):
+    backend = ExactBackend(matrix)
+    rows, _ = backend.query(matrix[5], 6, exclude=[5])
+    assert rows.tolist() == exact_top(matrix, 5, 6, exclude=[5])
+
+
+def test_inactive_rows_are_never_returned(matrix):
+    active = np.ones(matrix.shape[0], dtype=bool)
+    active[::2] = False
+    for backend in (ExactBackend(matrix, active), IvfBackend(matrix, active, n_lists=8)):
+        rows, _ = backend.query(matrix[1], 10)
+        assert active[rows].all()
+
+
+def test_ivf_probing_every_list_is_exact(matrix):
+    backend = IvfBackend(matrix, n_lists=8)
+    for row in (0, 17, 123):
+        rows, _ = backend.query(matrix[row], 10, exclude=[row], probes=backend.n_lists)
+        assert rows.tolist() == exact_top(matrix, row, 10, exclude=[row])
+
+
+def test_ivf_neighbor_index_probing_every_list_is_exact(matrix):
+    backend = IvfBackend(matrix, n_lists=8)
+    index = backend.neighbor_index(k=5, probes=backend.n_lists)
+    exact = build_neighbor_index(matrix, k=5)
+    np.testing.assert_array_equal(index.ids, exact.ids)
+
+
+def test_ivf_recall_is_reasonable_at_the_default_probes(matrix):
+    backend = IvfBackend(matrix, n_lists=8)
+    recall = measure_recall(backend, ExactBackend(matrix), np.arange(0, 300, 10), k=10)["recall"]
+    assert recall > 0.5
+
+
+def test_edited_rows_are_found_through_the_loose_set(matrix):
+    backend = IvfBackend(matrix, n_lists=8)
+    edited = matrix.tolil()
+    edited[42] = matrix[200].toarray()
+    edited = edited.tocsr()
+    updated = backend.updated(edited, None, [42])
+
+    assert 42 in updated.loose
+    assert 42 not in updated.order
+    rows, _ = updated.query(matrix[200], 2, probes=1)
+    assert set(rows.tolist()) == {42, 200}
+
+
+def test_make_backend_switches_on_size(matrix, monkeypatch):
+    import ann_index
+    monkeypatch.setattr(ann_index, "ANN_MIN_ITEMS", 100)
+    assert make_backend(matrix[:50], name="auto").name == "exact"
+    assert make_backend(matrix, name="auto").name == "ivf"
+    with pytest.raises(ValueError):
+        make_backend(matrix, name="faiss")
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+from flask import Flask, session
+
+import cart_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        store = cart_store.SqliteCartBackend(str(tmp_path / "carts.sqlite3"))
+    else:
+        store = cart_store.MemoryCartBackend()
+    monkeypatch.setattr(cart_store, "_store", store)
+    return store
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.secret_key = "test"
+    return app
+
+
+def test_get_set_delete(store):
+    assert store.get("a") == {}
+    store.set("a", {"1": 2})
+    assert store.get("a") == {"1": 2}
+    store.delete("a")
+    assert store.get("a") == {}
+
+
+def test_expired_carts_are_gone(store, monkeypatch):
+    store.set("a", {"1": 2})
+    monkeypatch.setattr(cart_store, "CART_TTL_DAYS", -1)
+    assert store.get("a") == {}
+
+
+def test_update_deletes_emptied_carts(store):
+    store.set("a", {"1": 2})
+    assert store.update("a", lambda items: {}) == {}
+    assert store.get("a") == {}
+
+
+def test_failed_update_changes_nothing(store):
+    store.set("a", {"1": 2})
+
+    def change(items):
+        items["2"] = 1
+        raise RuntimeError("boom")
+    with pytest.raises(RuntimeError):
+        store.update("a", change)
+    assert store.get("a") == {"1": 2}
+
+
+def test_concurrent_adds_are_not_lost(store, app):
+    def add():
+        for _ in range(10):
+            with app.test_request_context():
+                session["cart_id"] = "shared"
+                cart_store.add_item(7)
+    threads = [threading.Thread(target=add) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.get("shared") == {"7": 80}
+
+
+def test_session_keeps_only_the_cart_id(store, app):
+    with app.test_request_context():
+        cart_store.add_item(3, 2)
+        cart_store.set_quantity(4, 150)
+        assert cart_store.get_cart() == {"3": 2, "4": cart_store.MAX_QUANTITY}
+        assert set(session) == {"cart_id"}
+
+        cart_store.set_quantity(3, 0)
+        assert cart_store.get_cart() == {"4": cart_store.MAX_QUANTITY}
+        cart_store.clear_cart()
+        assert cart_store.get_cart() == {}
+
+
+def test_old_cookie_carts_move_to_the_store(store, app):
+    with app.test_request_context():
+        session["cart"] = {"5": 1}
+        assert cart_store.add_item(6) == {"5": 1, "6": 1}
+        assert "cart" not in session
+        assert store.get(session["cart_id"]) == {"5": 1, "6": 1}
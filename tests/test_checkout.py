@@ -0,0 +1,131 @@
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+# The app's database modules (extensions.py, models.py) live outside this tree
+pytest.importorskip("extensions")
+pytest.importorskip("models")
+
+import checkout  # noqa: E402
+from extensions import db  # noqa: E402
+from models import MenuItem, OrderItemNew  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([
+            MenuItem(menu_items_id=1, recipe_name="Latte", price=3.5, is_ready_to_serve=True),
+            MenuItem(menu_items_id=2, recipe_name="Scone", price=2.25, is_ready_to_serve=True),
+            MenuItem(menu_items_id=3, recipe_name="Soup", price=4.0, is_ready_to_serve=False),
+        ])
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def order_lines():
+    return OrderItemNew.query.order_by(OrderItemNew.menu_item_id).all()
+
+
+def checkout_requests():
+    return db.session.execute(db.select(checkout.checkout_requests)).all()
+
+
+def test_places_order_at_database_prices(app):
+    result = checkout.place_order(7, {"1": 2, "2": 1}, "key-1", address="1 High St")
+
+    assert result["success"] and not result["replayed"]
+    assert result["total"] == 9.25
+    assert result["order_id"] >= checkout.ORDER_ID_OFFSET
+    lines = order_lines()
+    assert [(line.menu_item_id, line.quantity, line.order_id) for line in lines] == [
+        (1, 2, result["order_id"]), (2, 1, result["order_id"])]
+
+
+def test_retry_with_same_key_replays_the_stored_response(app):
+    first = checkout.place_order(7, {"1": 1}, "key-1")
+    second = checkout.place_order(7, {"1": 5}, "key-1")
+
+    assert second == {**first, "replayed": True}
+    assert len(order_lines()) == 1
+
+
+def test_key_of_another_user_is_rejected(app):
+    checkout.place_order(7, {"1": 1}, "key-1")
+
+    with pytest.raises(checkout.CheckoutError) as error:
+        checkout.place_order(8, {"1": 1}, "key-1")
+    assert error.value.status == 409
+
+
+def test_failed_checkout_rolls_back_everything_including_the_key(app):
+    with pytest.raises(checkout.CheckoutError) as error:
+        checkout.place_order(7, {"1": 1, "3": 1}, "key-1")
+    assert error.value.status == 409
+    assert error.value.details == {"unavailable": [3]}
+    assert order_lines() == [] and checkout_requests() == []
+
+    # The corrected cart goes through with the same key
+    result = checkout.place_order(7, {"1": 1}, "key-1")
+    assert not result["replayed"] and len(order_lines()) == 1
+
+
+def test_concurrent_request_with_same_key_replays_the_winner(app, monkeypatch):
+    winner = checkout.place_order(7, {"1": 1}, "key-1")
+
+    # The loser looked the key up before the winner committed, then lost the insert
+    stored_response = checkout._stored_response
+    lookups = []
+
+    def racing_lookup(key, user_id):
+        lookups.append(key)
+        return None if len(lookups) == 1 else stored_response(key, user_id)
+    monkeypatch.setattr(checkout, "_stored_response", racing_lookup)
+
+    loser = checkout.place_order(7, {"1": 1}, "key-1")
+    assert loser == {**winner, "replayed": True}
+    assert len(lookups) == 2
+    assert len(order_lines()) == 1 and len(checkout_requests()) == 1
+
+
+def test_changed_prices_stop_the_checkout(app):
+    with pytest.raises(checkout.CheckoutError) as error:
+        checkout.place_order(7, {"1": 2}, "key-1", expected_total="6.00")
+    assert error.value.status == 409
+    assert error.value.details == {"total": 7.0}
+    assert order_lines() == [] and checkout_requests() == []
+
+    result = checkout.place_order(7, {"1": 2}, "key-1", expected_total=7)
+    assert result["total"] == 7.0
+
+
+@pytest.mark.parametrize("key", [None, "", 123, ["key"], "k" * (checkout.MAX_KEY_LENGTH + 1)])
+def test_invalid_idempotency_key_is_a_client_error(app, key):
+    with pytest.raises(checkout.CheckoutError) as error:
+        checkout.place_order(7, {"1": 1}, key)
+    assert error.value.status == 400
+
+
+@pytest.mark.parametrize("expected_total", ["abc", "NaN", "Infinity", True, [1]])
+def test_invalid_expected_total_is_a_client_error(app, expected_total):
+    with pytest.raises(checkout.CheckoutError) as error:
+        checkout.place_order(7, {"1": 1}, "key-1", expected_total=expected_total)
+    assert error.value.status == 400
+    assert checkout_requests() == []
+
+
+def test_order_id_taken_by_another_order_fails_the_checkout(app):
+    db.session.add(OrderItemNew(user_id=9, menu_item_id=2, quantity=1, price=2.25, order_date=datetime.now(),
+                                order_id=checkout.ORDER_ID_OFFSET + 1))
+    db.session.commit()
+
+    with pytest.raises(RuntimeError):
+        checkout.place_order(7, {"1": 1}, "key-1")
+    assert len(order_lines()) == 1 and checkout_requests() == []
@@ -0,0 +1,50 @@
+import numpy as np
+import scipy.sparse as sp
+
+from collaborative_filtering import CFModel, _solve_side, train_als
+
+
+def interactions():
+    # Users 0-3 order items 0-2, users 4-7 order items 3-5; user 3 hasn't tried item 2
+    dense = np.zeros((8, 6), dtype=np.float32)
+    dense[:4, :3] = 2
+    dense[4:, 3:] = 2
+    dense[3, 2] = 0
+    return sp.csr_matrix(dense)
+
+
+def test_batched_solve_matches_one_solve_per_row():
+    matrix = sp.random(30, 12, density=0.3, random_state=2, format="csr", dtype=np.float32)
+    fixed = np.random.default_rng(0).standard_normal((12, 4)).astype(np.float32)
+
+    expected = np.zeros((30, 4), dtype=np.float32)
+    for row in range(30):
+        items = matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]
+        confidence = 15.0 * matrix.data[matrix.indptr[row]:matrix.indptr[row + 1]]
+        if len(items):
+            lhs = fixed.T @ fixed + 0.1 * np.eye(4) + (fixed[items].T * confidence) @ fixed[items]
+            expected[row] = np.linalg.solve(lhs, fixed[items].T @ (1 + confidence))
+
+    for chunk_entries in (1, 5, 10000):
+        solved = _solve_side(matrix, fixed, 0.1, 15.0, chunk_entries)
+        np.testing.assert_allclose(solved, expected, rtol=1e-3, atol=1e-4)
+
+
+def make_model():
+    matrix = interactions()
+    user_factors, item_factors = train_als(matrix, factors=4, iterations=10)
+    return CFModel(user_factors, item_factors, np.arange(100, 108), np.arange(10, 16), matrix)
+
+
+def test_recommends_what_similar_users_ordered():
+    model = make_model()
+    assert model.recommend(103, 1).tolist() == [12]
+
+
+def test_seen_items_are_excluded():
+    recommended = make_model().recommend(100, 6).tolist()
+    assert not set(recommended) & {10, 11, 12}
+
+
+def test_unknown_user_gets_popular_items():
+    assert make_model().recommend(999, 2).tolist() == [10, 11]
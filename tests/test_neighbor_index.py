@@ -0,0 +1,51 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+from neighbor_index import NeighborIndex, build_neighbor_index, neighbor_rows, top_k
+
+
+def random_matrix(n_items=60, n_features=40, seed=0):
+    matrix = sp.random(n_items, n_features, density=0.2, random_state=seed, format="csr", dtype=np.float32)
+    return normalize(matrix)
+
+
+def test_top_k_is_best_first_with_lower_index_on_ties():
+    scores = np.array([0.5, 0.9, 0.7, 0.1, 0.9], dtype=np.float32)
+    assert top_k(scores, 3).tolist() == [1, 4, 2]
+    assert top_k(scores, 10).tolist() == [1, 4, 2, 0, 3]
+    assert top_k(scores, 0).tolist() == []
+
+
+def test_index_matches_the_dense_similarity_matrix():
+    matrix = random_matrix()
+    index = build_neighbor_index(matrix, k=5, chunk_size=7)
+
+    dense = (matrix @ matrix.T).toarray()
+    np.fill_diagonal(dense, -np.inf)
+    for row in range(matrix.shape[0]):
+        expected = top_k(dense[row], 5)
+        assert index.ids[row].tolist() == expected.tolist()
+        np.testing.assert_allclose(index.scores[row], dense[row, expected], rtol=1e-5)
+
+
+def test_k_is_capped_by_the_number_of_other_items():
+    index = build_neighbor_index(random_matrix(n_items=4), k=20)
+    assert index.k == 3
+    assert build_neighbor_index(random_matrix(n_items=1), k=20).k == 0
+
+
+def test_excluded_items_are_never_neighbours():
+    matrix = random_matrix()
+    excluded = np.zeros(matrix.shape[0], dtype=bool)
+    excluded[[3, 7]] = True
+    ids, scores = neighbor_rows(matrix, np.arange(matrix.shape[0]), 5, excluded=excluded)
+    assert not np.isin(ids[np.isfinite(scores)], [3, 7]).any()
+
+
+def test_neighbors_drops_deleted_items():
+    index = NeighborIndex(np.array([[2, 1, 0]], dtype=np.int32),
+                          np.array([[0.9, 0.5, -np.inf]], dtype=np.float32))
+    ids, scores = index.neighbors(0, 3)
+    assert ids.tolist() == [2, 1]
+    assert index.neighbors(0, 2)[0].tolist() == [2, 1]
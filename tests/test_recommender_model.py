@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+from neighbor_index import neighbor_rows
+from recommender_model import RecommenderModel
+
+MENU_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "menu_items.csv")
+
+
+@pytest.fixture(scope="module")
+def model():
+    return RecommenderModel.fit_csv(MENU_CSV)
+
+
+def assert_patched_like_rebuilt(model):
+    """Neighbour scores of the active rows equal a from-scratch computation (ids may differ on ties)."""
+    rows = np.flatnonzero(model.active)
+    _, scores = neighbor_rows(model.tfidf_matrix, rows, model.neighbor_index.k, excluded=~model.active)
+    np.testing.assert_allclose(model.neighbor_index.scores[rows], scores, rtol=1e-5, atol=1e-6)
+
+
+def test_upsert_patches_neighbours_like_a_rebuild(model):
+    item = model.menu_df.iloc[0].to_dict()
+    item.update(menu_items_id=9999, recipe_name="Blueberry Pancake Stack")
+    edited = model.upserted(item)
+
+    assert edited.row_by_id[9999] == len(model.menu_df)
+    assert_patched_like_rebuilt(edited)
+
+
+def test_update_in_place_patches_neighbours_like_a_rebuild(model):
+    item = model.menu_df.iloc[5].to_dict()
+    item["cleaned_ingredients"] = "espresso milk caramel"
+    edited = model.upserted(item)
+
+    assert edited.row_by_id[int(item["menu_items_id"])] == 5
+    assert_patched_like_rebuilt(edited)
+
+
+def test_deleted_item_is_never_recommended(model):
+    item_id = int(model.menu_df["menu_items_id"].iloc[0])
+    edited = model.deleted(item_id)
+
+    assert item_id not in edited.row_by_id
+    live = np.isfinite(edited.neighbor_index.scores) & edited.active[:, None]
+    assert not (edited.neighbor_index.ids[live] == 0).any()
+    assert_patched_like_rebuilt(edited)
+    assert model.deleted(-1) is model
+
+
+def test_edits_never_change_the_served_model(model):
+    ids, version, revision = model.neighbor_index.ids.copy(), model.version, model.revision
+    edited = model.deleted(int(model.menu_df["menu_items_id"].iloc[3]))
+
+    assert edited is not model and edited.revision == revision + 1
+    np.testing.assert_array_equal(model.neighbor_index.ids, ids)
+    assert model.version == version and model.active.all()
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from search_index import SearchIndex
+
+
+@pytest.fixture
+def index():
+    menu_df = pd.DataFrame([
+        {"menu_items_id": 1, "recipe_name": "Iced Latte", "cleaned_ingredients": "espresso milk ice",
+         "price": 3.5, "rating": 4.5},
+        {"menu_items_id": 2, "recipe_name": "Caramel Latte", "cleaned_ingredients": "espresso milk caramel",
+         "price": 4.0, "rating": 4.0},
+        {"menu_items_id": 3, "recipe_name": "Lemon Tart", "cleaned_ingredients": "lemon butter flour",
+         "price": 2.5, "rating": 3.0},
+        {"menu_items_id": 4, "recipe_name": "Retired Mocha", "cleaned_ingredients": "espresso chocolate",
+         "price": 3.0, "rating": 5.0},
+    ])
+    index = SearchIndex()
+    index.rebuild(SimpleNamespace(menu_df=menu_df, active=np.array([True, True, True, False])))
+    return index
+
+
+def ids(results):
+    return [result["id"] for result in results]
+
+
+def test_exact_and_prefix_matches(index):
+    assert ids(index.search("latte")) == [1, 2]
+    assert ids(index.search("lat")) == [1, 2]
+    assert index.search("tart")[0] == {"id": 3, "name": "Lemon Tart", "price": 2.5}
+
+
+def test_names_outrank_ingredients_and_all_tokens_count(index):
+    assert ids(index.search("caramel latte")) == [2, 1]
+    assert ids(index.search("milk"))[:2] == [1, 2]
+
+
+def test_typos_match_through_trigrams(index):
+    assert ids(index.search("lemmon")) == [3]
+
+
+def test_inactive_items_and_empty_queries(index):
+    assert 4 not in ids(index.search("mocha espresso"))
+    assert index.search("  ") == []
+
+
+def test_limit(index):
+    assert len(index.search("espresso", limit=1)) == 1
+
+
+def test_edits_are_applied_incrementally(index):
+    index.apply("upsert", {"menu_items_id": 5, "recipe_name": "Matcha Latte", "cleaned_ingredients": "matcha milk",
+                           "price": 4.5, "rating": 4.8})
+    assert ids(index.search("matcha")) == [5]
+
+    index.apply("upsert", {"menu_items_id": 3, "recipe_name": "Lime Tart", "cleaned_ingredients": "lime butter",
+                           "price": 2.5, "rating": 3.0})
+    assert index.search("lemon") == []
+    assert ids(index.search("lime")) == [3]
+
+    index.apply("delete", 1)
+    assert ids(index.search("iced")) == []
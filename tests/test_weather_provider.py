@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from weather_provider import CachedWeatherProvider, StubWeatherProvider, WeatherUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingProvider(StubWeatherProvider):
+    def __init__(self, delay=0.0):
+        super().__init__()
+        self.delay = delay
+        self.down = True
+
+    def fetch(self, lat, lon):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.down:
+            raise WeatherUnavailable("upstream down")
+        return self.weather, self.temp
+
+
+def test_fresh_entries_are_served_from_cache():
+    provider = StubWeatherProvider()
+    cached = CachedWeatherProvider(provider, clock=Clock())
+    assert cached.get(16.8409, 96.1735) == ("Clear", 30.0)
+    assert cached.get(16.8411, 96.1739) == ("Clear", 30.0)
+    assert provider.calls == 1
+
+
+def test_concurrent_cold_misses_share_one_upstream_call():
+    provider = FailingProvider(delay=0.1)
+    provider.down = False
+    cached = CachedWeatherProvider(provider)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cached.get(1, 2))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert provider.calls == 1
+    assert results == [("Clear", 30.0)] * 10
+
+
+def test_failures_are_remembered_for_failure_ttl():
+    clock = Clock()
+    provider = FailingProvider()
+    cached = CachedWeatherProvider(provider, clock=clock, failure_ttl=30)
+    for _ in range(3):
+        with pytest.raises(WeatherUnavailable):
+            cached.get(1, 2)
+    assert provider.calls == 1
+
+    clock.now = 31
+    provider.down = False
+    assert cached.get(1, 2) == ("Clear", 30.0)
+    assert provider.calls == 2
+
+
+def test_expired_entry_is_served_while_upstream_is_down():
+    clock = Clock()
+    provider = FailingProvider()
+    provider.down = False
+    cached = CachedWeatherProvider(provider, ttl=10, stale_ttl=10, clock=clock)
+    cached.get(1, 2)
+
+    provider.down = True
+    clock.now = 100
+    assert cached.get(1, 2) == ("Clear", 30.0)
+    assert cached.get(1, 2) == ("Clear", 30.0)
+    assert provider.calls == 2
@@ -0,0 +1,191 @@
+"""Weather lookups for the weather-based recommendations.
+
+Weather changes on the order of minutes, but the recommendation route is hit
+hundreds of times a minute, so lookups go through a :class:`CachedWeatherProvider`:
+
+* results are cached per rounded lat/lon for ``ttl`` seconds;
+* after that they are still served for up to ``stale_ttl`` seconds while a
+  background thread refreshes them (stale-while-revalidate);
+* only a cold (or fully expired) cache blocks on the upstream call, which
+  uses a pooled ``requests.Session`` and a strict timeout.  Concurrent misses
+  for the same key share that one call instead of stampeding upstream;
+* a failed blocking call is remembered for ``failure_ttl`` seconds
+  (``WEATHER_FAILURE_TTL``, 30 by default).  Until then the key fails at
+  once, or serves its expired entry, so an outage doesn't hold every
+  request for the full timeout; ``current_weather`` answers
+  ``(None, None)`` straight away.
+
+Set ``WEATHER_PROVIDER=stub`` (optionally with ``WEATHER_STUB_CONDITION`` and
+``WEATHER_STUB_TEMP``) to run fully offline.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+OPENWEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+DEFAULT_TIMEOUT = (1.0, 2.0)  # (connect, read) seconds
+DEFAULT_TTL = 10 * 60
+DEFAULT_STALE_TTL = 60 * 60
+DEFAULT_PRECISION = 2  # ~1 km at Yangon's latitude
+DEFAULT_FAILURE_TTL = float(os.environ.get("WEATHER_FAILURE_TTL", "30"))
+
+
+class WeatherUnavailable(Exception):
+    """Raised when no weather could be fetched and nothing usable is cached."""
+
+
+class OpenWeatherProvider:
+    """Current weather from the OpenWeather API over a pooled session."""
+
+    def __init__(self, api_key, timeout=DEFAULT_TIMEOUT, pool_size=10):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def fetch(self, lat, lon):
+        params = {"lat": lat, "lon": lon, "appid": self.api_key, "units": "metric"}
+        try:
+            response = self.session.get(OPENWEATHER_URL, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+            return data["weather"][0]["main"], data["main"]["temp"]
+        except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+            raise WeatherUnavailable(f"OpenWeather lookup failed: {e}") from e
+
+
+class StubWeatherProvider:
+    """Offline provider returning fixed weather, for tests and local runs."""
+
+    def __init__(self, weather="Clear", temp=30.0):
+        self.weather = weather
+        self.temp = temp
+        self.calls = 0
+
+    def fetch(self, lat, lon):
+        self.calls += 1
+        return self.weather, self.temp
+
+
+class CachedWeatherProvider:
+    """TTL cache with stale-while-revalidate in front of another provider."""
+
+    def __init__(self, provider, ttl=DEFAULT_TTL, stale_ttl=DEFAULT_STALE_TTL,
+                 precision=DEFAULT_PRECISION, clock=time.monotonic, failure_ttl=DEFAULT_FAILURE_TTL):
+        self.provider = provider
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.precision = precision
+        self.clock = clock
+        self.failure_ttl = failure_ttl
+        self._cache = {}  # key -> (fetched_at, (weather, temp))
+        self._failed_until = {}  # key -> clock time until which upstream isn't retried
+        self._refreshing = set()
+        self._fetching = {}  # key -> Future of the blocking fetch in flight
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="weather-refresh")
+
+    def _key(self, lat, lon):
+        return round(float(lat), self.precision), round(float(lon), self.precision)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._cache[key] = (self.clock(), value)
+            self._failed_until.pop(key, None)
+
+    def _refresh(self, key):
+        try:
+            self._store(key, self.provider.fetch(*key))
+        except WeatherUnavailable as e:
+            print("Background weather refresh failed:", e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, lat, lon):
+        key = self._key(lat, lon)
+        now = self.clock()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                age = now - entry[0]
+                if age < self.ttl:
+                    return entry[1]
+                if age < self.ttl + self.stale_ttl:
+                    # Serve stale and refresh once in the background
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._executor.submit(self._refresh, key)
+                    return entry[1]
+            failed_until = self._failed_until.get(key)
+            if failed_until is not None and now < failed_until:
+                # Upstream failed moments ago: don't wait on it again yet
+                if entry is not None:
+                    return entry[1]
+                raise WeatherUnavailable(f"Weather lookup failed recently; retrying in {failed_until - now:.0f}s")
+            # Only the first miss for a key calls upstream; the others wait for it
+            fetch = self._fetching.get(key)
+            first = fetch is None
+            if first:
+                fetch = self._fetching[key] = Future()
+
+        if first:
+            try:
+                value = self.provider.fetch(*key)
+            except Exception as e:
+                if isinstance(e, WeatherUnavailable):
+                    with self._lock:
+                        self._failed_until[key] = self.clock() + self.failure_ttl
+                fetch.set_exception(e)
+            else:
+                self._store(key, value)
+                fetch.set_result(value)
+            finally:
+                with self._lock:
+                    self._fetching.pop(key, None)
+        try:
+            return fetch.result()
+        except WeatherUnavailable:
+            if entry is not None:
+                return entry[1]
+            raise
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._failed_until.clear()
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def make_provider(api_key):
+    if os.environ.get("WEATHER_PROVIDER", "openweather").lower() == "stub":
+        provider = StubWeatherProvider(
+            os.environ.get("WEATHER_STUB_CONDITION", "Clear"),
+            float(os.environ.get("WEATHER_STUB_TEMP", "30")),
+        )
+    else:
+        provider = OpenWeatherProvider(api_key)
+    return CachedWeatherProvider(provider)
+
+
+def get_provider(api_key):
+    """Shared cached provider for ``api_key``, created on first use."""
+    with _providers_lock:
+        if api_key not in _providers:
+            _providers[api_key] = make_provider(api_key)
+        return _providers[api_key]
+
+
+def set_provider(api_key, provider):
+    """Install ``provider`` (e.g. a cached stub) for ``api_key``."""
+    with _providers_lock:
+        _providers[api_key] = provider